@@ -0,0 +1,17 @@
+// page served while the dashboard loads its data (see loading_layout in covid-19_dashboard.py): it asks /readyz
+// on every tick of its interval and reloads itself into the dashboard once the data is there
+(function () {
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        loading: {
+            reload_when_ready: function () {
+                fetch("readyz", {cache: "no-store"}).then(function (response) {
+                    if (response.ok) {
+                        window.location.reload();
+                    }
+                }).catch(function () {
+                });
+                return window.dash_clientside.no_update;
+            }
+        }
+    });
+})();
@@ -0,0 +1,96 @@
+// Daily / Running Total tab switching in the browser: the figures of both tabs are shipped once per selection
+// in a dcc.Store and a tab switch only picks one of them, without a request to the server
+(function () {
+    // typed arrays of the compact figures (see compactfigure.py): {"dtype": "i4", "bdata": "<base64>"}
+    var TYPED_ARRAYS = {
+        i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+        i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array
+    };
+    var decoded = new WeakMap();
+
+    function decodeArray(value) {
+        if (!value || typeof value.bdata !== "string" || !TYPED_ARRAYS[value.dtype]) {
+            return value;
+        }
+        var binary = atob(value.bdata);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return new TYPED_ARRAYS[value.dtype](bytes.buffer);
+    }
+
+    function decodeFigure(figure) {
+        if (!decoded.has(figure)) {
+            var data = (figure.data || []).map(function (trace) {
+                var copy = Object.assign({}, trace);
+                ["x", "y", "z"].forEach(function (key) {
+                    if (key in copy) {
+                        copy[key] = decodeArray(copy[key]);
+                    }
+                });
+                return copy;
+            });
+            decoded.set(figure, Object.assign({}, figure, {data: data}));
+        }
+        return decoded.get(figure);
+    }
+
+    var DAY_MS = 24 * 60 * 60 * 1000;
+
+    function dateText(ms) {
+        return new Date(ms).toISOString().slice(0, 16).replace("T", " ");
+    }
+
+    // zoom a figure on the days first to last of the data (window_figure in covid-19_dashboard.py does the same
+    // on the server): the x axis shows the window and the y axis the range of the values in it
+    function windowFigure(figure, first, last) {
+        var low = 0, high = null, x0 = null, step = 1;
+        figure.data.forEach(function (trace) {
+            // a point stands for `step` days, several with compact figures over the point budget
+            step = trace.dx ? trace.dx / DAY_MS : 1;
+            var y = trace.y || [];
+            for (var i = 0; i < y.length; i++) {
+                var day = i * step;
+                if (day + step - 1 >= first && day <= last && y[i] !== null && isFinite(y[i])) {
+                    low = Math.min(low, y[i]);
+                    high = high === null ? y[i] : Math.max(high, y[i]);
+                }
+            }
+            x0 = trace.x0 !== undefined ? trace.x0 : x0;
+        });
+        var xRange;
+        if (x0 === null) {
+            // one category per date
+            xRange = [first - 0.5, last + 0.5];
+        } else {
+            var start = Date.parse(x0.replace(" ", "T") + "Z") - (step - 1) / 2 * DAY_MS;
+            xRange = [dateText(start + (first - 0.5) * DAY_MS), dateText(start + (last + 0.5) * DAY_MS)];
+        }
+        var layout = Object.assign({}, figure.layout, {
+            xaxis: Object.assign({}, figure.layout.xaxis, {range: xRange, autorange: false})
+        });
+        if (high !== null) {
+            var pad = (high - low) * 0.05 || 1;
+            layout.yaxis = Object.assign({}, figure.layout.yaxis,
+                {range: [low < 0 ? low - pad : 0, high + pad], autorange: false});
+        }
+        return Object.assign({}, figure, {layout: layout});
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        tabs: {
+            // the figure of the selected tab, zoomed on the date window of its section unless that is all the data
+            select_figure: function (tab, figures, dateWindow, lastDay) {
+                if (!figures || !figures[tab]) {
+                    return window.dash_clientside.no_update;
+                }
+                var figure = decodeFigure(figures[tab]);
+                if (!dateWindow || (dateWindow[0] === 0 && dateWindow[1] === lastDay)) {
+                    return figure;
+                }
+                return windowFigure(figure, dateWindow[0], dateWindow[1]);
+            }
+        }
+    });
+})();
@@ -0,0 +1,84 @@
+// time-lapse of the state map (see timelapse_payload in covid-19_dashboard.py): the frames arrive once as the totals
+// of the first frame and the growth of every state from one frame to the next, they are added up here once and
+// every frame of the playback is then a row of that table
+(function () {
+    var INTEGER_ARRAYS = {i1: Int8Array, i2: Int16Array, i4: Int32Array};
+    var DAY_MS = 24 * 60 * 60 * 1000;
+    var tables = new WeakMap();
+    var requested = false;
+
+    function decodeArray(value) {
+        var binary = atob(value.bdata);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return new INTEGER_ARRAYS[value.dtype](bytes.buffer);
+    }
+
+    // running totals of every frame, one row of `base.length` states per frame
+    function frameTable(payload) {
+        if (!tables.has(payload)) {
+            var states = payload.base.length;
+            var deltas = decodeArray(payload.deltas);
+            var table = new Float64Array(payload.frames * states);
+            table.set(payload.base);
+            for (var i = states; i < table.length; i++) {
+                table[i] = table[i - states] + deltas[i - states];
+            }
+            tables.set(payload, table);
+        }
+        return tables.get(payload);
+    }
+
+    function triggered(id) {
+        return window.dash_clientside.callback_context.triggered.some(function (item) {
+            return item.prop_id.split(".")[0] === id;
+        });
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        timelapse: {
+            // the play button starts (from the first day once at the end) and pauses the interval, every tick of
+            // the interval moves the slider one frame on until the last one
+            playback: function (clicks, ticks, paused, day, lastFrame) {
+                var noUpdate = window.dash_clientside.no_update;
+                if (triggered("timelapse_play")) {
+                    if (!paused) {
+                        return [true, "Play", noUpdate];
+                    }
+                    return [false, "Pause", day >= lastFrame ? 0 : noUpdate];
+                }
+                if (day >= lastFrame) {
+                    return [true, "Play", noUpdate];
+                }
+                return [noUpdate, noUpdate, day + 1];
+            },
+            // the frames are asked for once, on the first use of the button or the slider
+            request_frames: function () {
+                if (requested) {
+                    return window.dash_clientside.no_update;
+                }
+                requested = true;
+                return true;
+            },
+            show_frame: function (frame, payload) {
+                if (!payload || frame === null || frame === undefined) {
+                    return window.dash_clientside.no_update;
+                }
+                frame = Math.min(frame, payload.frames - 1);
+                var states = payload.base.length;
+                var day = Math.min(frame * payload.step, payload.last_day);
+                var date = new Date(Date.parse(payload.first_date + "T00:00:00Z") + day * DAY_MS);
+                return {
+                    data: [Object.assign({}, payload.trace,
+                        {z: frameTable(payload).subarray(frame * states, (frame + 1) * states)})],
+                    layout: Object.assign({}, payload.layout, {
+                        title: {text: "Confirmed Cases on " + date.toISOString().slice(0, 10)},
+                        uirevision: "timelapse"
+                    })
+                };
+            }
+        }
+    });
+})();
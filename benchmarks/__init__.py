@@ -0,0 +1 @@
+# Offline benchmarks of the dashboard on generated JHU-shaped data, see `python -m benchmarks --help`
@@ -0,0 +1,38 @@
+import argparse
+import shutil
+import sys
+import tempfile
+
+from benchmarks import suite
+
+# `python -m benchmarks` generates JHU-shaped data of the given size, times the dashboard on it and compares the
+# medians with the saved baseline (benchmarks/baseline.json), exiting with 1 when a benchmark regressed.
+# --save writes the results as the new baseline
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="python -m benchmarks")
+    args.add_argument("--counties", type=int, default=3000, help="number of county rows of the generated data")
+    args.add_argument("--days", type=int, default=1143, help="number of days of the generated data")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--repeat", type=int, default=5, help="timed calls per benchmark")
+    args.add_argument("--only", help="only run the benchmarks whose name contains this")
+    args.add_argument("--threshold", type=float, default=suite.THRESHOLD,
+                      help="slowdown over the baseline median flagged as a regression (0.25 = 25%%)")
+    args.add_argument("--baseline", default=suite.BASELINE_FILE)
+    args.add_argument("--save", action="store_true", help="save the results as the baseline")
+    args.add_argument("--workdir", help="directory for the generated data and caches, kept after the run")
+    args = args.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="covid-benchmarks-")
+    try:
+        suite.configure(workdir, args.counties, args.days, args.seed)
+        results = suite.run(args.repeat, args.only)
+        if args.save:
+            suite.write_baseline(results, args.counties, args.days, args.baseline)
+            regressions = []
+        else:
+            regressions = suite.compare(results, suite.read_baseline(args.baseline), args.counties, args.days,
+                                        args.threshold)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,116 @@
+import argparse
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks import suite
+from benchmarks.synthetic import write_county_geojson
+
+# map metric and date window of every update of a session after the state selection
+UPDATES = [("per_100k", None), ("average", None), ("average_100k", None), ("total", [0, 199]), ("total", [100, 399]),
+           ("per_100k", [100, 399]), ("average", [100, 399]), ("total", [300, 799]), ("per_100k", [300, 799]),
+           ("total", None)]
+
+
+def county_map_request(state, metric, window, changed):
+    return {"output": "county_map.figure", "outputs": {"id": "county_map", "property": "figure"},
+            "inputs": [{"id": "states_and_territories", "property": "value", "value": state},
+                       {"id": "map_metric", "property": "value", "value": metric},
+                       {"id": "state_window", "property": "value", "value": window}],
+            "state": [], "changedPropIds": [changed]}
+
+
+# function to time a response: (bytes, gzipped bytes, seconds to produce it, seconds to parse it as the browser does)
+def measure(produce):
+    start = time.perf_counter()
+    body = produce()
+    seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    json.loads(body)
+    return len(body), len(gzip.compress(body)), seconds, time.perf_counter() - start
+
+
+# function to measure a session of one state selection and the UPDATES on the county map, returns
+# {mode: [(step, measure)]}: "naive" is a county map with the original shapes in the figure, sent whole for every
+# step; "shapes once" is the dashboard's map, the simplified shapes downloaded once and only the values of the
+# counties sent for the updates
+def run(module, state, geojson):
+    import plotly.io as pio
+
+    from payloadsize import post_callback
+
+    snap = module.data
+    client = module.server.test_client()
+    with open(geojson) as f:
+        features = json.load(f)["features"]
+    rows, fips = module.map_counties(snap.confirmed_cube, state)
+    wanted = set(fips)
+    shapes = {"type": "FeatureCollection", "features": [feature for feature in features if feature["id"] in wanted]}
+
+    def naive(metric, window):
+        figure = module.county_map(snap, state, metric, *module.window_bounds(snap, window)).to_plotly_json()
+        figure["data"][0]["geojson"] = shapes
+        return pio.to_json(figure, validate=False).encode()
+
+    def callback(metric, window, changed):
+        response = post_callback(client, county_map_request(state, metric, window, changed))
+        if response.status_code != 200:
+            raise RuntimeError("county map request failed with status {}".format(response.status_code))
+        return response.get_data()
+
+    url = json.loads(callback("total", None, "states_and_territories.value"))["response"]["county_map"]["figure"][
+        "data"][0]["geojson"]
+    steps = {"naive": [("select state", measure(lambda: naive("total", None)))],
+             "shapes once": [("select state", measure(lambda: callback("total", None, "states_and_territories.value"))),
+                             ("shapes", measure(lambda: client.get(url).get_data()))]}
+    for metric, window in UPDATES:
+        label = "{} {}".format(metric, window or "all")
+        steps["naive"].append((label, measure(lambda: naive(metric, window))))
+        steps["shapes once"].append((label, measure(lambda: callback(metric, window, "map_metric.value"))))
+    return steps
+
+
+def report(steps, write=print):
+    write("{:<12} {:<28} {:>12} {:>12} {:>10} {:>10}".format("mode", "step", "bytes", "gzip bytes", "server ms",
+                                                              "parse ms"))
+    for mode, rows in steps.items():
+        for step, (size, zipped, seconds, parse) in rows:
+            write("{:<12} {:<28} {:>12,} {:>12,} {:>10.2f} {:>10.2f}".format(mode, step, size, zipped, seconds * 1000,
+                                                                          parse * 1000))
+        totals = [sum(row[1][i] for row in rows) for i in range(4)]
+        write("{:<12} {:<28} {:>12,} {:>12,} {:>10.2f} {:>10.2f}".format(mode, "session", totals[0], totals[1],
+                                                                      totals[2] * 1000, totals[3] * 1000))
+
+
+# `python -m benchmarks.countymap` measures the county map of one state over a session of a state selection and
+# ten metric and date window changes: the bytes sent (raw and gzipped), the time to answer every request and the
+# time to parse the answer, for a naive map sending the original shapes every time and for the dashboard's map.
+# The data and the county shapes are generated (or taken from --data and --geojson)
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="python -m benchmarks.countymap")
+    args.add_argument("--counties", type=int, default=3000, help="number of county rows of the generated data")
+    args.add_argument("--days", type=int, default=1143, help="number of days of the generated data")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--vertices", type=int, default=100, help="points of every generated county border")
+    args.add_argument("--data", help="directory with the JHU csv files to load instead of generated data")
+    args.add_argument("--geojson", help="county GeoJSON to use instead of generated shapes")
+    args.add_argument("--state", help="state of the map, by default the one with the most counties")
+    args = args.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="covid-countymap-")
+    try:
+        suite.configure(workdir, args.counties, args.days, args.seed, source=args.data)
+        geojson = args.geojson or write_county_geojson(os.path.join(workdir, "counties.json"), args.counties,
+                                                       args.seed, args.vertices)
+        from payloadsize import load_dashboard
+
+        module = load_dashboard("countymap_dashboard", {"COVID_COUNTY_GEOJSON": os.path.abspath(geojson)})
+        cube = module.data.confirmed_cube
+        state = args.state or max(cube.state_counties, key=lambda name: len(module.map_counties(cube, name)[1]))
+        print("county map of {}".format(state))
+        report(run(module, state, geojson))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
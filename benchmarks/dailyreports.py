@@ -0,0 +1,59 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.synthetic import write_daily_reports
+
+
+# function to ingest the daily reports into an empty store, then again with nothing new and once more after one
+# new day was published, returns [(step, seconds, files parsed, table)]
+def run(source, workdir, processes=None):
+    import dailyreports
+
+    root = os.path.join(workdir, "store")
+    names = sorted((name for name in os.listdir(source) if dailyreports.report_date(name)),
+                   key=dailyreports.report_date)
+    # the last day is held back until the one day refresh
+    held = os.path.join(workdir, names[-1])
+    shutil.move(os.path.join(source, names[-1]), held)
+    steps = []
+    for step in ["full", "unchanged", "one day"]:
+        if step == "one day":
+            shutil.move(held, os.path.join(source, names[-1]))
+        before = len(dailyreports.load_store(root).manifest)
+        start = time.perf_counter()
+        table = dailyreports.ingest(source, root, processes)
+        steps.append((step, time.perf_counter() - start, len(table.manifest) - before, table))
+    return steps
+
+
+def report(steps, write=print):
+    write("{:<12} {:>10} {:>8} {:>8} {:>8}".format("refresh", "seconds", "files", "states", "dates"))
+    for step, seconds, files, table in steps:
+        write("{:<12} {:>10.3f} {:>8} {:>8} {:>8}".format(step, seconds, files, len(table.states), len(table.dates)))
+
+
+# `python -m benchmarks.dailyreports` ingests the daily reports of the US states (see dailyreports.py) into an empty
+# store, refreshes it with no new report and refreshes it after one more day was published, and reports the
+# seconds of each. The reports are generated (or copied from --data) into a local directory standing in for the
+# JHU repository
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="python -m benchmarks.dailyreports")
+    args.add_argument("--days", type=int, default=1055, help="number of generated daily reports")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--data", help="directory with the JHU daily report csv files to use instead of generated ones")
+    args.add_argument("--processes", type=int, help="parse processes, COVID_PARSE_PROCESSES by default")
+    args = args.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="covid-dailyreports-")
+    try:
+        source = os.path.join(workdir, "reports")
+        if args.data:
+            shutil.copytree(args.data, source)
+        else:
+            write_daily_reports(source, args.days, args.seed)
+        report(run(source, workdir, args.processes))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,71 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.startup import serve_slowly
+from benchmarks.synthetic import CONFIRMED_FILE, DEATHS_FILE, GLOBAL_FILES, write_global_time_series, \
+    write_time_series
+
+
+# function to load the files one after the other and all at once into empty caches, then all at once again with the
+# snapshots of the last run, returns {mode: (seconds, {filename: result of load_dataset})}
+def run(filenames, source, workdir):
+    import datasource
+
+    runs = {}
+    for mode in ["sequential", "concurrent", "concurrent warm"]:
+        cache_dir = os.path.join(workdir, "cache-" + mode.split()[0])
+        if mode != "concurrent warm":
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        start = time.perf_counter()
+        if mode == "sequential":
+            results = {filename: datasource.load_dataset(filename, source, cache_dir) for filename in filenames}
+        else:
+            results = datasource.load_datasets(filenames, source, cache_dir)
+        runs[mode] = (time.perf_counter() - start, results)
+    return runs
+
+
+def report(runs, write=print):
+    write("{:<20} {:<44} {:>9} {:>9} {:>9}".format("mode", "file", "fetch s", "parse s", "total s"))
+    for mode, (seconds, results) in runs.items():
+        for filename, result in results.items():
+            write("{:<20} {:<44} {:>9} {:>9} {:>9.3f}{}".format(
+                mode, filename, *("-" if value is None else "{:.3f}".format(value)
+                                  for value in (result.fetch_seconds, result.parse_seconds)),
+                result.seconds, "" if result.error is None else "  FAILED: {!r}".format(result.error)))
+        write("{:<20} {:<44} {:>9} {:>9} {:>9.3f}".format(mode, "all", "", "", seconds))
+
+
+# `python -m benchmarks.ingest` loads the US and global time series with an empty cache one file after the other
+# and all at once (datasource.load_datasets), then all at once with a filled cache, and reports the seconds of
+# every file and of every run. The files are generated (or taken from --data) and read from their directory or,
+# with --delay, downloaded from a local stand-in for GitHub that answers every request after that many seconds
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="python -m benchmarks.ingest")
+    args.add_argument("--counties", type=int, default=3000, help="number of county rows of the generated US data")
+    args.add_argument("--countries", type=int, default=289, help="number of rows of the generated global data")
+    args.add_argument("--days", type=int, default=1143, help="number of days of the generated data")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--data", help="directory with the JHU csv files to load instead of generated data")
+    args.add_argument("--us-only", action="store_true", help="load the US time series only")
+    args.add_argument("--delay", type=float, default=0, help="seconds the data source takes to answer a request")
+    args = args.parse_args()
+
+    filenames = [DEATHS_FILE, CONFIRMED_FILE] + ([] if args.us_only else list(GLOBAL_FILES.values()))
+    workdir = tempfile.mkdtemp(prefix="covid-ingest-")
+    server = None
+    try:
+        source = args.data
+        if source is None:
+            source = write_time_series(os.path.join(workdir, "data"), args.counties, args.days, args.seed)
+            write_global_time_series(source, args.countries, args.days, args.seed)
+        if args.delay:
+            server, source = serve_slowly(source, args.delay)
+        report(run(filenames, source, workdir))
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
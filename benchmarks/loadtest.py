@@ -0,0 +1,310 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import numpy as np
+import us
+
+from benchmarks import suite
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# default share of each user action: a click on a state of the map, a pick in the states dropdown, a tab toggle
+MIX = {"click": 4, "dropdown": 3, "tab": 3}
+STATES = list(us.states.STATES_AND_TERRITORIES)
+
+
+# requests to the dashboard through the Flask test client of a server object, one client per thread
+class TestClientTransport:
+    def __init__(self, server):
+        self.server = server
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        if not hasattr(self.local, "client"):
+            self.local.client = self.server.test_client()
+        if method == "GET":
+            response = self.local.client.get(path)
+        else:
+            response = self.local.client.post(path, data=json.dumps(body), content_type="application/json")
+        return response.status_code, response.get_data()
+
+
+# requests to a running dashboard (e.g. a local gunicorn) over HTTP, one kept-alive connection per thread
+class HTTPTransport:
+    def __init__(self, url):
+        url = urlsplit(url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        for attempt in range(2):
+            if not hasattr(self.local, "connection"):
+                self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.local.connection.request(method, path, body=None if body is None else json.dumps(body),
+                                              headers={"Content-Type": "application/json"})
+                response = self.local.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                # the server closed the kept-alive connection, retry once on a new one
+                self.local.connection.close()
+                del self.local.connection
+                if attempt:
+                    raise
+
+
+# server callbacks of the dashboard as listed by /_dash-dependencies, and the props that only change in the browser
+class CallbackGraph:
+    def __init__(self, dependencies):
+        self.callbacks = []
+        self.tabs = set()
+        for dependency in dependencies:
+            inputs = ["{id}.{property}".format(**item) for item in dependency["inputs"]]
+            self.tabs.update(prop for prop in inputs if prop.split(".")[0].endswith("tabs"))
+            if dependency.get("clientside_function"):
+                continue
+            output = dependency["output"]
+            outputs = output.strip(".").split("...")
+            label = outputs[0] + (" (+{})".format(len(outputs) - 1) if len(outputs) > 1 else "")
+            self.callbacks.append({"output": output, "outputs": outputs, "inputs": dependency["inputs"],
+                                   "state": dependency.get("state", []), "input_props": inputs, "label": label,
+                                   "initial": not dependency.get("prevent_initial_call")})
+        self.tabs = sorted(self.tabs)
+
+    # function to get the server callbacks fired by a change of the given props
+    def triggered(self, props):
+        return [callback for callback in self.callbacks if props.intersection(callback["input_props"])]
+
+    # function to get the server callbacks the dash renderer calls when a page loads: those whose inputs are all in
+    # the layout (`components` are the ids of its components), unless they prevent their initial call
+    def initial(self, components):
+        return [callback for callback in self.callbacks if callback["initial"] and
+                all(prop.rsplit(".", 1)[0] in components for prop in callback["input_props"])]
+
+    # function to get the request body of a callback with the current prop values of a page
+    @staticmethod
+    def body(callback, values, changed):
+        outputs = [dict(zip(("id", "property"), prop.rsplit(".", 1))) for prop in callback["outputs"]]
+        return {"output": callback["output"], "outputs": outputs if callback["output"].startswith("..") else outputs[0],
+                "inputs": [dict(item, value=values.get("{id}.{property}".format(**item)))
+                           for item in callback["inputs"]],
+                "state": [dict(item, value=values.get("{id}.{property}".format(**item))) for item in callback["state"]],
+                "changedPropIds": sorted(changed.intersection(callback["input_props"]))}
+
+
+# function to get the prop values of every component of a dash layout with an id, as {"<id>.<prop>": value}
+def layout_values(layout):
+    values = {}
+    nodes = [layout]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, list):
+            nodes.extend(node)
+        elif isinstance(node, dict) and isinstance(node.get("props"), dict):
+            props = node["props"]
+            if "id" in props:
+                values.update({"{}.{}".format(props["id"], prop): value for prop, value in props.items()
+                               if prop != "children"})
+            nodes.append(props.get("children"))
+    return values
+
+
+# a simulated browser page: it applies a user action to its prop values and sends the callback requests the dash
+# renderer would send for it, following the chain of callbacks whose inputs were changed by earlier outputs
+class Page:
+    def __init__(self, transport, graph, record, rng):
+        self.transport = transport
+        self.graph = graph
+        self.record = record
+        self.rng = rng
+        self.values = {}
+
+    # the prop values start from the layout and every callback of the page load is sent once, as the renderer
+    # does: a callback reading the output of another one waits for it
+    def load(self):
+        layout = self.timed("layout", "GET", "/_dash-layout")
+        self.values = layout_values(layout) if layout is not None else {}
+        pending = self.graph.initial({prop.rsplit(".", 1)[0] for prop in self.values})
+        changed = set()
+        while pending:
+            produced = {prop for callback in pending for prop in callback["outputs"]}
+            ready = [callback for callback in pending if not produced.intersection(callback["input_props"])]
+            ready = ready or pending
+            pending = [callback for callback in pending if callback not in ready]
+            changed |= self.send(ready, changed)
+
+    def act(self, action):
+        state = self.rng.choice(STATES)
+        if action == "click":
+            changed = {"chloro_graph.clickData": {"points": [{"location": state.abbr}]}}
+        elif action == "dropdown":
+            changed = {"territories.value": state.name}
+        else:
+            tab = self.rng.choice(self.graph.tabs)
+            changed = {tab: "tab-1" if self.values.get(tab) == "tab-2" else "tab-2"}
+        self.values.update(changed)
+        self.fire(set(changed))
+
+    def fire(self, changed):
+        while changed:
+            changed = self.send(self.graph.triggered(changed), changed)
+
+    # function to send callbacks for the changed props, returns the props their outputs changed that other
+    # callbacks read
+    def send(self, callbacks, changed):
+        outputs = {}
+        for callback in callbacks:
+            response = self.timed(callback["label"], "POST", "/_dash-update-component",
+                                  self.graph.body(callback, self.values, changed))
+            if response is not None:
+                for component, props in response.get("response", {}).items():
+                    outputs.update({"{}.{}".format(component, prop): value for prop, value in props.items()})
+        # only props that other callbacks read are kept, the figures are dropped
+        changed = {prop for prop in outputs if self.graph.triggered({prop})}
+        self.values.update({prop: outputs[prop] for prop in changed})
+        return changed
+
+    def timed(self, label, method, path, body=None):
+        start = time.perf_counter()
+        try:
+            status, data = self.transport.request(method, path, body)
+        except (http.client.HTTPException, OSError):
+            status, data = None, b""
+        self.record(label, time.perf_counter() - start, status)
+        if status == 200:
+            return json.loads(data)
+        return None
+
+
+# function to run `users` simulated pages for `duration` seconds, each loading the page once and then acting
+# without pause, returns ({label: [(seconds, status)]}, number of actions, elapsed seconds)
+def run(transport, users, duration, mix, seed=0):
+    graph = CallbackGraph(json.loads(transport.request("GET", "/_dash-dependencies")[1]))
+    results = defaultdict(list)
+    lock = threading.Lock()
+    actions = [0]
+    names, weights = zip(*mix.items())
+
+    def record(label, seconds, status):
+        with lock:
+            results[label].append((seconds, status))
+
+    def user(number):
+        rng = random.Random(seed + number)
+        page = Page(transport, graph, record, rng)
+        page.load()
+        done = 0
+        while time.perf_counter() < stop:
+            page.act(rng.choices(names, weights)[0])
+            done += 1
+        with lock:
+            actions[0] += done
+
+    start = time.perf_counter()
+    stop = start + duration
+    threads = [threading.Thread(target=user, args=(number,)) for number in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, actions[0], time.perf_counter() - start
+
+
+def report(results, actions, elapsed, write=print):
+    write("{:<50} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}".format("callback output", "requests", "errors", "req/s",
+                                                             "p50 ms", "p95 ms", "p99 ms"))
+    rows = sorted(results.items()) + [("all", [sample for samples in results.values() for sample in samples])]
+    for label, samples in rows:
+        seconds = np.array([sample[0] for sample in samples]) * 1000
+        # 204 is a callback that prevented its update
+        errors = sum(1 for sample in samples if sample[1] not in (200, 204))
+        p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+        write("{:<50} {:>8} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(label, len(samples), errors,
+                                                                           len(samples) / elapsed, p50, p95, p99))
+    write("{} user actions in {:.1f} s: {:.1f} actions/s".format(actions, elapsed, actions / elapsed))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# function to start a local gunicorn serving the dashboard, returns the process and its url once it answers
+def start_gunicorn(workers, timeout=300):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "--workers", str(workers), "--bind",
+                                "127.0.0.1:{}".format(port), "covid-19_dashboard:server"], cwd=ROOT)
+    url = "http://127.0.0.1:{}".format(port)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited with status {}".format(process.returncode))
+        try:
+            if HTTPTransport(url).request("GET", "/_dash-dependencies")[0] == 200:
+                return process, url
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("gunicorn did not answer within {} s".format(timeout))
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in MIX:
+            raise argparse.ArgumentTypeError("unknown action {!r}, the actions are {}".format(name, ", ".join(MIX)))
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# `python -m benchmarks.loadtest` replays dashboard traffic (map clicks, dropdown picks, tab toggles) from concurrent
+# simulated users against the dashboard, on generated data (or the csv files of --data) so that it runs offline.
+# The dashboard runs in this process (test client), in a local gunicorn (--gunicorn WORKERS) or at --url
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="python -m benchmarks.loadtest")
+    args.add_argument("--users", type=int, default=8, help="concurrent simulated users")
+    args.add_argument("--duration", type=float, default=30, help="seconds of traffic")
+    args.add_argument("--mix", type=parse_mix, default=MIX,
+                      help="weights of the user actions, e.g. click=4,dropdown=3,tab=3")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--counties", type=int, default=3000, help="number of county rows of the generated data")
+    args.add_argument("--days", type=int, default=1143, help="number of days of the generated data")
+    args.add_argument("--data", help="directory with the JHU csv files to serve instead of generated data")
+    target = args.add_mutually_exclusive_group()
+    target.add_argument("--gunicorn", type=int, metavar="WORKERS", help="serve the dashboard with a local gunicorn")
+    target.add_argument("--url", help="url of an already running dashboard")
+    args = args.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="covid-loadtest-")
+    process = None
+    try:
+        if not args.url:
+            suite.configure(workdir, args.counties, args.days, args.seed, source=args.data)
+        if args.url:
+            transport = HTTPTransport(args.url)
+        elif args.gunicorn:
+            process, url = start_gunicorn(args.gunicorn)
+            transport = HTTPTransport(url)
+        else:
+            from payloadsize import load_dashboard
+
+            transport = TestClientTransport(load_dashboard("loadtest_dashboard", {}).server)
+        report(*run(transport, args.users, args.duration, args.mix, args.seed))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,120 @@
+import argparse
+import functools
+import http.client
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks import suite
+from benchmarks.loadtest import ROOT, free_port
+
+# seconds between two polls of the starting dashboard
+POLL = 0.01
+# part of the loading layout the dashboard serves until its data is loaded (see loading_layout)
+LOADING_MARK = b"loading_poll"
+
+
+# local stand-in for the data source answering every request after `delay` seconds, like a slow GitHub response
+class SlowHandler(SimpleHTTPRequestHandler):
+    delay = 0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+# function to serve a directory over HTTP with a delay, returns the server and its url
+def serve_slowly(directory, delay):
+    handler = type("Handler", (SlowHandler,), {"delay": delay})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+# function to get the status of a request, the seconds to its first byte and the body, None when the server does not
+# answer
+def first_byte(port, path):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        start = time.perf_counter()
+        connection.request("GET", path)
+        response = connection.getresponse()
+        seconds = time.perf_counter() - start
+        return response.status, seconds, response.read()
+    except OSError:
+        return None, None, None
+    finally:
+        connection.close()
+
+
+# function to start a gunicorn serving the dashboard and time its startup, returns [(milestone, seconds since the
+# start of the process)]: the first answer of /healthz, the first byte of the page, /readyz answering 200 and the
+# first byte of the layout with the data. The page itself is the same before and after the data loads, the data
+# comes with the layout (/_dash-layout), which is the loading notice until then
+def time_startup(workers, timeout=600):
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "--workers", str(workers), "--bind",
+                                "127.0.0.1:{}".format(port), "covid-19_dashboard:server"], cwd=ROOT,
+                               stderr=subprocess.DEVNULL)
+    milestones = []
+    try:
+        for name, path, pending in [("healthz", "/healthz", None), ("page", "/", None), ("readyz", "/readyz", None),
+                                    ("dashboard layout", "/_dash-layout", LOADING_MARK)]:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError("gunicorn exited with status {}".format(process.returncode))
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError("{} did not answer within {} s".format(path, timeout))
+                sent = time.perf_counter() - start
+                status, seconds, body = first_byte(port, path)
+                if status == 200 and (pending is None or pending not in body):
+                    milestones.append((name, sent + seconds))
+                    break
+                time.sleep(POLL)
+    finally:
+        process.terminate()
+        process.wait()
+    return milestones
+
+
+# `python -m benchmarks.startup` starts the dashboard under gunicorn on generated data and reports how long after
+# the start of the process it answers /healthz, serves the first byte of the page, reports ready on /readyz and
+# serves the layout with the data, with an empty (cold) and a filled (warm) data cache. --delay serves the data
+# from a local stand-in for GitHub that answers after that many seconds
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="python -m benchmarks.startup")
+    args.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    args.add_argument("--counties", type=int, default=3000, help="number of county rows of the generated data")
+    args.add_argument("--days", type=int, default=1143, help="number of days of the generated data")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--data", help="directory with the JHU csv files to serve instead of generated data")
+    args.add_argument("--delay", type=float, default=0, help="seconds the data source takes to answer a request")
+    args = args.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="covid-startup-")
+    source = None
+    try:
+        suite.configure(workdir, args.counties, args.days, args.seed, source=args.data)
+        if args.delay:
+            source, url = serve_slowly(os.environ["COVID_DATA_SOURCE"], args.delay)
+            os.environ["COVID_DATA_SOURCE"] = url
+        print("{:<20} {:>12} {:>12}".format("milestone", "cold s", "warm s"))
+        for directory in (os.environ["COVID_DATA_CACHE"], os.environ["COVID_FIGURE_CACHE_DIR"]):
+            shutil.rmtree(directory, ignore_errors=True)
+        cold = time_startup(args.workers)
+        warm = time_startup(args.workers)
+        for (name, cold_seconds), (_, warm_seconds) in zip(cold, warm):
+            print("{:<20} {:>12.3f} {:>12.3f}".format(name, cold_seconds, warm_seconds))
+    finally:
+        if source is not None:
+            source.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,178 @@
+import json
+import os
+import shutil
+import statistics
+import time
+
+from benchmarks.synthetic import write_county_geojson, write_time_series
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# a benchmark is flagged when its median time is this much slower than the baseline
+THRESHOLD = 0.25
+# shortest timed sample in seconds, see time_calls
+MIN_SAMPLE = 0.05
+# state used by the state transforms
+STATE = "Texas"
+
+
+# function to point the dashboard at generated data and county shapes in a work directory (or at the csv files in
+# `source`), so that it runs offline. It must run before the dashboard modules are imported as they read their
+# settings on import
+def configure(workdir, counties, days, seed, source=None):
+    if source is None:
+        source = write_time_series(os.path.join(workdir, "data"), counties, days, seed)
+    geojson = write_county_geojson(os.path.join(workdir, "counties.json"), counties, seed)
+    os.environ.update(COVID_DATA_SOURCE=os.path.abspath(source), COVID_DATA_CACHE=os.path.join(workdir, "cache"),
+                      COVID_COUNTY_GEOJSON=os.path.abspath(geojson),
+                      COVID_FIGURE_CACHE_DIR=os.path.join(workdir, "figures"), COVID_SHARED_DATA_DIR="",
+                      COVID_REFRESH_INTERVAL="0", COVID_FIGURE_WARMUP="0")
+
+
+# function to time `repeat` samples of function, returns the seconds per call of every sample. setup runs before
+# every sample and is not timed; without setup a fast function is called in a loop of MIN_SAMPLE seconds per sample
+def time_calls(function, repeat, setup=None):
+    loops = 1
+    if setup is None:
+        start = time.perf_counter()
+        function()
+        loops = max(1, int(MIN_SAMPLE / max(time.perf_counter() - start, 1e-9)))
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        times.append((time.perf_counter() - start) / loops)
+    return times
+
+
+# function to empty the figure cache of a dashboard, so that its figures are rendered again
+def clear_figures(module):
+    with module.figure_cache.lock:
+        module.figure_cache.figures.clear()
+    shutil.rmtree(module.figure_cache.directory, ignore_errors=True)
+
+
+# function to list the benchmarks as (name, function, setup): the startup of the dashboard module with an empty and
+# with a filled data cache, the pipeline steps, every transform function and every server callback
+def benchmarks():
+    import datasource
+    from datacube import CountyCube
+    from payloadsize import callback_requests, load_dashboard, post_callback
+
+    def clear_data_cache():
+        shutil.rmtree(datasource.CACHE_DIR, ignore_errors=True)
+        shutil.rmtree(os.environ["COVID_FIGURE_CACHE_DIR"], ignore_errors=True)
+
+    modules = []
+
+    def start():
+        modules[:] = [load_dashboard("benchmark_dashboard", {})]
+
+    yield "startup.cold", start, clear_data_cache
+    yield "startup.warm", start, None
+    if not modules:
+        start()
+    m = modules[0]
+    snap = m.data
+    deaths, confirmed = snap.deaths_cube, snap.confirmed_cube
+    confirmed_csv = os.path.join(datasource.DATA_SOURCE, datasource.CONFIRMED_FILE)
+    confirmed_frame = datasource.read_csv(confirmed_csv)
+    deaths_frame = datasource.read_csv(os.path.join(datasource.DATA_SOURCE, datasource.DEATHS_FILE))
+    previous = []
+    frames = []
+
+    # the data of the day before, which a refresh extends by the last day
+    def load_previous():
+        clear_figures(m)
+        previous[:] = [m.load_data(deaths_frame.iloc[:, :-1], confirmed_frame.iloc[:, :-1])]
+
+    # new frame objects, so that the full load does not find the cubes of the last one (see datacube.cube_for)
+    def new_frames():
+        clear_figures(m)
+        frames[:] = [deaths_frame.copy(), confirmed_frame.copy()]
+
+    yield "pipeline.read_csv", lambda: datasource.read_csv(confirmed_csv), None
+    yield "pipeline.cube", lambda: CountyCube(confirmed_frame), None
+    yield "pipeline.derive_data", lambda: m.derive_data(deaths, confirmed, snap.state_max_deaths,
+                                                        snap.state_max_confirmed), lambda: clear_figures(m)
+    # a refresh after one more day of data against the full load it replaces
+    yield "pipeline.load_data", lambda: m.load_data(*frames), new_frames
+    yield ("pipeline.refresh_one_day", lambda: m.extend_data(previous[0], deaths_frame, confirmed_frame),
+           load_previous)
+    yield "pipeline.summarize_states", lambda: m.summarize_states(snap.cplt_data, deaths, confirmed,
+                                                                  snap.fig_date), None
+
+    yield "transform.get_US_daily_deaths", lambda: m.get_US_daily_deaths(deaths), None
+    yield "transform.get_US_daily_confirmed_cases", lambda: m.get_US_daily_confirmed_cases(confirmed), None
+    yield "transform.get_US_deaths", lambda: m.get_US_deaths(deaths), None
+    yield "transform.get_US_confirmed_cases", lambda: m.get_US_confirmed_cases(confirmed), None
+    for name, function, cube in [("confirmed_cases", m.get_US_state_confirmed_cases, confirmed),
+                                 ("deaths", m.get_US_state_deaths, deaths)]:
+        yield "transform.get_US_state_{}".format(name), lambda f=function, c=cube: f(STATE, c), None
+        yield "transform.get_US_state_{}.counties".format(name), lambda f=function, c=cube: f(STATE, c, "C"), None
+        yield "transform.get_US_state_{}.US".format(name), lambda f=function, c=cube: f("US", c), None
+        yield "transform.get_US_state_{}.US.counties".format(name), lambda f=function, c=cube: f("US", c, "C"), None
+    yield ("transform.get_US_state_daily_confirmed_cases",
+           lambda: m.get_US_state_daily_confirmed_cases(STATE, confirmed), None)
+    yield "transform.get_US_state_daily_deaths", lambda: m.get_US_state_daily_deaths(STATE, deaths), None
+
+    client = m.server.test_client()
+    for label, body in callback_requests(client):
+        response = post_callback(client, body)
+        if response.status_code != 200:
+            raise RuntimeError("callback {} failed with status {}".format(label, response.status_code))
+        # first request for a state after a data load (nothing cached) and a repeated request
+        yield "callback." + label, lambda b=body: post_callback(client, b), lambda: clear_figures(m)
+        yield "callback.{}.cached".format(label), lambda b=body: post_callback(client, b), None
+
+
+# function to run the benchmarks whose name contains `only`, returns {name: (median, min)} in seconds
+def run(repeat, only=None, report=print):
+    results = {}
+    for name, function, setup in benchmarks():
+        if only and only not in name:
+            continue
+        times = time_calls(function, repeat, setup)
+        results[name] = (statistics.median(times), min(times))
+        report("{:<60} {:>10.2f} ms".format(name, results[name][0] * 1000))
+    return results
+
+
+def read_baseline(path=BASELINE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_baseline(results, counties, days, path=BASELINE_FILE):
+    baseline = {"counties": counties, "days": days,
+                "medians": {name: round(median, 6) for name, (median, _) in sorted(results.items())}}
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+        f.write("\n")
+
+
+# function to compare the results with a baseline of the same data size, returns the names of the benchmarks whose
+# median is more than `threshold` slower than their baseline
+def compare(results, baseline, counties, days, threshold=THRESHOLD, report=print):
+    if baseline is None or (baseline["counties"], baseline["days"]) != (counties, days):
+        report("no baseline for {} counties x {} days".format(counties, days))
+        return []
+    regressions = []
+    report("{:<60} {:>10} {:>10} {:>8}".format("benchmark", "median ms", "base ms", "change"))
+    for name, (median, _) in results.items():
+        base = baseline["medians"].get(name)
+        if base is None:
+            report("{:<60} {:>10.2f} {:>10} {:>8}".format(name, median * 1000, "-", "new"))
+            continue
+        change = median / base - 1 if base else 0
+        flag = change > threshold
+        if flag:
+            regressions.append(name)
+        report("{:<60} {:>10.2f} {:>10.2f} {:>+7.0%}{}".format(name, median * 1000, base * 1000, change,
+                                                                 "  REGRESSION" if flag else ""))
+    return regressions
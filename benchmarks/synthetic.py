@@ -0,0 +1,168 @@
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import us
+
+# file names of the JHU US time series, as in datasource.py (not imported so that the data source settings can
+# still be changed after generating the data)
+DEATHS_FILE = "time_series_covid19_deaths_US.csv"
+CONFIRMED_FILE = "time_series_covid19_confirmed_US.csv"
+GLOBAL_FILES = {"confirmed": "time_series_covid19_confirmed_global.csv",
+                "deaths": "time_series_covid19_deaths_global.csv",
+                "recovered": "time_series_covid19_recovered_global.csv"}
+FIRST_DAY = datetime.date(2020, 1, 22)
+# territories that have no county rows in the JHU data, as no_counties in the dashboard
+NO_COUNTIES = ["American Samoa", "Guam", "Northern Mariana Islands", "Virgin Islands"]
+# rows of the JHU data that belong to no state: (name, FIPS)
+CRUISE_SHIPS = [("Diamond Princess", 88888.0), ("Grand Princess", 99999.0)]
+# share of the confirmed cases of a day that are deaths two weeks later
+DEATH_RATE = 0.015
+DEATH_LAG = 14
+
+
+# function to get the JHU date labels (m/d/yy) of `days` days
+def date_labels(days):
+    dates = [FIRST_DAY + datetime.timedelta(days=day) for day in range(days)]
+    return ["{}/{}/{:02d}".format(date.month, date.day, date.year % 100) for date in dates]
+
+
+# function to get the label columns of the rows: `counties` counties spread over the states (and Puerto Rico),
+# an "Unassigned" and an "Out of <abbr>" row per state, one row without a county per territory of NO_COUNTIES
+# and the cruise ships
+def make_rows(counties, rng):
+    states = [state for state in us.states.STATES_AND_TERRITORIES if state.name not in NO_COUNTIES]
+    per_state = rng.multinomial(max(counties - len(states), 0), rng.dirichlet(np.ones(len(states)))) + 1
+    rows = []
+    for state, count in zip(states, per_state):
+        fips = int(state.fips) * 1000
+        rows += [(fips + i + 1, "County {}".format(i + 1), state.name) for i in range(count)]
+        rows += [(90000 + int(state.fips), "Unassigned", state.name),
+                 (80000 + int(state.fips), "Out of {}".format(state.abbr), state.name)]
+    rows += [(int(us.states.lookup(name).fips), np.nan, name) for name in NO_COUNTIES]
+    rows += [(fips, np.nan, name) for name, fips in CRUISE_SHIPS]
+    fips = np.array([row[0] for row in rows], dtype=float)
+    frame = pd.DataFrame({"UID": (84000000 + fips).astype(np.int64), "iso2": "US", "iso3": "USA", "code3": 840,
+                          "FIPS": fips, "Admin2": [row[1] for row in rows], "Province_State": [row[2] for row in rows],
+                          "Country_Region": "US", "Lat": rng.uniform(18, 65, len(rows)),
+                          "Long_": rng.uniform(-170, -65, len(rows))})
+    frame["Combined_Key"] = [", ".join(str(part) for part in (county, state, "US") if pd.notna(part))
+                             for county, state in zip(frame["Admin2"], frame["Province_State"])]
+    return frame
+
+
+# function to get the daily new cases of every row: a few waves shared by the whole country, scaled per row
+def daily_cases(rows, days, rng):
+    t = np.arange(days)
+    waves = np.zeros(days)
+    for _ in range(max(1, days // 200)):
+        waves += rng.uniform(0.3, 1) * np.exp(-0.5 * ((t - rng.uniform(0, days)) / rng.uniform(15, 60)) ** 2)
+    scale = rng.lognormal(3, 1.2, rows)
+    return rng.poisson(scale[:, None] * (waves[None, :] + 0.02))
+
+
+# function to generate the deaths and confirmed cases time series frames of the JHU schema, with `counties`
+# county rows and `days` date columns; the same seed gives the same frames
+def make_time_series(counties=3000, days=1143, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = make_rows(counties, rng)
+    cases = daily_cases(len(rows), days, rng)
+    lagged = np.zeros_like(cases)
+    lagged[:, DEATH_LAG:] = cases[:, :max(days - DEATH_LAG, 0)]
+    deaths = rng.binomial(lagged, DEATH_RATE)
+    dates = date_labels(days)
+    confirmed = pd.concat([rows, pd.DataFrame(np.cumsum(cases, axis=1), columns=dates)], axis=1)
+    deaths_rows = rows.assign(Population=rng.integers(1000, 2000000, len(rows)))
+    deaths = pd.concat([deaths_rows, pd.DataFrame(np.cumsum(deaths, axis=1), columns=dates)], axis=1)
+    return deaths, confirmed
+
+
+# function to write generated deaths and confirmed cases csv files into a directory, usable as COVID_DATA_SOURCE
+def write_time_series(directory, counties=3000, days=1143, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    deaths, confirmed = make_time_series(counties, days, seed)
+    deaths.to_csv(os.path.join(directory, DEATHS_FILE), index=False)
+    confirmed.to_csv(os.path.join(directory, CONFIRMED_FILE), index=False)
+    return directory
+
+
+# function to write generated global confirmed, deaths and recovered csv files of the JHU global schema into a
+# directory: `countries` rows with a province for every fifth of them
+def write_global_time_series(directory, countries=289, days=1143, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    rows = pd.DataFrame({"Province/State": [np.nan if i % 5 else "Province {}".format(i) for i in range(countries)],
+                         "Country/Region": ["Country {}".format(i // 5) for i in range(countries)],
+                         "Lat": rng.uniform(-60, 70, countries), "Long": rng.uniform(-180, 180, countries)})
+    cases = np.cumsum(daily_cases(countries, days, rng), axis=1)
+    dates = date_labels(days)
+    for name, values in [("confirmed", cases), ("deaths", rng.binomial(cases, DEATH_RATE)),
+                         ("recovered", rng.binomial(cases, 0.9))]:
+        frame = pd.concat([rows, pd.DataFrame(values, columns=dates)], axis=1)
+        frame.to_csv(os.path.join(directory, GLOBAL_FILES[name]), index=False)
+    return directory
+
+
+# function to write a county GeoJSON for the counties of the generated time series of the same size and seed: every
+# state is a block of square counties whose borders wiggle through `vertices` points, like the county shapes of
+# the plotly datasets
+def write_county_geojson(path, counties=3000, seed=0, vertices=100):
+    rows = make_rows(counties, np.random.default_rng(seed))
+    rows = rows[rows["Admin2"].str.startswith("County", na=False)]
+    rng = np.random.default_rng(seed)
+    features = []
+    for i, (_, state_rows) in enumerate(rows.groupby("Province_State", sort=False)):
+        columns = int(np.ceil(np.sqrt(len(state_rows))))
+        size = 6 / columns
+        west, south = -125 + (i % 8) * 7, 25 + (i // 8) * 4
+        for j, fips in enumerate(state_rows["FIPS"]):
+            x, y = west + (j % columns) * size, south + (j // columns) * size * 0.6
+            # the perimeter of the square from its south west corner, bent by a few waves
+            t = np.linspace(0, 4, vertices, endpoint=False)
+            side, along = np.floor(t), t % 1
+            corners = np.array([[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]], dtype=float)
+            points = corners[side.astype(int)] + (corners[side.astype(int) + 1] - corners[side.astype(int)]) * \
+                along[:, None]
+            bend = sum(rng.uniform(0, 0.04) * np.sin(2 * np.pi * (k * t + rng.uniform())) for k in (1, 3, 7))
+            points = points + bend[:, None] * (points - 0.5)
+            ring = np.column_stack([x + points[:, 0] * size, y + points[:, 1] * size * 0.6])
+            ring = np.round(np.vstack([ring, ring[:1]]), 6).tolist()
+            features.append({"type": "Feature", "id": "{:05d}".format(int(fips)),
+                             "geometry": {"type": "Polygon", "coordinates": [ring]}})
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+    return path
+
+
+# function to write generated daily reports of the JHU csse_covid_19_daily_reports_us schema into a directory, one
+# MM-DD-YYYY.csv file per day from `first` with a row per state and territory. The older files use the column names
+# of 2020 (People_Tested, Mortality_Rate). Returns the directory
+def write_daily_reports(directory, days=1055, seed=0, first=datetime.date(2020, 4, 12)):
+    rng = np.random.default_rng(seed)
+    states = list(us.states.STATES_AND_TERRITORIES) + [name for name, _ in CRUISE_SHIPS]
+    names = [getattr(state, "name", state) for state in states]
+    population = rng.integers(50000, 40000000, len(states))
+    cases = np.cumsum(daily_cases(len(states), days, rng) * 10, axis=1)
+    deaths = rng.binomial(cases, DEATH_RATE)
+    tests = np.cumsum(rng.poisson(population[:, None] / 300, (len(states), days)), axis=1)
+    hospitalized = rng.binomial(cases, 0.05)
+    os.makedirs(directory, exist_ok=True)
+    for day in range(days):
+        date = first + datetime.timedelta(days=day)
+        old = date < datetime.date(2020, 11, 1)
+        frame = pd.DataFrame({"Province_State": names, "Country_Region": "US",
+                              "Last_Update": "{} 04:30:00".format(date + datetime.timedelta(days=1)),
+                              "Confirmed": cases[:, day], "Deaths": deaths[:, day],
+                              "Incident_Rate": np.round(cases[:, day] / population * 1e5, 3),
+                              "People_Tested" if old else "Total_Test_Results": tests[:, day],
+                              "People_Hospitalized": hospitalized[:, day],
+                              "Mortality_Rate" if old else "Case_Fatality_Ratio":
+                                  np.round(deaths[:, day] / np.maximum(cases[:, day], 1) * 100, 3),
+                              "Testing_Rate": np.round(tests[:, day] / population * 1e5, 3),
+                              "Hospitalization_Rate": np.round(hospitalized[:, day] / np.maximum(cases[:, day], 1)
+                                                               * 100, 3)})
+        frame.to_csv(os.path.join(directory, date.strftime("%m-%d-%Y.csv")), index=False)
+    return directory
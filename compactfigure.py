@@ -0,0 +1,113 @@
+import base64
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+# COVID_FIGURE_POINT_BUDGET: most points sent per trace, longer scatter traces are drawn with WebGL and longer
+# bar traces are averaged over consecutive days
+POINT_BUDGET = int(os.environ.get("COVID_FIGURE_POINT_BUDGET", "1000"))
+# day step of a date axis in milliseconds
+DAY_MS = 24 * 60 * 60 * 1000
+# date format of the JHU time series columns
+DATE_FORMAT = "%m/%d/%y"
+
+
+# function to encode a numeric array as a base64 typed array ({"dtype", "bdata"}), the format of plotly.js, as
+# 32 bit integers when all values are integers and as 64 bit floats otherwise
+def typed_array(values):
+    values = np.asarray(values, dtype=float)
+    if is_integral(values):
+        array, dtype = values.astype("<i4"), "i4"
+    else:
+        array, dtype = values.astype("<f8"), "f8"
+    return {"dtype": dtype, "bdata": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+# function to encode integers as a typed array of the narrowest signed integers that hold them all
+def narrow_typed_array(values):
+    values = np.asarray(values, dtype=np.int64)
+    for dtype in ("i1", "i2", "i4"):
+        info = np.iinfo(dtype)
+        if not len(values) or (values.min() >= info.min and values.max() <= info.max):
+            break
+    else:
+        raise ValueError("values do not fit 32 bit integers")
+    return {"dtype": dtype, "bdata": base64.b64encode(values.astype("<" + dtype).tobytes()).decode("ascii")}
+
+
+def is_integral(values):
+    return bool(np.isfinite(values).all() and (values == np.round(values)).all()
+                and (not len(values) or np.abs(values).max() < 2 ** 31))
+
+
+# function to encode a numeric array as a typed array or as the shortest plain list
+def encode_array(values, typed_arrays):
+    if typed_arrays:
+        return typed_array(values)
+    if is_integral(values):
+        return values.astype(np.int64).tolist()
+    return values.tolist()
+
+
+# function to get the first date of x when x is a list of consecutive days, None otherwise
+def first_day(x):
+    try:
+        dates = pd.to_datetime(pd.Series(x), format=DATE_FORMAT)
+    except (ValueError, TypeError):
+        return None
+    if not len(dates) or (np.diff(dates.to_numpy()) != np.timedelta64(1, "D")).any():
+        return None
+    return dates.iloc[0]
+
+
+# function to average the values of every `step` consecutive days, a bar of `step` days then has the area of the
+# daily bars it replaces
+def bucket_means(values, step):
+    padded = np.full(math.ceil(len(values) / step) * step, np.nan)
+    padded[:len(values)] = values
+    buckets = padded.reshape(-1, step)
+    finite = np.isfinite(buckets)
+    with np.errstate(invalid="ignore"):
+        return np.where(finite, buckets, 0).sum(axis=1) / finite.sum(axis=1)
+
+
+def compact_trace(trace, typed_arrays):
+    trace = dict(trace)
+    x, y = trace.get("x"), trace.get("y")
+    if x is None or y is None or len(x) != len(y) or trace.get("orientation") == "h":
+        return trace
+    try:
+        y = np.asarray(y, dtype=float)
+    except (ValueError, TypeError):
+        return trace
+    start = first_day(x)
+    step = 1
+    if len(y) > POINT_BUDGET:
+        if trace.get("type") == "scatter":
+            trace["type"] = "scattergl"
+        elif trace.get("type") == "bar" and start is not None:
+            step = math.ceil(len(y) / POINT_BUDGET)
+            y = bucket_means(y, step)
+    if start is not None:
+        # the x axis as its first day and a day step, a bar of several days is centered on them
+        del trace["x"]
+        trace["x0"] = (start + pd.Timedelta(days=(step - 1) / 2)).strftime("%Y-%m-%d %H:%M")
+        trace["dx"] = step * DAY_MS
+    trace["y"] = encode_array(y, typed_arrays)
+    return trace
+
+
+# function to turn a figure into its compact form for the browser: dates as a start and a step, numbers as typed
+# arrays (decoded by assets/tabs.js, typed_arrays=False sends plain lists) and long series within the point budget
+def compact_figure(figure, typed_arrays=True):
+    if hasattr(figure, "to_plotly_json"):
+        figure = figure.to_plotly_json()
+    data = [compact_trace(trace, typed_arrays) for trace in figure.get("data", [])]
+    layout = dict(figure.get("layout", {}))
+    # without x values plotly cannot tell that the axis holds dates
+    for axis in {trace.get("xaxis", "x") for trace in data if "x0" in trace}:
+        name = "xaxis" + axis[1:]
+        layout[name] = dict(layout.get(name, {}), type="date")
+    return {"data": data, "layout": layout}
@@ -0,0 +1,193 @@
+import errno
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from types import SimpleNamespace
+
+import numpy as np
+
+from datasource import CACHE_DIR, TIMEOUT, write_atomic
+
+# county shapes of the plotly datasets, features with the 5 digit county FIPS code as their id
+PLOTLY_COUNTIES_URL = "https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json"
+# COVID_COUNTY_GEOJSON: county GeoJSON file or url with 5 digit FIPS feature ids. A url is downloaded once into
+# COVID_DATA_CACHE, then the shapes are simplified once into one small file per state under
+# <COVID_DATA_CACHE>/geometry/<version>/ that the dashboard serves to the browser
+COUNTY_GEOJSON = os.environ.get("COVID_COUNTY_GEOJSON", PLOTLY_COUNTIES_URL)
+# COVID_GEOMETRY_TOLERANCE: degrees a simplified border may be off the original one
+GEOMETRY_TOLERANCE = float(os.environ.get("COVID_GEOMETRY_TOLERANCE", "0.01"))
+GEOMETRY_DIR = os.path.join(CACHE_DIR, "geometry")
+# decimals kept of the coordinates, about 100 m
+PRECISION = 3
+# seconds before a failed preparation (e.g. an offline download) is tried again, the failure is raised until then
+RETRY = 300
+
+# the simplified shapes, prepared once per process, and the last failure with its time
+_prepared = None
+_failure = None
+_prepare_lock = threading.Lock()
+
+
+# function to get the indexes of the points of a line kept by the Douglas-Peucker simplification: the points that
+# are more than `tolerance` off the line between the kept points around them
+def douglas_peucker(points, tolerance):
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        inner = points[first + 1:last]
+        line = end - start
+        length = np.hypot(*line)
+        if length:
+            distances = np.abs(line[0] * (inner[:, 1] - start[1]) - line[1] * (inner[:, 0] - start[0])) / length
+        else:
+            distances = np.hypot(inner[:, 0] - start[0], inner[:, 1] - start[1])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack += [(first, middle), (middle, last)]
+    return np.flatnonzero(keep)
+
+
+# function to simplify a closed ring of [lon, lat] points, None when too little of it is left to be drawn
+def simplify_ring(ring, tolerance):
+    points = np.round(np.asarray(ring, dtype=float), PRECISION)
+    if len(points) < 4:
+        return None
+    # a ring is split at its point farthest from its start, so that both halves are simplified as open lines
+    split = int(np.argmax(np.hypot(*(points - points[0]).T)))
+    if split == 0:
+        return None
+    first = points[douglas_peucker(points[:split + 1], tolerance)]
+    second = points[split + douglas_peucker(points[split:], tolerance)]
+    points = np.vstack([first, second[1:]])
+    # consecutive points rounded onto the same spot
+    points = points[np.append(True, (np.diff(points, axis=0) != 0).any(axis=1))]
+    if len(points) < 4:
+        return None
+    return points.tolist()
+
+
+# function to simplify a Polygon or MultiPolygon geometry, the polygons (and holes) that vanish are dropped. A shape
+# that would vanish entirely keeps its largest polygon unsimplified
+def simplify_geometry(geometry, tolerance):
+    polygons = geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+    simplified = []
+    for polygon in polygons:
+        outer = simplify_ring(polygon[0], tolerance)
+        if outer is not None:
+            holes = [simplify_ring(ring, tolerance) for ring in polygon[1:]]
+            simplified.append([outer] + [hole for hole in holes if hole is not None])
+    if not simplified:
+        largest = max(polygons, key=lambda polygon: len(polygon[0]))
+        simplified = [[np.round(np.asarray(largest[0], dtype=float), PRECISION).tolist()]]
+    if len(simplified) == 1:
+        return {"type": "Polygon", "coordinates": simplified[0]}
+    return {"type": "MultiPolygon", "coordinates": simplified}
+
+
+# function to split a county GeoJSON by state and write the simplified shapes of every state as
+# <directory>/<2 digit state FIPS>.json, only the ids and the geometries of the features are kept
+def preprocess(path, directory, tolerance=GEOMETRY_TOLERANCE):
+    with open(path, "rb") as f:
+        collection = json.load(f)
+    states = defaultdict(list)
+    for feature in collection["features"]:
+        geometry = feature.get("geometry")
+        fips = str(feature.get("id", ""))
+        if not geometry or geometry["type"] not in ("Polygon", "MultiPolygon") or len(fips) != 5:
+            continue
+        states[fips[:2]].append({"type": "Feature", "id": fips, "geometry": simplify_geometry(geometry, tolerance)})
+    os.makedirs(directory, exist_ok=True)
+    sizes = {}
+    for state, features in states.items():
+        text = json.dumps({"type": "FeatureCollection", "features": features}, separators=(",", ":")).encode()
+        write_atomic(os.path.join(directory, state + ".json"), lambda f, text=text: f.write(text))
+        sizes[state] = len(text)
+    # written last, a directory without it is redone
+    write_atomic(os.path.join(directory, "index.json"), lambda f: f.write(json.dumps(sizes).encode()))
+    return sizes
+
+
+# function to get the local path of the county GeoJSON, an http(s) url is downloaded once into the geometry
+# directory, anything else is a local path
+def source_path(source=None):
+    source = source or COUNTY_GEOJSON
+    if source.startswith("file://"):
+        source = source[len("file://"):]
+    if not source.startswith(("http://", "https://")):
+        if not os.path.exists(source):
+            raise FileNotFoundError(errno.ENOENT, "County GeoJSON not found", source)
+        return source
+    path = os.path.join(GEOMETRY_DIR, "source-{}.json".format(hashlib.sha1(source.encode()).hexdigest()[:12]))
+    if not os.path.exists(path):
+        os.makedirs(GEOMETRY_DIR, exist_ok=True)
+        with urllib.request.urlopen(source, timeout=TIMEOUT) as response:
+            write_atomic(path, lambda f: f.write(response.read()))
+    return path
+
+
+# function to simplify the county shapes unless a worker already did, returns their directory and version. The
+# version changes with the source file and the tolerance, it is part of the urls of the shapes so that the browser
+# can keep them
+def prepare(source=None, tolerance=GEOMETRY_TOLERANCE):
+    global _prepared, _failure
+    with _prepare_lock:
+        if _prepared is None and _failure is not None and time.monotonic() - _failure[0] < RETRY:
+            raise _failure[1]
+        if _prepared is None:
+            try:
+                path = source_path(source)
+                stat = os.stat(path)
+                version = hashlib.sha1("{}-{}-{}-{}".format(os.path.abspath(path), stat.st_mtime_ns, stat.st_size,
+                                                             tolerance).encode()).hexdigest()[:12]
+                directory = os.path.join(GEOMETRY_DIR, version)
+                if not os.path.exists(os.path.join(directory, "index.json")):
+                    preprocess(path, directory, tolerance)
+            except Exception as error:
+                _failure = (time.monotonic(), error)
+                raise
+            _prepared = SimpleNamespace(directory=directory, version=version, shapes={})
+        return _prepared
+
+
+# function to tell whether the county shapes can be served
+def available():
+    try:
+        prepare()
+    except Exception:
+        return False
+    return True
+
+
+# function to get the simplified shapes of the counties of a state (2 digit FIPS) as GeoJSON bytes, None when there
+# are none
+def state_shapes(state_fips):
+    prepared = prepare()
+    shapes = prepared.shapes.get(state_fips)
+    if shapes is None:
+        try:
+            with open(os.path.join(prepared.directory, state_fips + ".json"), "rb") as f:
+                shapes = prepared.shapes[state_fips] = f.read()
+        except OSError:
+            return None
+    return shapes
+
+
+# `python countygeometry.py` simplifies the county shapes and prints the size of the shapes of every state
+if __name__ == "__main__":
+    prepared = prepare()
+    with open(os.path.join(prepared.directory, "index.json")) as f:
+        sizes = json.load(f)
+    for state, size in sorted(sizes.items()):
+        print("{} {:>10,}".format(state, size))
+    print("all {:>10,} bytes in {}".format(sum(sizes.values()), prepared.directory))
@@ -1,106 +1,104 @@
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from types import SimpleNamespace
+
 import dash
-import dash_core_components as dcc
-import dash_html_components as html
+from dash import Patch, dash_table, dcc, html
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 import us
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 from dateutil import parser
+from flask import Response, abort, jsonify, request
+from flask_compress import Compress
 import gunicorn
+from werkzeug.http import is_resource_modified
+
+import countygeometry
+import dailyreports
+from compactfigure import DAY_MS, POINT_BUDGET, compact_figure, encode_array, narrow_typed_array
+from datacube import align_rows, cube_for, melt_table, per_100k, top_rows
+from datasource import CONFIRMED_FILE, DEATHS_FILE, load_datasets, required_frames, snapshot_version
+from figurecache import FigureCache
+from metrics import instrument, observe_stage, stage, timed
+import profiler
+from sharedstore import SHARED_DATA_DIR, open_store, prepare_store
+import staticexport
 
 external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-server = app.server
 
-US_covid_deaths = pd.read_csv(
-    "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv")
-
-US_confirmed_cases = pd.read_csv(
-    "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv")
+# seconds between checks of the data source for new data, 0 disables the background refresh
+REFRESH_INTERVAL = float(os.environ.get("COVID_REFRESH_INTERVAL", "600"))
+# seconds between attempts of the first data load when it fails
+LOAD_RETRY = float(os.environ.get("COVID_LOAD_RETRY", "30"))
+# COVID_CLIENTSIDE_TABS=0 switches the Daily / Running Total tabs with server callbacks instead of in the browser
+CLIENTSIDE_TABS = os.environ.get("COVID_CLIENTSIDE_TABS", "1") == "1"
+# COVID_FIGURE_WARMUP=1 renders every state chart in the background after each data load
+FIGURE_WARMUP = os.environ.get("COVID_FIGURE_WARMUP", "0") == "1"
+# COVID_COMPACT_FIGURES=1 sends the charts in their compact form (see compactfigure.py) and gzips the responses.
+# The typed arrays are decoded by the client side tabs, with server side tabs the numbers are sent as lists
+COMPACT_FIGURES = os.environ.get("COVID_COMPACT_FIGURES", "0") == "1"
+TYPED_ARRAYS = COMPACT_FIGURES and CLIENTSIDE_TABS
+# COVID_TIMELAPSE_BUDGET: most bytes of the time-lapse of the map sent to the browser, longer series are shown in
+# frames of several days. COVID_TIMELAPSE_INTERVAL: milliseconds between two frames of the playback
+TIMELAPSE_BUDGET = int(os.environ.get("COVID_TIMELAPSE_BUDGET", "400000"))
+TIMELAPSE_INTERVAL = int(os.environ.get("COVID_TIMELAPSE_INTERVAL", "50"))
+# COVID_COMPARE_LIMIT: most series of the comparison chart
+COMPARE_LIMIT = int(os.environ.get("COVID_COMPARE_LIMIT", "10"))
+# COVID_LEADERBOARD_LIMIT: most counties of the county leaderboard
+LEADERBOARD_LIMIT = int(os.environ.get("COVID_LEADERBOARD_LIMIT", "100"))
+# COVID_API_CACHE: responses of /api/v1/series every worker keeps for repeated requests, each of them up to
+# COVID_API_CACHE_BYTES (a larger csv response is streamed every time)
+API_CACHE = int(os.environ.get("COVID_API_CACHE", "64"))
+API_CACHE_BYTES = int(os.environ.get("COVID_API_CACHE_BYTES", str(8 * 1024 * 1024)))
+# dates per chunk of a streamed csv response
+API_CSV_ROWS = 100
+
+# rendered figures shared by the workers, see figurecache.py
+figure_cache = FigureCache(variant="{}-{}".format("typed" if TYPED_ARRAYS else "compact", POINT_BUDGET)
+                           if COMPACT_FIGURES else "")
+
+
+# function to get series from the aggregation engine (see CountyCube.aggregate) in the long format of pd.melt,
+# with the daily difference of the values added as daily_name when given
+def get_series_frame(df, level, id_name, value_name, daily_name=None, names=None, state=None):
+    cube = cube_for(df)
+    labels, dates, table = cube.aggregate(level, names=names, state=state)
+    series = melt_table(labels, dates, table, id_name, value_name)
+    if daily_name:
+        series[daily_name] = cube.aggregate(level, "daily", names=names, state=state)[2].T.ravel()
+    return series
 
 
 # All states and territories
 # function for daily US covid19 deaths
 def get_US_daily_deaths(df):
-    # We make a copy of the data frame to be able to delete unnecessary columns
-    US_daily_deaths = df[df.Country_Region == "US"].copy()
-    # We remove unnecessary columns
-    US_daily_deaths.drop(
-        ["UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Province_State", "Combined_Key", "Population", "Lat",
-         "Long_"], axis=1, inplace=True)
-    # We list all columns so we can summarize them
-    cols = list(US_daily_deaths.columns)
-    # Aggregate (sum) all columns
-    US_daily_deaths = US_daily_deaths.groupby(["Country_Region"])[cols].sum()
-    # reset index in the resulting dataframe
-    US_daily_deaths = US_daily_deaths.reset_index()
-    # Pivot all the date columns into rows
-    US_daily_deaths = pd.melt(US_daily_deaths, id_vars=["Country_Region"], var_name="Date", value_name="Value")
-    # do a difference of the value in a row with the one before it to undo the cumulative values
-    US_daily_deaths["Daily_Deaths"] = US_daily_deaths["Value"].diff(1)
-    return US_daily_deaths
+    return get_series_frame(df, "nation", "Country_Region", "Value", "Daily_Deaths")
 
 
 # function for daily US confirmed covid19 cases
 def get_US_daily_confirmed_cases(df):
-    # We make a copy of the data frame to be able to delete unnecessary columns
-    US_daily_confirmed_cases = df[df.Country_Region == "US"].copy()
-    # We remove unnecessary columns
-    US_daily_confirmed_cases.drop(
-        ["UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Province_State", "Lat", "Long_", "Combined_Key"], axis=1,
-        inplace=True)
-    # We list all columns so we can summarize them
-    cols = list(US_daily_confirmed_cases.columns)
-    # Aggregate (sum) all columns
-    US_daily_confirmed_cases = US_daily_confirmed_cases.groupby(["Country_Region"])[cols].sum()
-    # reset index in the resulting dataframe
-    US_daily_confirmed_cases = US_daily_confirmed_cases.reset_index()
-    # Pivot all the date columns into rows
-    US_daily_confirmed_cases = pd.melt(US_daily_confirmed_cases, id_vars=["Country_Region"], var_name="Date",
-                                       value_name="Value")
-    # do a difference of the value in a row with the one before it to undo the cumulative values
-    US_daily_confirmed_cases["Daily_Confirmed_Cases"] = US_daily_confirmed_cases["Value"].diff(1)
-    return US_daily_confirmed_cases
+    return get_series_frame(df, "nation", "Country_Region", "Value", "Daily_Confirmed_Cases")
 
 
 # function for US confirmed convid19 cases(cumulative)
 def get_US_confirmed_cases(df):
-    # We make a copy of the data frame to be able to delete unnecessary columns
-    US_confirmed_cases = df[df.Country_Region == "US"].copy()
-    # We remove unnecessary columns
-    US_confirmed_cases.drop(
-        ["UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Province_State", "Lat", "Long_", "Combined_Key"], axis=1,
-        inplace=True)
-    # We list all columns so we can summarize them
-    cols = list(US_confirmed_cases.columns)
-    # Aggregate (sum) all columns
-    US_confirmed_cases = US_confirmed_cases.groupby(["Country_Region"])[cols].sum()
-    # reset index in the resulting dataframe
-    US_confirmed_cases = US_confirmed_cases.reset_index()
-    # Pivot all the date columns into rows
-    US_confirmed_cases = pd.melt(US_confirmed_cases, id_vars=["Country_Region"], var_name="Date",
-                                 value_name="Confirmed_Cases")
-    return US_confirmed_cases
+    return get_series_frame(df, "nation", "Country_Region", "Confirmed_Cases")
 
 
 # function for US covid19 deaths (cumulative)
 def get_US_deaths(df):
-    # We make a copy of the data frame to be able to delete unnecessary columns
-    US_deaths = df[df.Country_Region == "US"].copy()
-    # We remove unnecessary columns
-    US_deaths.drop(
-        ["UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Province_State", "Combined_Key", "Population", "Lat",
-         "Long_"], axis=1, inplace=True)
-    # We list all columns so we can summarize them
-    cols = list(US_deaths.columns)
-    # Aggregate (sum) all columns
-    US_deaths = US_deaths.groupby(["Country_Region"])[cols].sum()
-    # reset index in the resulting dataframe
-    US_deaths = US_deaths.reset_index()
-    # Pivot all the date columns into rows
-    US_deaths = pd.melt(US_deaths, id_vars=["Country_Region"], var_name="Date", value_name="US_Deaths_Count")
-    return US_deaths
+    return get_series_frame(df, "nation", "Country_Region", "US_Deaths_Count")
 
 
 # Individual states and territories
@@ -112,266 +110,1093 @@ states_abbr = pd.DataFrame([[x, x.abbr] for x in us.states.STATES_AND_TERRITORIE
 no_counties = ["American Samoa", "Guam", "Northern Mariana Islands", "Virgin Islands"]
 
 
+# function for the cumulative series of a state ('US' for all states) or of its counties
+def get_state_frame(state, df, county, value_name):
+    if county != "None" and state not in no_counties:
+        if state == 'US':
+            # counties grouped by name across the whole country
+            labels, table = cube_for(df).county_name_table()
+            return melt_table(labels, cube_for(df).dates, table, "Admin2", value_name)
+        return get_series_frame(df, "county", "Admin2", value_name, state=state)
+    return get_series_frame(df, "state", "Province_State", value_name, names=None if state == 'US' else [state])
+
+
 # function for US state daily covid19 deaths
 def get_US_state_daily_deaths(state, df):
-    # We make a copy of the data frame to be able to delete unnecessary columns
-    US_state_daily_deaths = df[df.Province_State == state].copy()
-    # We remove unnecessary columns
-    US_state_daily_deaths.drop(
-        ["UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Country_Region", "Combined_Key", "Population", "Lat",
-         "Long_"], axis=1, inplace=True)
-    # We list all columns so we can summarize them
-    cols = list(US_state_daily_deaths.columns)
-    # Aggregate (sum) all columns
-    US_state_daily_deaths = US_state_daily_deaths.groupby(["Province_State"])[cols].sum()
-    # reset index in the resulting dataframe
-    US_state_daily_deaths = US_state_daily_deaths.reset_index()
-    # Pivot all the date columns into rows
-    US_state_daily_deaths = pd.melt(US_state_daily_deaths, id_vars=["Province_State"], var_name="Date",
-                                    value_name="Value")
-    # do a difference of the value in a row with the one before it to undo the cumulative values
-    US_state_daily_deaths["US_state_daily_deaths"] = US_state_daily_deaths["Value"].diff(1)
-    return US_state_daily_deaths
+    return get_series_frame(df, "state", "Province_State", "Value", "US_state_daily_deaths", names=[state])
 
 
 # function for US state cumulative covid19 deaths
 def get_US_state_deaths(state, df, county="None"):
-    # We make a copy of the data frame to be able to delete unnecessary columns
-    if state == 'US':
-        US_state_deaths = df[df.Country_Region == 'US'].copy()
-    else:
-        US_state_deaths = df[df.Province_State == state].copy()
-
-    if county == "None" or state in no_counties:
-        # We remove unnecessary columns
-        US_state_deaths.drop(
-            ['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Admin2', 'Country_Region', 'Combined_Key', 'Population', 'Lat',
-             'Long_'], axis=1, inplace=True)
-        # We list all columns so we can summarize them
-        cols = list(US_state_deaths.columns)
-        # Aggregate (sum) all columns
-        US_state_deaths = US_state_deaths.groupby(['Province_State'])[cols].sum()
-        # reset index in the resulting dataframe
-        US_state_deaths = US_state_deaths.reset_index()
-        # Pivot all the date columns into rows
-        US_state_deaths = pd.melt(US_state_deaths, id_vars=['Province_State'], var_name="Date",
-                                  value_name="US_state_deaths")
-
-    else:
-        # We remove unnecessary columns
-        US_state_deaths.drop(
-            ['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Province_State', 'Country_Region', 'Combined_Key', 'Population',
-             'Lat',
-             'Long_'], axis=1, inplace=True)
-        # We list all columns so we can summarize them
-        cols = list(US_state_deaths.columns)
-        # Aggregate (sum) all columns
-        US_state_deaths = US_state_deaths.groupby(['Admin2'])[cols].sum()
-        # reset index in the resulting dataframe
-        US_state_deaths = US_state_deaths.reset_index()
-        # Pivot all the date columns into rows
-        US_state_deaths = pd.melt(US_state_deaths, id_vars=['Admin2'], var_name="Date",
-                                  value_name="US_state_deaths")
-
-    return US_state_deaths
+    return get_state_frame(state, df, county, "US_state_deaths")
 
 
 # function for US state daily covid19 confirmed cases
 def get_US_state_daily_confirmed_cases(state, df):
-    # We make a copy of the data frame to be able to delete unnecessary columns
-    US_state_daily_confirmed_cases = df[df.Province_State == state].copy()
-    # We remove unnecessary columns
-    US_state_daily_confirmed_cases.drop(
-        ["UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Country_Region", "Lat", "Long_", "Combined_Key"], axis=1,
-        inplace=True)
-    # We list all columns so we can summarize them
-    cols = list(US_state_daily_confirmed_cases.columns)
-    # Aggregate (sum) all columns
-    US_state_daily_confirmed_cases = US_state_daily_confirmed_cases.groupby(["Province_State"])[cols].sum()
-    # reset index in the resulting dataframe
-    US_state_daily_confirmed_cases = US_state_daily_confirmed_cases.reset_index()
-    # Pivot all the date columns into rows
-    US_state_daily_confirmed_cases = pd.melt(US_state_daily_confirmed_cases, id_vars=["Province_State"],
-                                             var_name="Date", value_name="Value")
-    # do a difference of the value in a row with the one before it to undo the cumulative values
-    US_state_daily_confirmed_cases["US_state_daily_confirmed_cases"] = US_state_daily_confirmed_cases["Value"].diff(1)
-    return US_state_daily_confirmed_cases
+    return get_series_frame(df, "state", "Province_State", "Value", "US_state_daily_confirmed_cases", names=[state])
 
 
 # function for US state and county cumulative covid19 confirmed cases
 def get_US_state_confirmed_cases(state, df, county="None"):
-    # We make a copy of the data frame to be able to delete unnecessary columns
-    if state == 'US':
-        US_state_confirmed_cases = df[df.Country_Region == 'US'].copy()
-    else:
-        US_state_confirmed_cases = df[df.Province_State == state].copy()
-    if county == "None" or state in no_counties:
-        # We remove unnecessary columns
-        US_state_confirmed_cases.drop(
-            ['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Admin2', 'Country_Region', 'Lat', 'Long_', 'Combined_Key'],
-            axis=1,
-            inplace=True)
-        # We list all columns so we can summarize them
-        cols = list(US_state_confirmed_cases.columns)
-        # Aggregate (sum) all columns
-        US_state_confirmed_cases = US_state_confirmed_cases.groupby(['Province_State'])[cols].sum()
-        # reset index in the resulting dataframe
-        US_state_confirmed_cases = US_state_confirmed_cases.reset_index()
-        # Pivot all the date columns into rows
-        US_state_confirmed_cases = pd.melt(US_state_confirmed_cases, id_vars=['Province_State'], var_name="Date",
-                                           value_name="US_state_confirmed_cases")
-    else:
-        # We remove unnecessary columns
-        US_state_confirmed_cases.drop(
-            ['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Province_State', 'Country_Region', 'Lat', 'Long_',
-             'Combined_Key'], axis=1,
-            inplace=True)
-        # We list all columns so we can summarize them
-        cols = list(US_state_confirmed_cases.columns)
-        # Aggregate (sum) all columns
-        US_state_confirmed_cases = US_state_confirmed_cases.groupby(['Admin2'])[cols].sum()
-        # reset index in the resulting dataframe
-        US_state_confirmed_cases = US_state_confirmed_cases.reset_index()
-        # Pivot all the date columns into rows
-        US_state_confirmed_cases = pd.melt(US_state_confirmed_cases, id_vars=['Admin2'], var_name="Date",
-                                           value_name="US_state_confirmed_cases")
-    return US_state_confirmed_cases
-
-
-# call functions to get daily and cumulative covid19 deaths in the US
-Daily_deaths = get_US_daily_deaths(US_covid_deaths)
-US_deaths = get_US_deaths(US_covid_deaths)
-
-# call function to get daily and cumulative confirmed covid19 cases
-Daily_confirmed_cases = get_US_daily_confirmed_cases(US_confirmed_cases)
-US_Confirmed_cases = get_US_confirmed_cases(US_confirmed_cases)
-
-# make df for the chloropleth
-cplt_death = get_US_state_deaths("US", US_covid_deaths).groupby(["Province_State"]).max().reset_index()
-cplt_confirmed_cases = get_US_state_confirmed_cases("US", US_confirmed_cases).groupby(
-    ["Province_State"]).max().reset_index()
-cplt_ = cplt_confirmed_cases.merge(cplt_death, how="left", on=["Province_State", "Date"])
-cplt_data = cplt_.merge(states_abbr, how="left", on="Province_State")
-cplt_data["text"] = cplt_data["Province_State"] + "<br>" + "Confirmed Cases: " + cplt_data[
-    "US_state_confirmed_cases"].astype(str) + \
-                    "<br>" + "Deaths: " + cplt_data["US_state_deaths"].astype(str)
+    return get_state_frame(state, df, county, "US_state_confirmed_cases")
+
+
 territories = pd.DataFrame([[x, x.abbr] for x in us.states.STATES_AND_TERRITORIES],
                            columns=(["Province_State", "abbr"])).astype(str).sort_values(by="Province_State")
 drpdn = territories["Province_State"]
 
 
+# rolling averages drawn over the daily charts and their line colors, see CountyCube.rolling_averages
+ROLLING_DAYS = [7, 14]
+ROLLING_COLORS = ["rgb(190, 100, 200)", "rgb(0, 0, 0)"]
+
+
+# function for the rolling average lines of a daily chart of the nation or a state, [(name, values)]
+def rolling_overlays(cube, level, name):
+    position = cube.label_positions[level].get(name)
+    if position is None:
+        return []
+    return [("{}-day average".format(days), np.round(table[position].astype(float), 2))
+            for days, table in zip(ROLLING_DAYS, cube.rolling_averages(level, ROLLING_DAYS))]
+
+
+# function to plot a daily or running total bar chart, overlays are [(name, values)] drawn as lines over the bars
+def bar_figure(df, y, title, label, overlays=()):
+    # plotly.express takes about half a second to import, it is only needed once the data is there
+    import plotly.express as px
+
+    figure = px.bar(df, x="Date", y=y, title=title, labels={y: label})
+    figure.update_xaxes(nticks=20)
+    for (name, values), color in zip(overlays, ROLLING_COLORS):
+        figure.add_trace(go.Scatter(x=figure.data[0].x, y=values, mode="lines", name=name, line=dict(color=color)))
+    if overlays:
+        figure.update_layout(legend=dict(x=0.01, y=0.99, bgcolor="rgba(255, 255, 255, 0.6)"))
+    if COMPACT_FIGURES:
+        return compact_figure(figure, TYPED_ARRAYS)
+    return figure
+
+
+# state charts: (metric, daily/cumulative) -> (function for the chart's df, y column, title, y axis label)
+STATE_CHARTS = {
+    ("confirmed", "daily"): (lambda state, snap: get_US_state_daily_confirmed_cases(state, snap.confirmed_cube),
+                             "US_state_daily_confirmed_cases", "<b>Daily Confirmed Covid Cases in {}</b>",
+                             """Number of New Cases (Daily Total)"""),
+    ("confirmed", "cumulative"): (lambda state, snap: get_US_state_confirmed_cases(state, snap.confirmed_cube),
+                                  "US_state_confirmed_cases", "<b>Confirmed Covid Cases in {}</b>",
+                                  """Number of New Cases (Running Total)"""),
+    ("deaths", "daily"): (lambda state, snap: get_US_state_daily_deaths(state, snap.deaths_cube),
+                          "US_state_daily_deaths", "<b>Daily Covid Deaths in {}</b>",
+                          """Number of Deaths (Daily Total)"""),
+    ("deaths", "cumulative"): (lambda state, snap: get_US_state_deaths(state, snap.deaths_cube),
+                               "US_state_deaths", "<b>Cumulative Covid Deaths in {}</b>",
+                               """Number of Deaths (Running Total)"""),
+}
+
+
+# function to get a state chart, through the figure cache for the states in the data
+def state_figure(snap, state, metric, kind):
+    get_df, y, title, label = STATE_CHARTS[(metric, kind)]
+
+    def build():
+        with stage("slice"):
+            df = get_df(state, snap)
+            overlays = rolling_overlays(getattr(snap, metric + "_cube"), "state", state) if kind == "daily" else []
+        with stage("figure"):
+            return bar_figure(df, y, title.format(state), label, overlays)
+
+    if state not in snap.confirmed_cube.state_rows:
+        return build()
+    with stage("figure_cache"):
+        return figure_cache.get((snap.version, state, metric, kind), build)
+
+
+# function to render every state chart of the data ahead of the first click
+def warm_figures(snap):
+    for state in drpdn:
+        for metric, kind in STATE_CHARTS:
+            state_figure(snap, state, metric, kind)
+
+
+# function to format the outputs of the state summary callback (but the daily texts, see daily_text). stats_c and
+# stats_d are the county statistics of both metrics: (number of counties, their mean, name and value of the highest
+# county, name and value of the lowest county)
+def state_outputs(state, period, confirmed, deaths, stats_c, stats_d):
+    state_confirmed = "Total Confirmed Cases: {} ".format(str(confirmed))
+    state_deaths = "Total Deaths: {} ".format(str(deaths))
+    state_header = "Covid-19 Summary for {} {}".format(state, period)
+    if state in no_counties or stats_c is None or stats_d is None or not stats_c[0] or not stats_d[0]:
+        county_avg_confirmed = "Avg Confirmed Cases in counties: **"
+        county_avg_deaths = "Avg Deaths in counties: **"
+        max_c = """Max Confirmed Cases: **"""
+        min_c = """Min Confirmed Cases: **"""
+        max_d = """Max Deaths: **"""
+        min_d = """Min Deaths: **"""
+        state_footer = """**County data not available"""
+    else:
+        county_avg_confirmed = "Avg Confirmed Cases in counties: {}".format(round(stats_c[1], 2))
+        county_avg_deaths = "Avg Deaths in counties: {}".format(round(stats_d[1], 2))
+        max_c = """Max Confirmed Cases: {} ({})""".format(stats_c[2], stats_c[3])
+        min_c = """Min Confirmed Cases: {} ({})""".format(stats_c[4], stats_c[5])
+        max_d = """Max Deaths: {} ({})""".format(stats_d[2], stats_d[3])
+        min_d = """Min Deaths: {} ({})""".format(stats_d[4], stats_d[5])
+        state_footer = ""
+    return (state_confirmed, state_deaths, state_header, county_avg_confirmed, county_avg_deaths, max_c, min_c, max_d,
+            min_d, state_footer)
+
+
+# function to build the outputs of the state summary callback for every state at once, keyed by both the state
+# name and its abbreviation
+def summarize_states(cplt_data, deaths_cube, confirmed_cube, fig_date):
+    county_stats = {}
+    for metric, cube in [("confirmed", confirmed_cube), ("deaths", deaths_cube)]:
+        peaks, counts, means, max_idx, min_idx = cube.county_peak_stats()
+        for i, state in enumerate(cube.states):
+            county_stats[(metric, state)] = (counts[i], means[i], cube.county_names[max_idx[i]], peaks[max_idx[i]],
+                                             cube.county_names[min_idx[i]], peaks[min_idx[i]])
+
+    state_summaries = {}
+    for state, abbr, confirmed, deaths in zip(cplt_data["Province_State"], cplt_data["abbr"],
+                                              cplt_data["US_state_confirmed_cases"], cplt_data["US_state_deaths"]):
+        summary = {"Province_State": state, "abbr": abbr,
+                   "outputs": state_outputs(state, "as of {}".format(fig_date), confirmed, deaths,
+                                            county_stats.get(("confirmed", state)),
+                                            county_stats.get(("deaths", state)))}
+        state_summaries[state] = summary
+        if isinstance(abbr, str):
+            state_summaries[abbr] = summary
+    return state_summaries
+
+
+# function to describe the period of the dates first to last (indexes into the dates of the data)
+def window_period(snap, first, last):
+    if (first, last) == (0, len(snap.window_dates) - 1):
+        return "as of {}".format(snap.fig_date)
+    return "from {} to {}".format(snap.window_dates[first], snap.window_dates[last])
+
+
+# function to read a date range slider value, None (a callback of a page without the slider) is the whole data
+def window_bounds(snap, window):
+    last_day = len(snap.window_dates) - 1
+    if not window:
+        return 0, last_day
+    return min(int(window[0]), last_day), min(int(window[1]), last_day)
+
+
+# function to describe the highest and the average daily count of a series (of a "nation" or "state" level) from
+# date first to last
+def daily_text(snap, label, cube, level, name, first, last):
+    position = cube.label_positions[level].get(name)
+    if position is None or last < max(first, 1):
+        return "{}: **".format(label)
+    means = cube.window_totals(level, first, last, [position])[1]
+    peaks, days = cube.window_peaks(level, first, last, [position])
+    return "{}: peak {} on {}, average {}".format(label, peaks[0], snap.window_dates[days[0]], round(means[0], 2))
+
+
+# function to get the texts of the national summary from date first to last, the whole data gives the totals and
+# state maxima of derive_data, a window the sums of its daily counts
+def national_outputs(snap, first, last):
+    if (first, last) == (0, len(snap.window_dates) - 1):
+        totals = (snap.total_US_confirmed, snap.total_US_deaths, snap.avg_US_state_confirmed, snap.avg_US_state_deaths)
+        extremes = [(list(snap.states_max_c.Province_State)[0], list(snap.states_max_c.US_state_confirmed_cases)[0]),
+                    (list(snap.states_max_d.Province_State)[0], list(snap.states_max_d.US_state_deaths)[0]),
+                    (list(snap.states_min_c.Province_State)[0], list(snap.states_min_c.US_state_confirmed_cases)[0]),
+                    (list(snap.states_min_d.Province_State)[0], list(snap.states_min_d.US_state_deaths)[0])]
+    else:
+        state_totals = {}
+        national = {}
+        for metric, cube in [("confirmed", snap.confirmed_cube), ("deaths", snap.deaths_cube)]:
+            state_totals[metric] = (cube.states, cube.window_totals("state", first, last)[0])
+            national[metric] = cube.window_totals("nation", first, last)[0][0]
+        totals = (national["confirmed"], national["deaths"], round(state_totals["confirmed"][1].mean(), 2),
+                  round(state_totals["deaths"][1].mean(), 2))
+        extremes = [(states[pick(values)], values[pick(values)])
+                    for pick in (np.argmax, np.argmin) for states, values in state_totals.values()]
+    return ("Covid-19 Summary {}".format(window_period(snap, first, last)),
+            "Total Confirmed Cases: {}".format(totals[0]),
+            "Total Deaths: {}".format(totals[1]),
+            "Avg Confirmed Cases in States: {}".format(totals[2]),
+            "Avg Deaths in States: {}".format(totals[3]),
+            """Max Confirmed Cases: {} ({})""".format(*extremes[0]),
+            """Max Deaths: {} ({})""".format(*extremes[1]),
+            """Min Confirmed Cases: {} ({})""".format(*extremes[2]),
+            """Min Deaths: {} ({})""".format(*extremes[3]),
+            daily_text(snap, "Daily Confirmed Cases", snap.confirmed_cube, "nation", "US", first, last),
+            daily_text(snap, "Daily Deaths", snap.deaths_cube, "nation", "US", first, last))
+
+
+# function to get the outputs of the state summary callback from date first to last, a window sums the daily counts
+# of the state and of each of its counties
+def window_state_outputs(snap, state, first, last):
+    if (first, last) == (0, len(snap.window_dates) - 1):
+        outputs = snap.state_summaries[state]["outputs"]
+    else:
+        totals = {}
+        stats = {}
+        for metric, cube in [("confirmed", snap.confirmed_cube), ("deaths", snap.deaths_cube)]:
+            position = cube.label_positions["state"].get(state)
+            totals[metric] = cube.window_totals("state", first, last, [position])[0][0] if position is not None else 0
+            start, stop = cube.state_counties.get(state, (0, 0))
+            counties = cube.window_totals("county", first, last, slice(start, stop))[0]
+            if len(counties):
+                high, low = np.argmax(counties), np.argmin(counties)
+                stats[metric] = (len(counties), counties.mean(), cube.county_names[start + high], counties[high],
+                                 cube.county_names[start + low], counties[low])
+        outputs = state_outputs(state, window_period(snap, first, last), totals["confirmed"], totals["deaths"],
+                                stats.get("confirmed"), stats.get("deaths"))
+    return tuple(outputs) + (
+        daily_text(snap, "Daily Confirmed Cases", snap.confirmed_cube, "state", state, first, last),
+        daily_text(snap, "Daily Deaths", snap.deaths_cube, "state", state, first, last))
+
+
+# function to zoom a chart on the dates first to last: the x axis shows the window and the y axis the range of the
+# values in it, the figure keeps all its data (assets/tabs.js does the same in the browser for the client side tabs)
+def window_figure(figure, first, last):
+    if hasattr(figure, "to_plotly_json"):
+        figure = figure.to_plotly_json()
+    low, high = 0, None
+    x0 = step = None
+    for trace in figure.get("data", []):
+        y = np.asarray(trace.get("y", []), dtype=float)
+        # a point stands for `step` days, several with compact figures over the point budget
+        step = trace["dx"] / DAY_MS if "dx" in trace else 1
+        days = np.arange(len(y)) * step
+        inside = y[(days + step - 1 >= first) & (days <= last) & np.isfinite(y)]
+        if len(inside):
+            low, high = min(low, inside.min()), max(high if high is not None else inside.max(), inside.max())
+        x0 = trace.get("x0", x0)
+    if x0 is None:
+        # one category per date
+        x_range = [first - 0.5, last + 0.5]
+    else:
+        start = pd.Timestamp(x0) - pd.Timedelta(days=(step - 1) / 2)
+        x_range = [(start + pd.Timedelta(days=day)).strftime("%Y-%m-%d %H:%M") for day in (first - 0.5, last + 0.5)]
+    layout = dict(figure.get("layout", {}))
+    layout["xaxis"] = dict(layout.get("xaxis", {}), range=x_range, autorange=False)
+    if high is not None:
+        pad = (high - low) * 0.05 or 1
+        layout["yaxis"] = dict(layout.get("yaxis", {}), range=[low - pad if low < 0 else 0, high + pad],
+                               autorange=False)
+    return dict(figure, layout=layout)
+
+
+# function to zoom a chart on a date range slider value, the whole data keeps the chart as it is
+def windowed(snap, figure, window):
+    first, last = window_bounds(snap, window)
+    if (first, last) == (0, len(snap.window_dates) - 1):
+        return figure
+    return window_figure(figure, first, last)
+
+
+# metrics of the map: value -> (label, suffix of the counts in the hover text). The averages are those of the 7 days
+# up to the last day of the window
+MAP_METRICS = {"total": ("Total", ""),
+               "per_100k": ("Total per 100k", " per 100k"),
+               "average": ("7-day average", " (7-day average)"),
+               "average_100k": ("7-day average per 100k", " per 100k (7-day average)")}
+
+
+# function to get the values of a map metric from date first to last for the states of the map, as floats
+def map_values(snap, metric, first, last):
+    states = snap.cplt_data["Province_State"]
+    full = (first, last) == (0, len(snap.window_dates) - 1)
+    values = {}
+    for name, cube, column in [("confirmed", snap.confirmed_cube, "US_state_confirmed_cases"),
+                               ("deaths", snap.deaths_cube, "US_state_deaths")]:
+        if metric.startswith("average"):
+            table = cube.rolling_averages("state", [7])[0][:, last]
+        elif full:
+            values[name] = snap.cplt_data[column].to_numpy(dtype=float)
+            table = None
+        else:
+            table = cube.window_totals("state", first, last)[0]
+        if table is not None:
+            positions = cube.label_positions["state"]
+            values[name] = np.array([table[positions[state]] if state in positions else np.nan for state in states],
+                                    dtype=float)
+        if metric.endswith("100k"):
+            values[name] = per_100k(values[name], snap.map_population)
+    return values
+
+
+# function to color the map by a metric of the cases from date first to last
+def map_figure(snap, metric, first, last):
+    figure = snap.fig_clp.to_plotly_json()
+    label, suffix = MAP_METRICS[metric]
+    values = map_values(snap, metric, first, last)
+    if metric == "total":
+        z = np.nan_to_num(values["confirmed"]).astype(np.int64)
+        texts = {name: ["**" if np.isnan(value) else str(int(value)) for value in series]
+                 for name, series in values.items()}
+    else:
+        z = np.round(values["confirmed"], 2)
+        texts = {name: ["**" if np.isnan(value) else str(round(value, 2)) for value in series]
+                 for name, series in values.items()}
+    text = ["{}<br>Confirmed Cases{}: {}<br>Deaths{}: {}".format(state, suffix, confirmed, suffix, deaths)
+            for state, confirmed, deaths in zip(snap.cplt_data["Province_State"], texts["confirmed"],
+                                                texts["deaths"])]
+    if metric.startswith("average"):
+        title = "{} to {}".format(label, snap.window_dates[last])
+    else:
+        title = "{} {}".format(label, window_period(snap, first, last))
+    trace = dict(figure["data"][0], z=z.tolist(), text=text,
+                 colorbar=dict(figure["data"][0].get("colorbar", {}), title={"text": title}))
+    return dict(figure, data=[trace])
+
+
+# function to get the map of a metric from date first to last, the maps of the whole data are those of derive_data
+def window_map(snap, first, last, metric="total"):
+    if (first, last) == (0, len(snap.window_dates) - 1) and metric in snap.map_figures:
+        return snap.map_figures[metric]
+    return map_figure(snap, metric, first, last)
+
+
+# function to get the positions of the counties of a state on the county map (into the county tables) and their FIPS
+# codes, the counties without a shape are left out ("Unassigned" and "Out of <state>" rows, FIPS 90xxx and 80xxx)
+def map_counties(cube, state):
+    start, stop = cube.state_counties.get(state, (0, 0))
+    fips = cube.county_fips[start:stop]
+    keep = np.flatnonzero(np.isfinite(fips) & (fips < 80000))
+    return start + keep, ["{:05d}".format(int(code)) for code in fips[keep]]
+
+
+# function to get the confirmed cases of a map metric from date first to last for the counties at `rows` of the
+# county tables and the title of their color bar
+def county_map_values(snap, metric, rows, first, last):
+    cube = snap.confirmed_cube
+    label = MAP_METRICS[metric][0]
+    if metric.startswith("average"):
+        # the 7-day averages of that day only, from two columns of the running totals: a county table of the
+        # averages would be a private copy in every worker, next to the shared county tables
+        values = (cube.window_totals("county", last - 6, last, rows)[1] if last >= 7
+                  else np.full(len(rows), np.nan))
+        title = "{} to {}".format(label, snap.window_dates[last])
+    else:
+        if (first, last) == (0, len(snap.window_dates) - 1):
+            values = cube.level_tables()["county"][1][rows, last].astype(float)
+        else:
+            values = cube.window_totals("county", first, last, rows)[0].astype(float)
+        title = "{} {}".format(label, window_period(snap, first, last))
+    if metric.endswith("100k"):
+        values = per_100k(values, snap.county_population[rows])
+    values = values.astype(np.int64).tolist() if metric == "total" else np.round(values, 2).tolist()
+    return [None if value != value else value for value in values], title
+
+
+# function for the county map of a state: the shapes are only referenced by their url (the browser downloads them
+# once and keeps them, see county_shapes), the figure carries the FIPS codes, names and values of the counties
+def county_map(snap, state, metric, first, last):
+    rows, fips = map_counties(snap.confirmed_cube, state)
+    try:
+        version = countygeometry.prepare().version if fips else None
+    except Exception as error:
+        app.logger.warning("County shapes are not available: %s", error)
+        version = None
+    if version is None:
+        figure = go.Figure()
+        figure.update_layout(title_text="County map not available for {}".format(state),
+                             xaxis_visible=False, yaxis_visible=False)
+        return figure
+    z, title = county_map_values(snap, metric, rows, first, last)
+    url = app.get_relative_path("/geometry/counties/{}.json?v={}".format(fips[0][:2], version))
+    figure = go.Figure(go.Choropleth(geojson=url, featureidkey="id", locations=fips, z=z,
+                                     text=snap.confirmed_cube.county_names[rows],
+                                     hovertemplate="%{text}<br>%{z}<extra></extra>", colorscale="Reds",
+                                     marker_line_width=0.5, colorbar_title_text=title))
+    figure.update_geos(fitbounds="locations", visible=False)
+    # uirevision keeps the zoom of the map while only its values change
+    figure.update_layout(title_text="Confirmed Cases in the Counties of {}".format(state), uirevision=state,
+                         margin=dict(l=0, r=0, b=0))
+    return figure
+
+
+# function to build the time-lapse of the map (the running total of the confirmed cases of every state on every
+# frame) in one pass over the state table: the totals of the first frame and the growth of every state from one
+# frame to the next, as a typed array of the narrowest integers that assets/timelapse.js adds up in the browser.
+# A frame is the first day of the data and every `step` days after it (and the last day), step is the smallest
+# that keeps the time-lapse within TIMELAPSE_BUDGET bytes. Returns the time-lapse and the figure of its last frame
+def timelapse_payload(confirmed_cube, fig_clp, states, window_dates):
+    positions = confirmed_cube.label_positions["state"]
+    table = confirmed_cube.level_tables()["state"][1]
+    table = np.vstack([table[positions[state]] if state in positions else np.zeros(table.shape[1], dtype=table.dtype)
+                       for state in states])
+    figure = json.loads(fig_clp.to_json())
+    trace = {key: value for key, value in figure["data"][0].items() if key not in ("z", "text")}
+    trace.update(text=list(states), hovertemplate="%{text}<br>Confirmed Cases: %{z}<extra></extra>", zmin=0,
+                 zmax=int(table.max()) if table.size else 0, colorbar={"title": {"text": "Cumulative Total"}})
+    last_day = table.shape[1] - 1
+    step = 1
+    while True:
+        days = np.unique(np.append(np.arange(0, last_day + 1, step), last_day))
+        frames = table[:, days]
+        payload = {"trace": trace, "layout": figure["layout"], "first_date": window_dates[0], "last_day": last_day,
+                   "step": step, "frames": len(days), "base": frames[:, 0].tolist(),
+                   "deltas": narrow_typed_array(np.diff(frames, axis=1).T.ravel())}
+        size = len(json.dumps(payload))
+        if size <= TIMELAPSE_BUDGET or len(days) <= 2:
+            break
+        step = max(step + 1, int(np.ceil(step * size / TIMELAPSE_BUDGET)))
+    last_frame = {"data": [dict(trace, z=frames[:, -1].tolist())],
+                  "layout": dict(figure["layout"], title={"text": "Confirmed Cases on {}".format(window_dates[-1])})}
+    return payload, last_frame
+
+
+# series of the comparison chart shown first, and the most search matches offered by its dropdown
+COMPARE_DEFAULT = ["state|New York", "state|California", "state|Texas", "state|Florida"]
+COMPARE_MATCHES = 50
+# transforms of the comparison chart: value -> (label, y axis label)
+COMPARE_TRANSFORMS = {"cumulative": ("Running Total", "Running Total"),
+                      "daily": ("Daily", "Daily Total"),
+                      "average": ("7-day average", "7-day Average of the Daily Totals")}
+
+
+# function for the dropdown options of the comparison chart, every state and then every county of the cube. The
+# values are "state|<state>" and "county|<state>|<county>"
+def compare_options(cube):
+    return ([{"label": state, "value": "state|{}".format(state)} for state in cube.states] +
+            [{"label": "{}, {}".format(county, state), "value": "county|{}|{}".format(state, county)}
+             for state, county in zip(cube.county_states, cube.county_names)])
+
+
+# function to turn a dropdown value of the comparison chart into a (level, name) key of CountyCube.series
+def compare_key(value):
+    parts = str(value).split("|")
+    if parts[0] == "state" and len(parts) == 2:
+        return "state", parts[1]
+    if parts[0] == "county" and len(parts) == 3:
+        return "county", (parts[1], parts[2])
+    return None
+
+
+# function to get the label of a metric of metric_series
+def metric_label(metric):
+    if metric in dailyreports.REPORT_METRICS:
+        return dailyreports.REPORT_METRICS[metric][0]
+    return "Deaths" if metric == "deaths" else "Confirmed Cases"
+
+
+# function to get many series of a metric ("confirmed", "deaths" or one of the daily reports, see dailyreports.py)
+# at once by their (level, name) keys of CountyCube.series, unknown keys are skipped. The metrics of the daily
+# reports only have states. Returns the keys found, their running totals (or report values), the series in the
+# transform of COMPARE_TRANSFORMS and the ISO dates of the columns
+def metric_series(snap, keys, metric, transform):
+    if metric in dailyreports.REPORT_METRICS:
+        reports = snap.reports or dailyreports.empty_table()
+        states, cumulative = reports.series(metric, [name for level, name in keys if level == "state"])
+        keys, cumulative = [("state", state) for state in states], cumulative.astype(np.float64)
+        dates = list(reports.dates)
+    else:
+        cube = snap.deaths_cube if metric == "deaths" else snap.confirmed_cube
+        keys, cumulative = cube.series(keys)
+        dates = snap.window_dates
+    if transform == "daily":
+        series = np.diff(cumulative, axis=1, prepend=np.nan)
+    elif transform == "average":
+        series = np.full(cumulative.shape, np.nan)
+        series[:, 7:] = (cumulative[:, 7:] - cumulative[:, :-7]) / 7
+        series = np.round(series, 2)
+    else:
+        series = cumulative
+    return keys, cumulative, series, dates
+
+
+# function to get the display name of a (level, name) key of metric_series
+def series_name(key):
+    level, name = key
+    return "{}, {}".format(*name[::-1]) if level == "county" else name
+
+
+# function for the comparison chart of up to COMPARE_LIMIT states and counties on shared axes. All series come from
+# one batched lookup (metric_series) and the figure is built as a dict with a day step instead of dates, so its
+# cost grows with the number of points drawn. With `threshold` every series starts on the day it reached that
+# many cases (or deaths), the series that never did are left out. The metrics of the daily reports are not aligned
+def compare_figure(snap, values, metric, transform, scale, threshold=None):
+    keys = [key for key in map(compare_key, values[:COMPARE_LIMIT]) if key is not None]
+    keys, cumulative, series, dates = metric_series(snap, keys, metric, transform)
+    label = metric_label(metric)
+    if metric in dailyreports.REPORT_METRICS:
+        threshold = None
+    layout = {"title": {"text": "<b>{} ({}) Compared</b>".format(label, COMPARE_TRANSFORMS[transform][0])},
+              "yaxis": {"title": {"text": "{} ({})".format(label, COMPARE_TRANSFORMS[transform][1])},
+                        "type": "log" if scale == "log" else "linear"},
+              "legend": {"x": 0.01, "y": 0.99, "bgcolor": "rgba(255, 255, 255, 0.6)"}}
+    if threshold:
+        series, starts = align_rows(series, cumulative, threshold)
+        x0, dx = 0, 1
+        layout["xaxis"] = {"title": {"text": "Days since {} {}".format(threshold, label.lower())}}
+    else:
+        starts = np.zeros(len(keys))
+        x0, dx = (dates or snap.window_dates)[0], DAY_MS
+        layout["xaxis"] = {"type": "date"}
+    data = [{"type": "scatter", "mode": "lines", "name": series_name(key), "x0": x0, "dx": dx,
+             "y": encode_array(row, False)}
+            for key, row, start in zip(keys, series, starts) if start >= 0]
+    if len(values) > COMPARE_LIMIT:
+        layout["title"]["text"] += "<br>the first {} of {} selections".format(COMPARE_LIMIT, len(values))
+    return {"data": data, "layout": layout}
+
+
+# metrics of the county leaderboard (see CountyCube.county_vector): value -> (label, column name)
+LEADERBOARD_METRICS = {"total": ("Running Total", "Total"),
+                       "growth": ("Last 7 Days", "Last 7 Days"),
+                       "per_100k": ("Per 100k People", "Per 100k")}
+LEADERBOARD_DEFAULT = 10
+
+
+# function for the rows of the county leaderboard: the n counties with the highest (or lowest, with order "bottom")
+# value of a metric, nationwide or within `state`. The county vectors are computed once per data version (see
+# derive_data), so a change of n, order or metric is one partial selection (top_rows) over one vector
+def leaderboard_rows(snap, kind, metric, order, state, n):
+    cube = snap.deaths_cube if kind == "deaths" else snap.confirmed_cube
+    vector = cube.county_vector(metric)
+    start, stop = cube.state_counties.get(state, (0, 0)) if state is not None else (0, None)
+    rows = top_rows(vector, min(n, LEADERBOARD_LIMIT), order != "bottom", start, stop)
+    return [{"rank": i + 1, "county": cube.county_names[row], "state": cube.county_states[row],
+             "value": round(float(vector[row]), 1) if metric == "per_100k" else int(vector[row])}
+            for i, row in enumerate(rows)]
+
+
+# function to build everything the dashboard displays from the cubes of both time series and their state
+# maxima. The result is never modified: a refresh builds a new one and swaps it in whole, so a callback that
+# holds the current data never sees a half updated state. The time series frames are not kept, everything is
+# derived from the cubes. `previous` is the data the cubes were extended from (see extend_data): what only depends on
+# the rows, such as the options of the comparison chart, is taken from it
+def derive_data(deaths_cube, confirmed_cube, state_max_deaths, state_max_confirmed, sources=None, reports=None,
+                previous=None):
+    # call functions to get daily and cumulative covid19 deaths in the US
+    Daily_deaths = get_US_daily_deaths(deaths_cube)
+    US_deaths = get_US_deaths(deaths_cube)
+
+    # call function to get daily and cumulative confirmed covid19 cases
+    Daily_confirmed_cases = get_US_daily_confirmed_cases(confirmed_cube)
+    US_Confirmed_cases = get_US_confirmed_cases(confirmed_cube)
+
+    # make df for the chloropleth, the highest cumulative value of every state
+    cplt_death = pd.DataFrame({"Province_State": deaths_cube.states, "Date": max(deaths_cube.dates),
+                               "US_state_deaths": state_max_deaths})
+    cplt_confirmed_cases = pd.DataFrame({"Province_State": confirmed_cube.states, "Date": max(confirmed_cube.dates),
+                                         "US_state_confirmed_cases": state_max_confirmed})
+    cplt_ = cplt_confirmed_cases.merge(cplt_death, how="left", on=["Province_State", "Date"])
+    cplt_data = cplt_.merge(states_abbr, how="left", on="Province_State")
+    cplt_data["text"] = cplt_data["Province_State"] + "<br>" + "Confirmed Cases: " + cplt_data[
+        "US_state_confirmed_cases"].astype(str) + \
+                        "<br>" + "Deaths: " + cplt_data["US_state_deaths"].astype(str)
+
+    # variables for plots
+    # total cumulative US confirmed cases and deaths
+    total_US_confirmed = Daily_confirmed_cases["Daily_Confirmed_Cases"].sum()
+    total_US_deaths = Daily_deaths["Daily_Deaths"].sum()
+    avg_US_state_confirmed = round(cplt_confirmed_cases["US_state_confirmed_cases"].mean(), 2)
+    avg_US_state_deaths = round(cplt_death["US_state_deaths"].mean(), 2)
+    states_max_c = cplt_confirmed_cases[
+        cplt_confirmed_cases.US_state_confirmed_cases == cplt_confirmed_cases["US_state_confirmed_cases"].max()]
+    states_min_c = cplt_confirmed_cases[
+        cplt_confirmed_cases.US_state_confirmed_cases == cplt_confirmed_cases["US_state_confirmed_cases"].min()]
+    states_max_d = cplt_death[cplt_death.US_state_deaths == cplt_death["US_state_deaths"].max()]
+    states_min_d = cplt_death[cplt_death.US_state_deaths == cplt_death["US_state_deaths"].min()]
+
+    fig_date = str(parser.parse(confirmed_cube.dates[-1]).date())
+    # dates of the date range sliders
+    window_dates = list(pd.to_datetime(pd.Series(confirmed_cube.dates), format="%m/%d/%y").dt.strftime("%Y-%m-%d"))
+    # the daily peaks of any window are looked up in the sparse tables of the national and state series, the rolling
+    # averages of the charts and the map are computed once for the data
+    for cube in (deaths_cube, confirmed_cube):
+        cube.peak_table("nation")
+        cube.peak_table("state")
+        cube.rolling_averages("nation", ROLLING_DAYS)
+        cube.rolling_averages("state", ROLLING_DAYS)
+    # population of the states of the map, only the deaths file has a Population column
+    state_population = deaths_cube.level_population("state")
+    positions = deaths_cube.label_positions["state"]
+    map_population = np.array([state_population[positions[state]]
+                               if state_population is not None and state in positions else 0
+                               for state in cplt_data["Province_State"]], dtype=np.int64)
+    county_population = confirmed_cube.level_population("county", deaths_cube)
+    if county_population is None:
+        county_population = np.zeros(len(confirmed_cube.county_names), dtype=np.int64)
+    # the county vectors of the leaderboard, computed once here for every metric
+    for cube in (confirmed_cube, deaths_cube):
+        population = cube.level_population("county", deaths_cube)
+        for metric in LEADERBOARD_METRICS:
+            cube.county_vector(metric, np.zeros(len(cube.county_names)) if population is None else population)
+    state_summaries = summarize_states(cplt_data, deaths_cube, confirmed_cube, fig_date)
+    # data version, the same in every worker that loaded the same data
+    version = "{}-{:08x}".format(fig_date, zlib.crc32(confirmed_cube.checksum().to_bytes(4, "little"),
+                                                      deaths_cube.checksum()))
+
+    # create and plot figures, or take them from the figure cache when a worker already did for this data
+    daily_deaths_fig = figure_cache.get((version, "US", "deaths", "daily"), lambda: bar_figure(
+        Daily_deaths, "Daily_Deaths", "<b>Daily Covid Deaths in the USA</b>", """Number of Deaths (Daily Total)""",
+        rolling_overlays(deaths_cube, "nation", "US")))
+    deaths_fig = figure_cache.get((version, "US", "deaths", "cumulative"), lambda: bar_figure(
+        US_deaths, "US_Deaths_Count", "<b>Cumulative Covid Deaths in the USA</b>",
+        """Number of Deaths (Running Total)"""))
+    daily_confirmed_fig = figure_cache.get((version, "US", "confirmed", "daily"), lambda: bar_figure(
+        Daily_confirmed_cases, "Daily_Confirmed_Cases", "<b>Daily Confirmed Covid Cases in the USA</b>",
+        """Number of New Cases (Daily Total)""", rolling_overlays(confirmed_cube, "nation", "US")))
+    confirmed_fig = figure_cache.get((version, "US", "confirmed", "cumulative"), lambda: bar_figure(
+        US_Confirmed_cases, "Confirmed_Cases", "<b>Cumulative Confirmed Covid Cases in the USA</b>",
+        """Number of New Cases (Running Total)"""))
+
+    # chloropleth map
+    df = cplt_data
+    df = df.reset_index()
+    locations = cplt_data["abbr"]
+
+    fig_clp = go.Figure(data=go.Choropleth(locations=locations,  # Spatial coordinates
+                                           z=df["US_state_confirmed_cases"],  # Data to be color-coded
+                                           locationmode="USA-states",  # set of locations match entries in `locations`
+                                           #     hoverinfo = locations + z, #df["Province_State"],
+                                           colorscale="Reds",  # "Plasma",# "Bluered",
+                                           autocolorscale=False,
+                                           text=df["text"],
+                                           colorbar_title="Cumulative Total",
+                                           )
+                        )
+
+    fig_clp.update_layout(  # title_text="Covid19 Deaths in the USA",
+        title_text="Click on a state on the map or select a state or territory from the dropdown list to view confirmed cases and deaths",
+        geo=dict(scope="usa",  # limit map scope to USA
+                 projection=go.layout.geo.Projection(type="albers usa"),
+                 showlakes=True,
+                 lakecolor="rgb(255, 255, 255)"
+                 )
+    )
+
+    timelapse, timelapse_fig = timelapse_payload(confirmed_cube, fig_clp, cplt_data["Province_State"], window_dates)
+
+    # dropdown options of the comparison chart, with their lower case labels for the search
+    old_cube = None if previous is None else previous.confirmed_cube
+    if (old_cube is None or not np.array_equal(old_cube.states, confirmed_cube.states)
+            or not np.array_equal(old_cube.county_states, confirmed_cube.county_states)
+            or not np.array_equal(old_cube.county_names, confirmed_cube.county_names)):
+        compare_choices = compare_options(confirmed_cube)
+        compare_search = [option["label"].lower() for option in compare_choices]
+    else:
+        compare_choices, compare_search = previous.compare_choices, previous.compare_search
+
+    snap = SimpleNamespace(
+        version=version, sources=sources, deaths_cube=deaths_cube, confirmed_cube=confirmed_cube,
+        state_max_deaths=state_max_deaths,
+        state_max_confirmed=state_max_confirmed, Daily_deaths=Daily_deaths, US_deaths=US_deaths,
+        Daily_confirmed_cases=Daily_confirmed_cases, US_Confirmed_cases=US_Confirmed_cases, cplt_death=cplt_death,
+        cplt_confirmed_cases=cplt_confirmed_cases, cplt_data=cplt_data, total_US_confirmed=total_US_confirmed,
+        total_US_deaths=total_US_deaths, avg_US_state_confirmed=avg_US_state_confirmed,
+        avg_US_state_deaths=avg_US_state_deaths, states_max_c=states_max_c, states_min_c=states_min_c,
+        states_max_d=states_max_d, states_min_d=states_min_d, fig_date=fig_date, window_dates=window_dates,
+        state_summaries=state_summaries,
+        daily_deaths_fig=daily_deaths_fig, deaths_fig=deaths_fig, daily_confirmed_fig=daily_confirmed_fig,
+        confirmed_fig=confirmed_fig, fig_clp=fig_clp, map_population=map_population,
+        county_population=county_population, timelapse=timelapse, timelapse_fig=timelapse_fig,
+        compare_choices=compare_choices, compare_search=compare_search, reports=reports, updated=time.time())
+    # the maps of every metric over the whole data
+    snap.map_figures = {metric: fig_clp if metric == "total" else map_figure(snap, metric, 0, len(window_dates) - 1)
+                        for metric in MAP_METRICS}
+    return snap
+
+
+# function to build the dashboard data from scratch
+def load_data(US_covid_deaths, US_confirmed_cases, sources=None, reports=None):
+    with stage("data.cubes"):
+        deaths_cube = cube_for(US_covid_deaths)
+        confirmed_cube = cube_for(US_confirmed_cases)
+        state_max_deaths = deaths_cube.aggregate("state")[2].max(axis=1)
+        state_max_confirmed = confirmed_cube.aggregate("state")[2].max(axis=1)
+    with stage("data.derive"):
+        return derive_data(deaths_cube, confirmed_cube, state_max_deaths, state_max_confirmed, sources, reports)
+
+
+# function to add the dates a cube gained to its state maxima
+def extend_state_max(old_cube, cube, state_max):
+    new_states = cube.aggregate("state", start=len(old_cube.dates))[2]
+    if not new_states.shape[1]:
+        return state_max
+    return np.maximum(state_max, new_states.max(axis=1))
+
+
+# function to build the dashboard data for time series that only gained new date columns since `current`:
+# only the new columns are appended to the cubes, only their sums are added to the level tables and the state
+# maxima, and the peak tables and rolling averages only gain the entries of the new dates. The figures, the maps,
+# the time-lapse and the leaderboard vectors are built again from the extended cubes. Anything else (new rows,
+# revised values) falls back to a full load
+def extend_data(current, US_covid_deaths, US_confirmed_cases, sources=None, reports=None):
+    with stage("data.extend"):
+        deaths_cube = current.deaths_cube.extend(US_covid_deaths)
+        confirmed_cube = current.confirmed_cube.extend(US_confirmed_cases)
+        if deaths_cube is None or confirmed_cube is None:
+            return load_data(US_covid_deaths, US_confirmed_cases, sources, reports)
+        state_max_deaths = extend_state_max(current.deaths_cube, deaths_cube, current.state_max_deaths)
+        state_max_confirmed = extend_state_max(current.confirmed_cube, confirmed_cube, current.state_max_confirmed)
+    with stage("data.derive"):
+        return derive_data(deaths_cube, confirmed_cube, state_max_deaths, state_max_confirmed, sources, reports,
+                           current)
+
+
+# function to read both time series through the local data cache, see datasource.py for the configurable source.
+# Both are fetched and parsed at once, their times are recorded as the data.fetch.<file> and data.parse.<file>
+# stages. With a shared data store the cubes are mapped from it instead and stand in for the frames
+def read_time_series():
+    with stage("data.read"):
+        if SHARED_DATA_DIR:
+            return open_store(SHARED_DATA_DIR)
+        datasets = load_datasets([DEATHS_FILE, CONFIRMED_FILE])
+        for filename, result in datasets.items():
+            name = os.path.splitext(filename)[0]
+            for step, seconds in [("fetch", result.fetch_seconds), ("parse", result.parse_seconds)]:
+                if seconds is not None:
+                    observe_stage("data.{}.{}".format(step, name), seconds)
+        US_covid_deaths, US_confirmed_cases = required_frames(datasets)
+        return US_covid_deaths, US_confirmed_cases, (snapshot_version(DEATHS_FILE), snapshot_version(CONFIRMED_FILE))
+
+
+# function to bring the store of the daily reports up to date (see dailyreports.py), only the new reports are
+# parsed. The dashboard keeps the reports it has when that fails
+def read_reports(current):
+    if not dailyreports.DAILY_REPORTS:
+        return None
+    try:
+        with stage("data.reports"):
+            return dailyreports.ingest()
+    except Exception:
+        app.logger.exception("Daily reports refresh failed")
+        return current
+
+
+# function to export the dashboard of a data snapshot as static files (see staticexport.py): the national figures
+# and texts, the map and the figures of both tabs and the summary of every state, everything the page shows before
+# a date window is picked. Returns the directory of the data
+def export_static(snap, directory=None):
+    first, last = window_bounds(snap, None)
+    national = {"summary": dict(zip(NATIONAL_SUMMARY_IDS, national_outputs(snap, first, last))),
+                "confirmed": {"tab-1": snap.daily_confirmed_fig, "tab-2": snap.confirmed_fig},
+                "deaths": {"tab-1": snap.daily_deaths_fig, "tab-2": snap.deaths_fig},
+                "map": snap.fig_clp,
+                "abbr": {summary["abbr"]: summary["Province_State"] for summary in snap.state_summaries.values()
+                         if isinstance(summary["abbr"], str)}}
+    states = {}
+    for state in drpdn:
+        if state not in snap.state_summaries:
+            continue
+        outputs = window_state_outputs(snap, snap.state_summaries[state]["Province_State"], first, last)
+        states[state] = {"summary": dict(zip(STATE_SUMMARY_IDS, outputs)),
+                         "confirmed": {"tab-1": state_figure(snap, state, "confirmed", "daily"),
+                                       "tab-2": state_figure(snap, state, "confirmed", "cumulative")},
+                         "deaths": {"tab-1": state_figure(snap, state, "deaths", "daily"),
+                                    "tab-2": state_figure(snap, state, "deaths", "cumulative")}}
+    with stage("export.write"):
+        return staticexport.write_export(directory or staticexport.STATIC_EXPORT_DIR, snap.version, national, states)
+
+
+# function to export the data after a load or refresh when COVID_STATIC_EXPORT_DIR is set, a failed export leaves
+# the previous one in place
+def refresh_export(snap):
+    if not staticexport.STATIC_EXPORT_DIR:
+        return
+    try:
+        with stage("refresh.export"):
+            export_static(snap)
+    except Exception:
+        app.logger.exception("Static export failed")
+
+
+# the data currently displayed, None until the first load (see data_loop) and then only ever replaced as a whole by
+# refresh_data
+data = None
+# set by the first data load
+data_ready = threading.Event()
+# error of the last failed first load attempt and seconds the first load took, reported by /readyz
+load_error = None
+load_seconds = None
+
+
+# function to pick up new data from the source and swap it in, the first call loads it from scratch
+def refresh_data():
+    global data
+    if SHARED_DATA_DIR:
+        # one worker at a time updates the store, the others pick up its new version
+        with stage("refresh.store"):
+            prepare_store(SHARED_DATA_DIR, wait=False)
+    US_covid_deaths, US_confirmed_cases, sources = read_time_series()
+    reports = read_reports(None if data is None else data.reports)
+    if data is None:
+        data = load_data(US_covid_deaths, US_confirmed_cases, sources, reports)
+        data_ready.set()
+        refresh_export(data)
+    elif sources != data.sources:
+        data = extend_data(data, US_covid_deaths, US_confirmed_cases, sources, reports)
+        with stage("refresh.prune"):
+            figure_cache.prune(data.version)
+        if FIGURE_WARMUP:
+            with stage("refresh.warmup"):
+                warm_figures(data)
+        refresh_export(data)
+    elif getattr(reports, "version", None) != getattr(data.reports, "version", None):
+        # only the reports changed, the rest of the data is kept as it is
+        data = SimpleNamespace(**dict(vars(data), reports=reports, updated=time.time()))
+    return data
+
+
+# background loop loading the data once the server is up, retrying every LOAD_RETRY seconds until it succeeds,
+# then refreshing it every REFRESH_INTERVAL seconds
+def data_loop():
+    global load_error, load_seconds
+    start = time.perf_counter()
+    while data is None:
+        try:
+            refresh_data()
+        except Exception as error:
+            load_error = repr(error)
+            app.logger.exception("Covid-19 data load failed")
+            time.sleep(LOAD_RETRY)
+    load_seconds = time.perf_counter() - start
+    load_error = None
+    try:
+        countygeometry.prepare()
+    except Exception as error:
+        app.logger.warning("County shapes are not available: %s", error)
+    if FIGURE_WARMUP:
+        threading.Thread(target=warm_figures, args=(data,), name="covid-figure-warmup", daemon=True).start()
+    while REFRESH_INTERVAL > 0:
+        time.sleep(REFRESH_INTERVAL)
+        try:
+            refresh_data()
+        except Exception:
+            app.logger.exception("Covid-19 data refresh failed")
+
+
+# function to wait for the first data load, for scripts driving the dashboard in process. It raises the error of
+# a failed attempt instead of waiting for the retries
+def wait_for_data():
+    while not data_ready.wait(0.05):
+        if load_error is not None:
+            raise RuntimeError("Covid-19 data load failed: {}".format(load_error))
+    return data
+
+
+# function to get the data for a callback, a callback of a page left open across a restart finds no data until the
+# first load finished and leaves its outputs alone
+def current_data():
+    snap = data
+    if snap is None:
+        raise PreventUpdate
+    return snap
+
+
 # call function to get state from clickData
-def get_state(code):
-    state = list(cplt_data[cplt_data.abbr == code]["Province_State"])[0]
+def get_state(snap, code):
+    state = snap.state_summaries[code]["Province_State"]
     return state
 
 
-# variables for plots
-# total cumulative US confirmed cases and deaths
-total_US_confirmed = Daily_confirmed_cases.sum().iloc[-1]
-total_US_deaths = Daily_deaths.sum().iloc[-1]
-avg_US_state_confirmed = round(cplt_confirmed_cases["US_state_confirmed_cases"].mean(), 2)
-avg_US_state_deaths = round(cplt_death["US_state_deaths"].mean(), 2)
-states_max_c = cplt_confirmed_cases[
-    cplt_confirmed_cases.US_state_confirmed_cases == cplt_confirmed_cases["US_state_confirmed_cases"].max()]
-states_min_c = cplt_confirmed_cases[
-    cplt_confirmed_cases.US_state_confirmed_cases == cplt_confirmed_cases["US_state_confirmed_cases"].min()]
-states_max_d = cplt_death[cplt_death.US_state_deaths == cplt_death["US_state_deaths"].max()]
-states_min_d = cplt_death[cplt_death.US_state_deaths == cplt_death["US_state_deaths"].min()]
-
-fig_date = str(parser.parse(list(get_US_state_confirmed_cases("US", US_confirmed_cases)["Date"].tail(1))[0]).date())
-
-# create and plot figures
-daily_deaths_fig = px.bar(Daily_deaths, x="Date", y="Daily_Deaths", title="<b>Daily Covid Deaths in the USA</b>",
-                          labels={"Daily_Deaths": """Number of Deaths (Daily Total)"""})
-deaths_fig = px.bar(US_deaths, x="Date", y="US_Deaths_Count", title="<b>Cumulative Covid Deaths in the USA</b>",
-                    labels={"US_Deaths_Count": """Number of Deaths (Running Total)"""})
-daily_confirmed_fig = px.bar(Daily_confirmed_cases, x="Date", y="Daily_Confirmed_Cases",
-                             title="<b>Daily Confirmed Covid Cases in the USA</b>",
-                             labels={"Daily_Confirmed_Cases": """Number of New Cases (Daily Total)"""})
-confirmed_fig = px.bar(US_Confirmed_cases, x="Date", y="Confirmed_Cases",
-                       title="<b>Cumulative Confirmed Covid Cases in the USA</b>",
-                       labels={"Confirmed_Cases": """Number of New Cases (Running Total)"""})
 tab_style = {"fontWeight": "bold", "fontSize": "20px", "color": "black", "borderRadius": "25px", "textAlign": "center",
              "line-height": "5px"}
 tab_selected_style = {"fontWeight": "bold", "fontSize": "20px", "color": "white", "borderRadius": "25px",
                       "line-height": "5px", "background": "rgb(190, 100, 200)", "textAlign": "center"}
-
-# chloropleth map
-df = cplt_data
-df = df.reset_index()
-locations = cplt_data["abbr"]
-
-fig_clp = go.Figure(data=go.Choropleth(locations=locations,  # Spatial coordinates
-                                       z=df["US_state_confirmed_cases"],  # Data to be color-coded
-                                       locationmode="USA-states",  # set of locations match entries in `locations`
-                                       #     hoverinfo = locations + z, #df["Province_State"],
-                                       colorscale="Reds",  # "Plasma",# "Bluered",
-                                       autocolorscale=False,
-                                       text=df["text"],
-                                       colorbar_title="Cumulative Total",
-                                       )
-                    )
-
-fig_clp.update_layout(  # title_text="Covid19 Deaths in the USA",
-    title_text="Click on a state on the map or select a state or territory from the dropdown list to view confirmed cases and deaths",
-    geo=dict(scope="usa",  # limit map scope to USA
-             projection=go.layout.geo.Projection(type="albers usa"),
-             showlakes=True,
-             lakecolor="rgb(255, 255, 255)"
-             )
-)
-
-app.layout = html.Div(children=([
-    html.Div(
-        html.H1(children="Covid-19 Dashboard for the United States of America"),
-        style={"textAlign": "center",
-               "border": "5px black",
-               "background": "rgb(190, 100, 200)",
-               "borderRadius": "15px",
-               "color": "white",
-               "fontWeight": "bold"
-               }
-    ),
-    # Total numbers
-    html.Div([html.Div(html.H4("Covid-19 Summary as of {}".format(fig_date))),
-              html.Div(html.H4("(All States and Territories inclusive)"),
-                       style={"fontSize": "10px"}),
-              html.Div(html.H4("Total Confirmed Cases: {}".format(total_US_confirmed)),
-                       style={"width": "50%", "display": "inline-block"}),
-              html.Div(html.H4("Total Deaths: {}".format(total_US_deaths)),
-                       style={"width": "50%", "display": "inline-block"}),
-              html.Div(html.H4("Avg Confirmed Cases in States: {}".format(avg_US_state_confirmed)),
-                       style={"width": "50%", "display": "inline-block"}),
-              html.Div(html.H4("Avg Deaths in States: {}".format(avg_US_state_deaths)),
-                       style={"width": "50%", "display": "inline-block"}),
-              html.Div(html.H4("""Max Confirmed Cases: {} ({})""".format(list(states_max_c.Province_State)[0],
-                                                                         list(states_max_c.US_state_confirmed_cases)[
-                                                                             0])),
-                       style={"width": "50%", "display": "inline-block"}),
-              html.Div(html.H4("""Max Deaths: {} ({})""".format(list(states_max_d.Province_State)[0],
-                                                                list(states_max_d.US_state_deaths)[0])),
-                       style={"width": "50%", "display": "inline-block"}),
-              html.Div(html.H4("""Min Confirmed Cases: {} ({})""".format(list(states_min_c.Province_State)[0],
-                                                                         list(states_min_c.US_state_confirmed_cases)[
-                                                                             0])),
-                       style={"width": "50%", "display": "inline-block"}),
-              html.Div(html.H4("""Min Deaths: {} ({})""".format(list(states_min_d.Province_State)[0],
-                                                                list(states_min_d.US_state_deaths)[0])),
-                       style={"width": "50%", "display": "inline-block"})
-              ],
-             style={"textAlign": "center",
-                    "border": "5px black",
-                    "background": "rgb(215, 100, 200)",
-                    "borderRadius": "25px",
-                    "color": "white",
-                    "fontWeight": "bold"}
-             ),
-    html.Br(),
-
-    # confirmed cases tabs
-    html.Div([
-        html.Div([dcc.Tabs(id="confirmed_tabs",
+header_style = {"textAlign": "center",
+                "border": "5px black",
+                "background": "rgb(190, 100, 200)",
+                "borderRadius": "15px",
+                "color": "white",
+                "fontWeight": "bold"
+                }
+
+
+# ids of the national summary texts, in the order of national_outputs
+NATIONAL_SUMMARY_IDS = ["us_summary_header", "us_total_confirmed", "us_total_deaths", "us_avg_confirmed",
+                        "us_avg_deaths", "us_max_confirmed", "us_max_deaths", "us_min_confirmed", "us_min_deaths",
+                        "us_daily_confirmed", "us_daily_deaths"]
+# ids of the state summary texts, in the order of window_state_outputs
+STATE_SUMMARY_IDS = ["selected_state_confirmed", "selected_state_death", "state_terr_header", "state_cnty_confirmed",
+                     "state_cnty_deaths", "county_max_c", "county_min_c", "county_max_d", "county_min_d",
+                     "state_footer", "state_daily_confirmed", "state_daily_deaths"]
+
+
+# function for a date range slider over the days of the data, marked at every half year
+def window_slider(id, snap):
+    dates = pd.to_datetime(snap.window_dates)
+    marks = {i: date.strftime("%b %Y") for i, date in enumerate(dates) if date.day == 1 and date.month in (1, 7)}
+    return dcc.RangeSlider(id=id, min=0, max=len(dates) - 1, value=[0, len(dates) - 1], marks=marks,
+                           allowCross=False, updatemode="drag")
+
+
+# function for the play button, the day slider and the map of the time-lapse. Its frames are only sent once the
+# button or the slider is first used (see assets/timelapse.js)
+def timelapse_controls(snap):
+    payload = snap.timelapse
+    days = np.minimum(np.arange(payload["frames"]) * payload["step"], payload["last_day"])
+    dates = pd.to_datetime(snap.window_dates[0]) + pd.to_timedelta(days, unit="D")
+    marks = {i: date.strftime("%b %Y") for i, date in enumerate(dates)
+             if date.month in (1, 7) and (i == 0 or dates[i - 1].month != date.month)}
+    return [html.Div([html.Button("Play", id="timelapse_play", n_clicks=0,
+                                  style={"width": "10%", "display": "inline-block", "verticalAlign": "top"}),
+                      html.Div(dcc.Slider(id="timelapse_day", min=0, max=payload["frames"] - 1,
+                                          value=payload["frames"] - 1, step=1, marks=marks, updatemode="drag"),
+                               style={"width": "90%", "display": "inline-block"})]),
+            dcc.Graph(id="timelapse_map", figure=snap.timelapse_fig),
+            dcc.Interval(id="timelapse_interval", interval=TIMELAPSE_INTERVAL, disabled=True),
+            dcc.Store(id="timelapse_request"),
+            dcc.Store(id="timelapse_data")]
+
+
+# function for the stores holding the figures of both tabs of every chart, used by the client side tab switching
+def tab_stores(snap):
+    if not CLIENTSIDE_TABS:
+        return []
+    return [dcc.Store(id="national_confirmed_figures",
+                      data={"tab-1": snap.daily_confirmed_fig, "tab-2": snap.confirmed_fig}),
+            dcc.Store(id="national_death_figures", data={"tab-1": snap.daily_deaths_fig, "tab-2": snap.deaths_fig}),
+            dcc.Store(id="state_confirmed_figures"),
+            dcc.Store(id="state_death_figures")]
+
+
+# function for the page served while the data loads, it reloads itself once /readyz says the data is there
+# (see assets/loading.js)
+def loading_layout():
+    return html.Div([
+        html.Div(
+            html.H1(children="Covid-19 Dashboard for the United States of America"),
+            style=header_style
+        ),
+        html.H4("Loading the latest Covid-19 data, the dashboard opens in a moment", style={"textAlign": "center"}),
+        dcc.Interval(id="loading_poll", interval=2000)
+    ])
+
+
+# function to build the layout from the current data, dash calls it on every page load so the summary
+# and the map show the latest refresh
+def serve_layout():
+    snap = data
+    if snap is None:
+        return loading_layout()
+    national = national_outputs(snap, *window_bounds(snap, None))
+    return html.Div(children=([
+        html.Div(
+            html.H1(children="Covid-19 Dashboard for the United States of America"),
+            style=header_style
+        ),
+        # Total numbers
+        html.Div([html.Div(html.H4(national[0], id="us_summary_header")),
+                  html.Div(html.H4("(All States and Territories inclusive)"),
+                           style={"fontSize": "10px"})] +
+                 [html.Div(html.H4(text, id=id), style={"width": "50%", "display": "inline-block"})
+                  for id, text in zip(NATIONAL_SUMMARY_IDS[1:], national[1:])
+                  ],
+                 style={"textAlign": "center",
+                        "border": "5px black",
+                        "background": "rgb(215, 100, 200)",
+                        "borderRadius": "25px",
+                        "color": "white",
+                        "fontWeight": "bold"}
+                 ),
+        html.Br(),
+        html.Div(window_slider("national_window", snap)),
+
+        # confirmed cases tabs
+        html.Div([
+            html.Div([dcc.Tabs(id="confirmed_tabs",
+                               value="tab-1",
+                               children=[dcc.Tab(label="Daily",
+                                                 value="tab-1",
+                                                 style=tab_style,
+                                                 selected_style=tab_selected_style
+                                                 ),
+                                         dcc.Tab(label="Running Total",
+                                                 value="tab-2",
+                                                 style=tab_style,
+                                                 selected_style=tab_selected_style
+                                                 )],
+                               ),
+                      dcc.Graph(id="confirmed_cases"),
+                      ], style={"width": "50%", "display": "inline-block", "borderRadius": "25px",
+                                "borderBottom": "1px solid rgb(214, 214, 214)"}
+                     ),
+
+            # deaths tabs
+            html.Div([dcc.Tabs(id="death_tabs",
+                               value="tab-1",
+                               children=[dcc.Tab(label="Daily",
+                                                 value="tab-1",
+                                                 style=tab_style,
+                                                 selected_style=tab_selected_style
+                                                 ),
+                                         dcc.Tab(label="Running Total",
+                                                 value="tab-2",
+                                                 style=tab_style,
+                                                 selected_style=tab_selected_style
+                                                 )],
+                               ),
+                      dcc.Graph(id="deaths")
+                      ], style={"width": "50%", "display": "inline-block", "borderRadius": "25px",
+                                "borderBottom": "1px solid rgb(214, 214, 214)"}
+                     )
+        ]),
+        html.Br(),
+        html.Br(),
+        html.Br(),
+
+        # US chloropleth map
+        html.Div(window_slider("state_window", snap)),
+        html.Div([html.H4(id="state_terr_header"),
+                  html.H4(id="selected_state_confirmed",
+                          style={"width": "50%", "display": "inline-block"}
+                          ),
+                  html.H4(id="selected_state_death",
+                          style={"width": "50%", "display": "inline-block"}
+                          ),
+                  html.H4(id="state_cnty_confirmed",
+                          style={"width": "50%", "display": "inline-block"}
+                          ),
+                  html.H4(id="state_cnty_deaths",
+                          style={"width": "50%", "display": "inline-block"}
+                          ),
+                  html.H4(id="county_max_c",
+                          style={"width": "50%", "display": "inline-block"}
+                          ),
+                  html.H4(id="county_max_d",
+                          style={"width": "50%", "display": "inline-block"}
+                          ),
+                  html.H4(id="county_min_c",
+                          style={"width": "50%", "display": "inline-block"}
+                          ),
+                  html.H4(id="county_min_d",
+                          style={"width": "50%", "display": "inline-block"}
+                          ),
+                  html.H4(id="state_daily_confirmed",
+                          style={"width": "50%", "display": "inline-block"}
+                          ),
+                  html.H4(id="state_daily_deaths",
+                          style={"width": "50%", "display": "inline-block"}
+                          ),
+                  html.Footer(id="state_footer",
+                              style={"width": "50%", "fontWeight": "normal", "fontSize": "15px"}
+                              )
+                  ],
+                 style={"textAlign": "center", "width": "100%", "display": "inline-block", "fontSize": "25px",
+                        "fontWeight": "bold", "border": "5px black", "background": "rgb(215, 100, 200)",
+                        "borderRadius": "25px", "color": "white"
+                        }),
+        html.Div(dcc.RadioItems(id="map_metric",
+                                options=[{"label": label, "value": value}
+                                         for value, (label, _) in MAP_METRICS.items()],
+                                value="total",
+                                labelStyle={"display": "inline-block", "marginRight": "20px"}
+                                ), style={"textAlign": "center"}),
+        html.Div(dcc.Graph(id="chloro_graph",
+                           figure=snap.fig_clp)),
+        html.Div(dcc.Graph(id="county_map")),
+        html.Div(timelapse_controls(snap)),
+
+        # states and territories dropdown
+        html.Div(dcc.Dropdown(id="territories",
+                              options=[{"label": i, "value": i} for i in drpdn],
+                              # value="US Territories"
+                              searchable=True,
+                              placeholder="Select a US State or Territory to display its Covid-19 data"
+                              )),
+        html.Br(),
+        html.Div(dcc.RadioItems(id="states_and_territories")),
+        html.Br(),
+        html.Div([dcc.Tabs(id="state_confirmed_tabs",
                            value="tab-1",
                            children=[dcc.Tab(label="Daily",
                                              value="tab-1",
@@ -381,16 +1206,14 @@ app.layout = html.Div(children=([
                                      dcc.Tab(label="Running Total",
                                              value="tab-2",
                                              style=tab_style,
-                                             selected_style=tab_selected_style
-                                             )],
+                                             selected_style=tab_selected_style)
+                                     ]
                            ),
-                  dcc.Graph(id="confirmed_cases"),
+                  dcc.Graph(id="state_confirmed")
                   ], style={"width": "50%", "display": "inline-block", "borderRadius": "25px",
                             "borderBottom": "1px solid rgb(214, 214, 214)"}
                  ),
-
-        # deaths tabs
-        html.Div([dcc.Tabs(id="death_tabs",
+        html.Div([dcc.Tabs(id="state_death_tabs",
                            value="tab-1",
                            children=[dcc.Tab(label="Daily",
                                              value="tab-1",
@@ -400,266 +1223,532 @@ app.layout = html.Div(children=([
                                      dcc.Tab(label="Running Total",
                                              value="tab-2",
                                              style=tab_style,
-                                             selected_style=tab_selected_style
-                                             )],
+                                             selected_style=tab_selected_style)
+                                     ]
                            ),
-                  dcc.Graph(id="deaths")
+                  dcc.Graph(id="state_death")
                   ], style={"width": "50%", "display": "inline-block", "borderRadius": "25px",
                             "borderBottom": "1px solid rgb(214, 214, 214)"}
-                 )
-    ]),
-    html.Br(),
-    html.Br(),
-    html.Br(),
-
-    # US chloropleth map
-    html.Div([html.H4(id="state_terr_header"),
-              html.H4(id="selected_state_confirmed",
-                      style={"width": "50%", "display": "inline-block"}
-                      ),
-              html.H4(id="selected_state_death",
-                      style={"width": "50%", "display": "inline-block"}
-                      ),
-              html.H4(id="state_cnty_confirmed",
-                      style={"width": "50%", "display": "inline-block"}
-                      ),
-              html.H4(id="state_cnty_deaths",
-                      style={"width": "50%", "display": "inline-block"}
-                      ),
-              html.H4(id="county_max_c",
-                      style={"width": "50%", "display": "inline-block"}
-                      ),
-              html.H4(id="county_max_d",
-                      style={"width": "50%", "display": "inline-block"}
-                      ),
-              html.H4(id="county_min_c",
-                      style={"width": "50%", "display": "inline-block"}
-                      ),
-              html.H4(id="county_min_d",
-                      style={"width": "50%", "display": "inline-block"}
-                      ),
-              html.Footer(id="state_footer",
-                          style={"width": "50%", "fontWeight": "normal", "fontSize": "15px"}
-                          )
-              ],
-             style={"textAlign": "center", "width": "100%", "display": "inline-block", "fontSize": "25px",
-                    "fontWeight": "bold", "border": "5px black", "background": "rgb(215, 100, 200)",
-                    "borderRadius": "25px", "color": "white"
-                    }),
-    html.Div(dcc.Graph(id="chloro_graph",
-                       figure=fig_clp)),
-
-    # states and territories dropdown
-    html.Div(dcc.Dropdown(id="territories",
-                          options=[{"label": i, "value": i} for i in drpdn],
-                          # value="US Territories"
-                          searchable=True,
-                          placeholder="Select a US State or Territory to display its Covid-19 data"
-                          )),
-    html.Br(),
-    html.Div(dcc.RadioItems(id="states_and_territories")),
-    html.Br(),
-    html.Div([dcc.Tabs(id="state_confirmed_tabs",
-                       value="tab-1",
-                       children=[dcc.Tab(label="Daily",
-                                         value="tab-1",
-                                         style=tab_style,
-                                         selected_style=tab_selected_style
-                                         ),
-                                 dcc.Tab(label="Running Total",
-                                         value="tab-2",
-                                         style=tab_style,
-                                         selected_style=tab_selected_style)
-                                 ]
-                       ),
-              dcc.Graph(id="state_confirmed")
-              ], style={"width": "50%", "display": "inline-block", "borderRadius": "25px",
-                        "borderBottom": "1px solid rgb(214, 214, 214)"}
-             ),
-    html.Div([dcc.Tabs(id="state_death_tabs",
-                       value="tab-1",
-                       children=[dcc.Tab(label="Daily",
-                                         value="tab-1",
-                                         style=tab_style,
-                                         selected_style=tab_selected_style
-                                         ),
-                                 dcc.Tab(label="Running Total",
-                                         value="tab-2",
-                                         style=tab_style,
-                                         selected_style=tab_selected_style)
-                                 ]
-                       ),
-              dcc.Graph(id="state_death")
-              ], style={"width": "50%", "display": "inline-block", "borderRadius": "25px",
-                        "borderBottom": "1px solid rgb(214, 214, 214)"}
-             ),
-    html.Footer(id="data-source",
-                children=[html.H6(dcc.Link("Data Source: JHU CSSE COVID-19 Dataset",
-                                           href="https://github.com/CSSEGISandData/COVID-19/tree/master/csse_covid_19_data/csse_covid_19_time_series",
-                                           target='_blank',
-                                           style={"width": "50%", "display": "inline-block", "borderRadius": "25px",
-                                                  "fontSize": "10px", "color": "black"}))
-                          ]
-                ),
-]))
-
-
-@app.callback(Output("confirmed_cases", "figure"),
-              [Input("confirmed_tabs", "value")])
-def render_confirmed(tab):
-    if tab == "tab-1":
-        figure = daily_confirmed_fig
-        figure.update_xaxes(nticks=20)
-        return figure
-    elif tab == "tab-2":
-        figure = confirmed_fig
-        figure.update_xaxes(nticks=20)
-        return figure
-
-
-@app.callback(Output("deaths", "figure"),
-              [Input("death_tabs", "value")])
-def render_deaths(tab):
-    if tab == "tab-1":
-        figure = daily_deaths_fig
-        figure.update_xaxes(nticks=20)
-        return figure
-    elif tab == "tab-2":
-        figure = deaths_fig
-        figure.update_xaxes(nticks=20)
-        return figure
-
-
-# chloropleth and dropdown state confirmed callbacks
-@app.callback(Output("state_confirmed", "figure"),
-              [Input("state_confirmed_tabs", "value"),
-               Input("states_and_territories", "value")])
-def display_click_data(tab, state):
-    # state confirmed cases dfs
-    Daily_state_confirmed = get_US_state_daily_confirmed_cases(state, US_confirmed_cases)
-    US_state_confirmed = get_US_state_confirmed_cases(state, US_confirmed_cases)
-
-    # state confirmed cases figs
-    state_daily_confirmed_fig = px.bar(Daily_state_confirmed, x="Date", y="US_state_daily_confirmed_cases",
-                                       title="<b>Daily Confirmed Covid Cases in {}</b>".format(state),
-                                       labels={
-                                           "US_state_daily_confirmed_cases": """Number of New Cases (Daily Total)"""})
-
-    state_confirmed_fig = px.bar(US_state_confirmed, x="Date", y="US_state_confirmed_cases",
-                                 title="<b>Confirmed Covid Cases in {}</b>".format(state),
-                                 labels={"US_state_confirmed_cases": """Number of New Cases (Running Total)"""})
-
-    if tab == "tab-1":
-        figure = state_daily_confirmed_fig
-        figure.update_xaxes(nticks=20)
-        return figure
-    else:
-        tab == "tab-2"
-        figure = state_confirmed_fig
-        figure.update_xaxes(nticks=20)
-        return figure
-
-    return figure
-
-
-@app.callback([Output("selected_state_confirmed", "children"),
-               Output("selected_state_death", "children"),
-               Output("state_terr_header", "children"),
-               Output("state_cnty_confirmed", "children"),
-               Output("state_cnty_deaths", "children"),
-               Output("county_max_c", "children"),
-               Output("county_min_c", "children"),
-               Output("county_max_d", "children"),
-               Output("county_min_d", "children"),
-               Output("state_footer", "children")],
-              [Input("states_and_territories", "value")])
-def display_click_data(state):
-    # state confirmed cases dfs
-    state_confirmed = "Total Confirmed Cases: {} ".format(
-        str(list(cplt_data[cplt_data.Province_State == state]["US_state_confirmed_cases"])[0]))
-    state_deaths = "Total Deaths: {} ".format(
-        str(list(cplt_data[cplt_data.Province_State == state]["US_state_deaths"])[0]))
-    state_header = "Covid-19 Summary for {} as of {}".format(state, fig_date)
-    if state in no_counties:
-        county_avg_confirmed = "Avg Confirmed Cases in counties: **"
-        county_avg_deaths = "Avg Deaths in counties: **"
-        max_c = """Max Confirmed Cases: **"""
-        min_c = """Min Confirmed Cases: **"""
-        max_d = """Max Deaths: **"""
-        min_d = """Min Deaths: **"""
-        state_footer = """**County data not available"""
-    else:
-        county_confirmed = get_US_state_confirmed_cases(state, US_confirmed_cases, 'C').groupby(
-            ['Admin2']).max().reset_index()
-        county_avg_confirmed = "Avg Confirmed Cases in counties: {}".format(
-            round(county_confirmed["US_state_confirmed_cases"].mean(), 2))
-        county_deaths = get_US_state_deaths(state, US_covid_deaths, 'C').groupby(['Admin2']).max().reset_index()
-        county_avg_deaths = "Avg Deaths in counties: {}".format(round(county_deaths["US_state_deaths"].mean(), 2))
-        cnt_max_c = county_confirmed[
-            county_confirmed.US_state_confirmed_cases == county_confirmed["US_state_confirmed_cases"].max()]
-        cnt_min_c = county_confirmed[
-            county_confirmed.US_state_confirmed_cases == county_confirmed["US_state_confirmed_cases"].min()]
-        max_c = """Max Confirmed Cases: {} ({})""".format(list(cnt_max_c.Admin2)[0],
-                                                          list(cnt_max_c.US_state_confirmed_cases)[0])
-        min_c = """Min Confirmed Cases: {} ({})""".format(list(cnt_min_c.Admin2)[0],
-                                                          list(cnt_min_c.US_state_confirmed_cases)[0])
-        cnt_max_d = county_deaths[county_deaths.US_state_deaths == county_deaths["US_state_deaths"].max()]
-        cnt_min_d = county_deaths[county_deaths.US_state_deaths == county_deaths["US_state_deaths"].min()]
-        max_d = """Max Deaths: {} ({})""".format(list(cnt_max_d.Admin2)[0], list(cnt_max_d.US_state_deaths)[0])
-        min_d = """Min Deaths: {} ({})""".format(list(cnt_min_d.Admin2)[0], list(cnt_min_d.US_state_deaths)[0])
-        state_footer = ""
-
-    return state_confirmed, state_deaths, state_header, county_avg_confirmed, county_avg_deaths, max_c, min_c, max_d, min_d, state_footer
-
-
-# chloropleth and dropdown state deaths callback
-@app.callback(Output("state_death", "figure"),
-              [Input("state_death_tabs", "value"),
-               Input("states_and_territories", "value")])
-def display_click_data(tab, state):
-    # state deaths dfs
-    Daily_state_deaths = get_US_state_daily_deaths(state, US_covid_deaths)
-    US_state_deaths = get_US_state_deaths(state, US_covid_deaths)
-
-    # state deaths figs
-    state_daily_death_fig = px.bar(Daily_state_deaths, x="Date", y="US_state_daily_deaths",
-                                   title="<b>Daily Covid Deaths in {}</b>".format(state),
-                                   labels={"US_state_daily_deaths": """Number of Deaths (Daily Total)"""})
-    state_death_fig = px.bar(US_state_deaths, x="Date", y="US_state_deaths",
-                             title="<b>Cumulative Covid Deaths in {}</b>".format(state),
-                             labels={"US_state_deaths": """Number of Deaths (Running Total)"""})
-    #
-    if tab == "tab-1":
-        figure = state_daily_death_fig
-        figure.update_xaxes(nticks=20)
-        return figure
-    else:
-        tab == "tab-2"
-        figure = state_death_fig
-        figure.update_xaxes(nticks=20)
-        return figure
-
-    return figure
-
-
-# chloropleth and dropdown state deaths callback
-@app.callback(Output("states_and_territories", "value"),
-              [Input("chloro_graph", "clickData"),
-               Input("territories", "value")])
-def display_click_data(clickData, dropdown):
-    # get state from map click or dropdown input
-    ctx = dash.callback_context
-    if clickData is None and dropdown is None:
-        state = "Florida"
-    else:
-        pie = ctx.triggered[0]["prop_id"].split(".")[0]
-        if pie == "territories":
-            state = dropdown
+                 ),
+        # comparison of states and counties
+        html.Div([html.H4("Compare States and Counties", style={"textAlign": "center"}),
+                  dcc.Dropdown(id="compare_series",
+                               options=[option for option in snap.compare_choices
+                                        if option["value"].startswith("state|")],
+                               value=COMPARE_DEFAULT,
+                               multi=True,
+                               placeholder="Select up to {} states or counties, type to find a county".format(
+                                   COMPARE_LIMIT)
+                               ),
+                  html.Div([dcc.RadioItems(id="compare_metric",
+                                           options=[{"label": "Confirmed Cases", "value": "confirmed"},
+                                                    {"label": "Deaths", "value": "deaths"}] +
+                                                   [{"label": label, "value": value}
+                                                    for value, (label, _) in dailyreports.REPORT_METRICS.items()
+                                                    if dailyreports.DAILY_REPORTS],
+                                           value="confirmed",
+                                           labelStyle={"display": "inline-block", "marginRight": "10px"}),
+                            dcc.RadioItems(id="compare_transform",
+                                           options=[{"label": label, "value": value}
+                                                    for value, (label, _) in COMPARE_TRANSFORMS.items()],
+                                           value="cumulative",
+                                           labelStyle={"display": "inline-block", "marginRight": "10px"}),
+                            dcc.RadioItems(id="compare_scale",
+                                           options=[{"label": "Linear", "value": "linear"},
+                                                    {"label": "Log", "value": "log"}],
+                                           value="linear",
+                                           labelStyle={"display": "inline-block", "marginRight": "10px"}),
+                            dcc.Checklist(id="compare_align",
+                                          options=[{"label": "Align by days since case number", "value": "align"}],
+                                          value=[],
+                                          labelStyle={"display": "inline-block"}),
+                            dcc.Input(id="compare_threshold", type="number", value=100, min=1, debounce=True,
+                                      style={"width": "100px"})
+                            ], style={"textAlign": "center"}),
+                  dcc.Graph(id="compare_graph")
+                  ]),
+        # county leaderboard
+        html.Div([html.H4("County Leaderboard", style={"textAlign": "center"}),
+                  html.Div([dcc.RadioItems(id="leaderboard_kind",
+                                           options=[{"label": "Confirmed Cases", "value": "confirmed"},
+                                                    {"label": "Deaths", "value": "deaths"}],
+                                           value="confirmed",
+                                           labelStyle={"display": "inline-block", "marginRight": "10px"}),
+                            dcc.RadioItems(id="leaderboard_metric",
+                                           options=[{"label": label, "value": value}
+                                                    for value, (label, _) in LEADERBOARD_METRICS.items()],
+                                           value="total",
+                                           labelStyle={"display": "inline-block", "marginRight": "10px"}),
+                            dcc.RadioItems(id="leaderboard_order",
+                                           options=[{"label": "Top", "value": "top"},
+                                                    {"label": "Bottom", "value": "bottom"}],
+                                           value="top",
+                                           labelStyle={"display": "inline-block", "marginRight": "10px"}),
+                            dcc.RadioItems(id="leaderboard_scope",
+                                           options=[{"label": "Nationwide", "value": "nation"},
+                                                    {"label": "Selected state", "value": "state"}],
+                                           value="nation",
+                                           labelStyle={"display": "inline-block", "marginRight": "10px"}),
+                            dcc.Input(id="leaderboard_size", type="number", value=LEADERBOARD_DEFAULT, min=1,
+                                      max=LEADERBOARD_LIMIT, debounce=True, style={"width": "100px"})
+                            ], style={"textAlign": "center"}),
+                  dash_table.DataTable(id="leaderboard",
+                                       columns=[{"name": "Rank", "id": "rank"}, {"name": "County", "id": "county"},
+                                                {"name": "State", "id": "state"}, {"name": "Total", "id": "value"}],
+                                       sort_action="native",
+                                       style_cell={"textAlign": "center"})
+                  ]),
+        html.Footer(id="data-source",
+                    children=[html.H6(dcc.Link("Data Source: JHU CSSE COVID-19 Dataset",
+                                               href="https://github.com/CSSEGISandData/COVID-19/tree/master/csse_covid_19_data/csse_covid_19_time_series",
+                                               target='_blank',
+                                               style={"width": "50%", "display": "inline-block", "borderRadius": "25px",
+                                                      "fontSize": "10px", "color": "black"}))
+                              ]
+                    ),
+    ] + tab_stores(snap)))
+
+
+# function to register the callbacks of the dashboard on a dash app
+def register_callbacks(app):
+    # decorator registering a server side tab callback, it does nothing when the tabs are switched in the browser
+    def tab_callback(*args):
+        if CLIENTSIDE_TABS:
+            return lambda function: function
+        return app.callback(*args)
+
+    @tab_callback(Output("confirmed_cases", "figure"),
+                  [Input("confirmed_tabs", "value"),
+                   Input("national_window", "value")])
+    @timed
+    def render_confirmed(tab, window):
+        snap = current_data()
+        if tab == "tab-1":
+            return windowed(snap, snap.daily_confirmed_fig, window)
+        elif tab == "tab-2":
+            return windowed(snap, snap.confirmed_fig, window)
+
+    @tab_callback(Output("deaths", "figure"),
+                  [Input("death_tabs", "value"),
+                   Input("national_window", "value")])
+    @timed
+    def render_deaths(tab, window):
+        snap = current_data()
+        if tab == "tab-1":
+            return windowed(snap, snap.daily_deaths_fig, window)
+        elif tab == "tab-2":
+            return windowed(snap, snap.deaths_fig, window)
+
+    @app.callback([Output(id, "children") for id in NATIONAL_SUMMARY_IDS],
+                  [Input("national_window", "value")])
+    @timed
+    def display_national_summary(window):
+        snap = current_data()
+        return national_outputs(snap, *window_bounds(snap, window))
+
+    # chloropleth and dropdown state confirmed callbacks
+    @tab_callback(Output("state_confirmed", "figure"),
+                  [Input("state_confirmed_tabs", "value"),
+                   Input("states_and_territories", "value"),
+                   Input("state_window", "value")])
+    @timed
+    def display_click_data(tab, state, window):
+        snap = current_data()
+        if tab == "tab-1":
+            return windowed(snap, state_figure(snap, state, "confirmed", "daily"), window)
         else:
-            single_state = clickData["points"][0]["location"]
-            state = get_state(single_state)
-    return state
-
+            return windowed(snap, state_figure(snap, state, "confirmed", "cumulative"), window)
+
+    @app.callback([Output(id, "children") for id in STATE_SUMMARY_IDS],
+                  [Input("states_and_territories", "value"),
+                   Input("state_window", "value")])
+    @timed
+    def display_click_data(state, window):
+        snap = current_data()
+        summary = snap.state_summaries.get(state)
+        if summary is None:
+            raise PreventUpdate
+        return window_state_outputs(snap, summary["Province_State"], *window_bounds(snap, window))
+
+    # chloropleth and dropdown state deaths callback
+    @tab_callback(Output("state_death", "figure"),
+                  [Input("state_death_tabs", "value"),
+                   Input("states_and_territories", "value"),
+                   Input("state_window", "value")])
+    @timed
+    def display_click_data(tab, state, window):
+        snap = current_data()
+        if tab == "tab-1":
+            return windowed(snap, state_figure(snap, state, "deaths", "daily"), window)
+        else:
+            return windowed(snap, state_figure(snap, state, "deaths", "cumulative"), window)
+
+    # the map shows a metric of the cases of the state window
+    @app.callback(Output("chloro_graph", "figure"),
+                  [Input("state_window", "value"),
+                   Input("map_metric", "value")])
+    @timed
+    def display_window_map(window, metric):
+        snap = current_data()
+        return window_map(snap, *window_bounds(snap, window), metric if metric in MAP_METRICS else "total")
+
+    # the county map of the selected state is sent whole when the state changes, the metric and the date window only
+    # replace its values (and their color bar title)
+    @app.callback(Output("county_map", "figure"),
+                  [Input("states_and_territories", "value"),
+                   Input("map_metric", "value"),
+                   Input("state_window", "value")])
+    @timed
+    def display_county_map(state, metric, window):
+        snap = current_data()
+        summary = snap.state_summaries.get(state)
+        if summary is None:
+            raise PreventUpdate
+        state = summary["Province_State"]
+        metric = metric if metric in MAP_METRICS else "total"
+        first, last = window_bounds(snap, window)
+        if dash.callback_context.triggered_id in (None, "states_and_territories"):
+            return county_map(snap, state, metric, first, last)
+        rows, fips = map_counties(snap.confirmed_cube, state)
+        # a state without a county map has nothing to update
+        if not fips or not countygeometry.available():
+            raise PreventUpdate
+        z, title = county_map_values(snap, metric, rows, first, last)
+        patch = Patch()
+        patch["data"][0]["z"] = z
+        patch["data"][0]["colorbar"]["title"]["text"] = title
+        return patch
+
+    # comparison chart of the selected states and counties
+    @app.callback(Output("compare_graph", "figure"),
+                  [Input("compare_series", "value"),
+                   Input("compare_metric", "value"),
+                   Input("compare_transform", "value"),
+                   Input("compare_scale", "value"),
+                   Input("compare_align", "value"),
+                   Input("compare_threshold", "value")])
+    @timed
+    def display_comparison(values, metric, transform, scale, align, threshold):
+        snap = current_data()
+        threshold = max(int(threshold or 1), 1) if align and "align" in align else None
+        transform = transform if transform in COMPARE_TRANSFORMS else "cumulative"
+        return compare_figure(snap, values or [], metric, transform, scale, threshold)
+
+    # the counties are only offered once searched for, next to the selected series
+    @app.callback(Output("compare_series", "options"),
+                  [Input("compare_series", "search_value")],
+                  [State("compare_series", "value")])
+    @timed
+    def search_compare_options(search, selected):
+        if not search:
+            raise PreventUpdate
+        snap = current_data()
+        selected = set(selected or [])
+        search = search.lower()
+        matches = [option for option, label in zip(snap.compare_choices, snap.compare_search)
+                   if search in label and option["value"] not in selected]
+        return ([option for option in snap.compare_choices if option["value"] in selected] +
+                matches[:COMPARE_MATCHES])
+
+    # county leaderboard, sorted by another column in the browser
+    @app.callback([Output("leaderboard", "data"),
+                   Output("leaderboard", "columns")],
+                  [Input("leaderboard_kind", "value"),
+                   Input("leaderboard_metric", "value"),
+                   Input("leaderboard_order", "value"),
+                   Input("leaderboard_scope", "value"),
+                   Input("leaderboard_size", "value"),
+                   Input("states_and_territories", "value")],
+                  [State("leaderboard", "data")])
+    @timed
+    def display_leaderboard(kind, metric, order, scope, size, state, rows):
+        snap = current_data()
+        # a nationwide table does not change with the state, but it is filled when the page loads, where this
+        # callback runs after the state callback
+        if scope != "state" and rows and dash.callback_context.triggered_id == "states_and_territories":
+            raise PreventUpdate
+        metric = metric if metric in LEADERBOARD_METRICS else "total"
+        summary = snap.state_summaries.get(state) if scope == "state" else None
+        state = None if summary is None else summary["Province_State"]
+        rows = leaderboard_rows(snap, kind, metric, order, state, int(size or LEADERBOARD_DEFAULT))
+        return rows, [{"name": "Rank", "id": "rank"}, {"name": "County", "id": "county"},
+                      {"name": "State", "id": "state"}, {"name": LEADERBOARD_METRICS[metric][1], "id": "value"}]
+
+    # time-lapse of the map: the button and the interval move the day slider and the slider picks the frame in the
+    # browser, the frames are sent once on the first use of the button or the slider (see assets/timelapse.js)
+    app.clientside_callback(ClientsideFunction(namespace="timelapse", function_name="playback"),
+                            [Output("timelapse_interval", "disabled"),
+                             Output("timelapse_play", "children"),
+                             Output("timelapse_day", "value")],
+                            [Input("timelapse_play", "n_clicks"),
+                             Input("timelapse_interval", "n_intervals")],
+                            [State("timelapse_interval", "disabled"),
+                             State("timelapse_day", "value"),
+                             State("timelapse_day", "max")],
+                            prevent_initial_call=True)
+    app.clientside_callback(ClientsideFunction(namespace="timelapse", function_name="request_frames"),
+                            Output("timelapse_request", "data"),
+                            [Input("timelapse_play", "n_clicks"),
+                             Input("timelapse_day", "value")],
+                            prevent_initial_call=True)
+    app.clientside_callback(ClientsideFunction(namespace="timelapse", function_name="show_frame"),
+                            Output("timelapse_map", "figure"),
+                            [Input("timelapse_day", "value"),
+                             Input("timelapse_data", "data")])
+
+    @app.callback(Output("timelapse_data", "data"),
+                  [Input("timelapse_request", "data")])
+    @timed
+    def ship_timelapse(requested):
+        if not requested:
+            raise PreventUpdate
+        return current_data().timelapse
+
+    if CLIENTSIDE_TABS:
+        # the tabs pick a figure from their store in the browser and zoom it on the date window, see assets/tabs.js
+        for graph, tabs, figures, window in [
+                ("confirmed_cases", "confirmed_tabs", "national_confirmed_figures", "national_window"),
+                ("deaths", "death_tabs", "national_death_figures", "national_window"),
+                ("state_confirmed", "state_confirmed_tabs", "state_confirmed_figures", "state_window"),
+                ("state_death", "state_death_tabs", "state_death_figures", "state_window")]:
+            app.clientside_callback(ClientsideFunction(namespace="tabs", function_name="select_figure"),
+                                    Output(graph, "figure"),
+                                    [Input(tabs, "value"), Input(figures, "data"), Input(window, "value")],
+                                    [State(window, "max")])
+
+        # both tabs of the state charts are shipped once per state selection
+        @app.callback([Output("state_confirmed_figures", "data"),
+                       Output("state_death_figures", "data")],
+                      [Input("states_and_territories", "value")])
+        @timed
+        def ship_state_figures(state):
+            snap = current_data()
+            return ({"tab-1": state_figure(snap, state, "confirmed", "daily"),
+                     "tab-2": state_figure(snap, state, "confirmed", "cumulative")},
+                    {"tab-1": state_figure(snap, state, "deaths", "daily"),
+                     "tab-2": state_figure(snap, state, "deaths", "cumulative")})
+
+    # the page served while the data loads polls /readyz, see assets/loading.js
+    app.clientside_callback(ClientsideFunction(namespace="loading", function_name="reload_when_ready"),
+                            Output("loading_poll", "disabled"),
+                            [Input("loading_poll", "n_intervals")])
+
+    # chloropleth and dropdown state deaths callback
+    @app.callback(Output("states_and_territories", "value"),
+                  [Input("chloro_graph", "clickData"),
+                   Input("territories", "value")])
+    @timed
+    def display_click_data(clickData, dropdown):
+        # get state from map click or dropdown input
+        ctx = dash.callback_context
+        if clickData is None and dropdown is None:
+            state = "Florida"
+        else:
+            pie = ctx.triggered[0]["prop_id"].split(".")[0]
+            if pie == "territories":
+                state = dropdown
+            else:
+                single_state = clickData["points"][0]["location"]
+                state = get_state(current_data(), single_state)
+        return state
+
+
+# /healthz answers as soon as the server is up
+def healthz():
+    return jsonify(status="ok")
+
+
+# /geometry/counties/<state FIPS>.json serves the simplified county shapes of a state, their url holds the version
+# of the shapes so that the browser keeps them for good
+def county_shapes(state_fips):
+    try:
+        shapes = countygeometry.state_shapes(state_fips) if state_fips.isdigit() else None
+    except Exception as error:
+        app.logger.warning("County shapes are not available: %s", error)
+        abort(503)
+    if shapes is None:
+        abort(404)
+    response = Response(shapes, mimetype="application/json")
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.set_etag(countygeometry.prepare().version)
+    return response.make_conditional(request)
+
+
+# function to read the query of /api/v1/series into a tuple (level, names, metric, transform, from, to, format),
+# names is None for all series of the level. Raises ValueError for a bad query
+def series_query(args):
+    level = args.get("level", "state")
+    if level not in ("nation", "state", "county"):
+        raise ValueError("level must be nation, state or county")
+    metric = args.get("metric", "confirmed")
+    report_metric = dailyreports.DAILY_REPORTS and metric in dailyreports.REPORT_METRICS
+    if metric not in ("confirmed", "deaths") and not (report_metric and level == "state"):
+        raise ValueError("unknown metric {!r} for the {} level".format(metric, level))
+    transform = args.get("transform", "cumulative")
+    if transform not in COMPARE_TRANSFORMS:
+        raise ValueError("transform must be one of {}".format(", ".join(COMPARE_TRANSFORMS)))
+    names = [name.strip() for value in args.getlist("names") for name in value.split("|") if name.strip()] or None
+    if names is not None and level == "county":
+        if not all(", " in name for name in names):
+            raise ValueError("county names are written <county>, <state>")
+        names = [tuple(name.rsplit(", ", 1)[::-1]) for name in names]
+    first, last = args.get("from"), args.get("to")
+    for date in (first, last):
+        if date is not None:
+            try:
+                datetime.date.fromisoformat(date)
+            except ValueError:
+                raise ValueError("dates are written YYYY-MM-DD, not {!r}".format(date)) from None
+    output = args.get("format", "csv" if request.accept_mimetypes.best == "text/csv" else "json")
+    if output not in ("json", "csv"):
+        raise ValueError("format must be json or csv")
+    return level, None if names is None else tuple(names), metric, transform, first, last, output
+
+
+# function to get the series of a query of series_query: the names found, the names missing, the dates and the
+# (series x dates) values
+def query_series(snap, query):
+    level, names, metric, transform, first, last, _ = query
+    if names is None:
+        names = (list(snap.reports.states) if metric in dailyreports.REPORT_METRICS and snap.reports else
+                 list(snap.confirmed_cube.label_positions[level]))
+    keys, _, series, dates = metric_series(snap, [(level, name) for name in names], metric, transform)
+    found = {name for _, name in keys}
+    start = int(np.searchsorted(dates, first)) if first else 0
+    stop = int(np.searchsorted(dates, last, side="right")) if last else len(dates)
+    missing = [series_name((level, name)) for name in names if name not in found]
+    return [series_name(key) for key in keys], missing, list(dates[start:stop]), series[:, start:stop]
+
+
+# function to write the series of a query as one json document: the dates and a row of values per series, null
+# where a series has no value
+def series_json(snap, query, names, missing, dates, values):
+    level, _, metric, transform, _, _, _ = query
+    rows = pd.DataFrame(values).to_json(orient="values", double_precision=6) if len(values) else "[]"
+    header = json.dumps({"version": snap.version, "level": level, "metric": metric, "transform": transform,
+                         "dates": dates, "names": names, "missing": missing}, separators=(",", ":"))
+    return (header[:-1] + ',"values":' + rows + "}").encode()
+
+
+# function to write the series of a query as csv chunks: a date column and a column per series, a chunk every
+# API_CSV_ROWS dates
+def series_csv(names, dates, values):
+    header = io.StringIO()
+    csv.writer(header, lineterminator="\n").writerow(["date"] + names)
+    yield header.getvalue().encode()
+    for start in range(0, len(dates), API_CSV_ROWS):
+        frame = pd.DataFrame(values[:, start:start + API_CSV_ROWS].T, index=dates[start:start + API_CSV_ROWS])
+        yield frame.to_csv(header=False, float_format="%.15g").encode()
+
+
+# function to gzip a stream of chunks on the fly
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# responses of /api/v1/series by their ETag, the least recently used ones are dropped first
+api_cache = OrderedDict()
+api_cache_lock = threading.Lock()
+
+
+# function to pass a stream of chunks on and keep the whole response in api_cache once streamed, unless it grew
+# larger than API_CACHE_BYTES
+def caching_chunks(etag, chunks):
+    parts, size = [], 0
+    for chunk in chunks:
+        if parts is not None:
+            parts.append(chunk)
+            size += len(chunk)
+            if size > API_CACHE_BYTES:
+                parts = None
+        yield chunk
+    if parts is not None and API_CACHE > 0:
+        with api_cache_lock:
+            api_cache[etag] = b"".join(parts)
+            while len(api_cache) > API_CACHE:
+                api_cache.popitem(last=False)
+
+
+# /api/v1/series answers many series of one level at once as json or csv, e.g.
+# /api/v1/series?level=state&names=Texas|Florida&metric=deaths&transform=daily&from=2021-01-01&to=2021-06-30.
+# names are separated by | (counties written "<county>, <state>"), without names every series of the level is
+# sent. The ETag and Last-Modified follow the data version, so a conditional request is answered 304 before any
+# work, and a repeated one from the cache of the worker (gzipped when the client accepts it)
+def api_series():
+    snap = data
+    if snap is None:
+        return jsonify(error="the data is loading"), 503
+    try:
+        query = series_query(request.args)
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    gzipped = "gzip" in request.accept_encodings
+    etag = hashlib.sha1(repr((snap.version, getattr(snap.reports, "version", None), query, gzipped)).encode()
+                        ).hexdigest()[:20]
+    last_modified = datetime.datetime.fromtimestamp(int(snap.updated), datetime.timezone.utc)
+    mimetype = "text/csv" if query[-1] == "csv" else "application/json"
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304, mimetype=mimetype)
+    else:
+        with api_cache_lock:
+            body = api_cache.get(etag)
+            if body is not None:
+                api_cache.move_to_end(etag)
+        if body is None:
+            names, missing, dates, values = query_series(snap, query)
+            if query[-1] == "csv":
+                chunks = series_csv(names, dates, values)
+            else:
+                chunks = iter([series_json(snap, query, names, missing, dates, values)])
+            body = caching_chunks(etag, gzip_chunks(chunks) if gzipped else chunks)
+        response = Response(body, mimetype=mimetype)
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# /readyz answers 200 once the data is loaded and 503 while it loads, with the error of the last attempt if it failed
+def readyz():
+    snap = data
+    if snap is None:
+        return jsonify(status="loading" if load_error is None else "failed", error=load_error), 503
+    return jsonify(status="ready", version=snap.version, load_seconds=round(load_seconds or 0, 3))
+
+
+# function to create the dash app: the server starts with the layout and the callbacks and answers right away, the
+# data is loaded by the data_loop thread started next to it
+def create_app():
+    # the page served while the data loads has none of the dashboard components
+    app = dash.Dash(__name__, external_stylesheets=external_stylesheets, suppress_callback_exceptions=True)
+    server = app.server
+    if COMPACT_FIGURES:
+        Compress(server)
+    # request timings and /metrics with COVID_METRICS=1, see metrics.py
+    instrument(server)
+    # profiles of slow callback requests with COVID_PROFILE=1 or COVID_PROFILE_SECRET, see profiler.py
+    profiler.instrument(server)
+    server.add_url_rule("/healthz", "healthz", healthz)
+    server.add_url_rule("/readyz", "readyz", readyz)
+    server.add_url_rule("/geometry/counties/<state_fips>.json", "county_shapes", county_shapes)
+    server.add_url_rule("/api/v1/series", "api_series", api_series)
+    app.layout = serve_layout
+    register_callbacks(app)
+    return app
+
+
+app = create_app()
+server = app.server
+threading.Thread(target=data_loop, name="covid-data-load", daemon=True).start()
 
 if __name__ == "__main__":
     app.run_server(debug=True)
@@ -0,0 +1,254 @@
+import datetime
+import fcntl
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from datasource import CACHE_DIR, PARSE_PROCESSES, TIMEOUT, write_atomic
+
+# JHU CSSE daily reports of the US states, one csv file per day named MM-DD-YYYY.csv
+JHU_DAILY_REPORTS_URL = ("https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/"
+                         "csse_covid_19_daily_reports_us")
+# first day of the US daily reports
+FIRST_REPORT = datetime.date(2020, 4, 12)
+# COVID_DAILY_REPORTS=1 ingests the daily reports with every data load and refresh, for the testing, hospitalization
+# and incident rate metrics. COVID_DAILY_REPORTS_SOURCE: a local directory or a base url holding the csv files.
+# The reports are kept as a state x date store under <COVID_DATA_CACHE>/daily_reports/ with a manifest of the files
+# already ingested, so that a refresh only parses the new ones
+DAILY_REPORTS = os.environ.get("COVID_DAILY_REPORTS", "0") == "1"
+DAILY_REPORTS_SOURCE = os.environ.get("COVID_DAILY_REPORTS_SOURCE", JHU_DAILY_REPORTS_URL)
+DAILY_REPORTS_DIR = os.path.join(CACHE_DIR, "daily_reports")
+# metrics of the store: column -> (label, names of the column in the files, older names last)
+REPORT_METRICS = {"Total_Test_Results": ("Total Test Results", ["Total_Test_Results", "People_Tested"]),
+                  "Testing_Rate": ("Testing Rate (per 100k)", ["Testing_Rate"]),
+                  "Incident_Rate": ("Incident Rate (per 100k)", ["Incident_Rate"]),
+                  "People_Hospitalized": ("People Hospitalized", ["People_Hospitalized"]),
+                  "Hospitalization_Rate": ("Hospitalization Rate (%)", ["Hospitalization_Rate"]),
+                  "Case_Fatality_Ratio": ("Case Fatality Ratio (%)", ["Case_Fatality_Ratio", "Mortality_Rate"])}
+# days after which a report that is still missing from a remote source is no longer asked for
+MISSING_AFTER = 3
+# number of store versions kept on disk
+KEEP_VERSIONS = 2
+
+
+# state x date table of the daily report metrics: states and dates (ISO) label the rows and columns of one float32
+# matrix per metric, NaN where a report has no value
+class ReportTable:
+    def __init__(self, states, dates, metrics, manifest, version=None):
+        self.states = np.asarray(states, dtype=object)
+        self.dates = np.asarray(dates, dtype=object)
+        self.metrics = metrics
+        # file name -> validator of its last ingested version, None for a remote file that is missing
+        self.manifest = manifest
+        self.version = version
+        self.state_positions = {state: i for i, state in enumerate(self.states)}
+
+    # function to save the table as one .npy file per array and the manifest
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "states.npy"), np.array(self.states, dtype=str))
+        np.save(os.path.join(directory, "dates.npy"), np.array(self.dates, dtype=str))
+        for name, values in self.metrics.items():
+            np.save(os.path.join(directory, name + ".npy"), values)
+        with open(os.path.join(directory, "manifest.json"), "w") as f:
+            json.dump(self.manifest, f)
+
+    # function to load a saved table, the metrics are memory-mapped read-only
+    @classmethod
+    def load(cls, directory, version=None):
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+        metrics = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in REPORT_METRICS}
+        return cls(np.load(os.path.join(directory, "states.npy")).astype(object),
+                   np.load(os.path.join(directory, "dates.npy")).astype(object), metrics, manifest, version)
+
+    # function to get a new table with the parsed reports [(date, states, {metric: values})] added, a report of a
+    # date already in the table replaces its column. The dates stay one column per day, the days without a report
+    # are NaN
+    def append(self, reports, manifest):
+        states = list(self.states) + sorted({state for _, names, _ in reports for state in names} -
+                                            set(self.states))
+        known = set(self.dates) | {date for date, _, _ in reports}
+        dates = []
+        if known:
+            first, last = datetime.date.fromisoformat(min(known)), datetime.date.fromisoformat(max(known))
+            dates = [(first + datetime.timedelta(days=day)).isoformat() for day in range((last - first).days + 1)]
+        positions = {state: i for i, state in enumerate(states)}
+        columns = {date: i for i, date in enumerate(dates)}
+        metrics = {}
+        for name in REPORT_METRICS:
+            values = np.full((len(states), len(dates)), np.nan, dtype=np.float32)
+            if len(self.dates):
+                values[:len(self.states), [columns[date] for date in self.dates]] = self.metrics[name]
+            metrics[name] = values
+        for date, names, report in reports:
+            rows = [positions[state] for state in names]
+            for name, values in report.items():
+                metrics[name][rows, columns[date]] = values
+        return ReportTable(states, dates, metrics, manifest)
+
+    # function to get the series of the given states as one (states x dates) matrix of a metric, unknown states are
+    # skipped; returns the states found and the matrix
+    def series(self, metric, states):
+        found = [state for state in states if state in self.state_positions]
+        return found, np.asarray(self.metrics[metric])[[self.state_positions[state] for state in found]]
+
+
+# function to get the table of an empty store
+def empty_table():
+    return ReportTable([], [], {name: np.zeros((0, 0), dtype=np.float32) for name in REPORT_METRICS}, {})
+
+
+# function to get the ISO date of a daily report file name (MM-DD-YYYY.csv), None for other files
+def report_date(filename):
+    try:
+        return datetime.datetime.strptime(filename, "%m-%d-%Y.csv").date().isoformat()
+    except ValueError:
+        return None
+
+
+# function to parse one daily report: its date, the states of its rows and the values of every metric. It runs in
+# a parse process, so it only returns small arrays
+def parse_report(path):
+    frame = pd.read_csv(path, low_memory=False)
+    frame = frame[frame["Country_Region"] == "US"] if "Country_Region" in frame.columns else frame
+    report = {}
+    for name, (_, columns) in REPORT_METRICS.items():
+        column = next((column for column in columns if column in frame.columns), None)
+        report[name] = (pd.to_numeric(frame[column], errors="coerce").to_numpy(dtype=np.float32) if column
+                        else np.full(len(frame), np.nan, dtype=np.float32))
+    return report_date(os.path.basename(path)), list(frame["Province_State"].astype(str)), report
+
+
+# function to list the reports of a local directory as {file name: (path, validator)}, the validator changes
+# whenever a file does
+def local_reports(source):
+    reports = {}
+    for entry in os.scandir(source):
+        if report_date(entry.name) is not None:
+            stat = entry.stat()
+            reports[entry.name] = (entry.path, "{}-{}".format(stat.st_mtime_ns, stat.st_size))
+    return reports
+
+
+# function to download the reports of a remote source that are not in the manifest, one thread per file, into
+# `directory`. Returns {file name: (path, validator)} and the names of the reports the source does not have (yet)
+def remote_reports(source, manifest, directory, today=None):
+    today = today or datetime.date.today()
+    names = [(FIRST_REPORT + datetime.timedelta(days=day)).strftime("%m-%d-%Y.csv")
+             for day in range((today - FIRST_REPORT).days + 1)]
+    names = [name for name in names if name not in manifest]
+
+    def download(name):
+        path = os.path.join(directory, name)
+        try:
+            with urllib.request.urlopen(source.rstrip("/") + "/" + name, timeout=TIMEOUT) as response:
+                write_atomic(path, lambda f: f.write(response.read()))
+        except urllib.error.HTTPError as error:
+            if error.code != 404:
+                raise
+            return None
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+    with ThreadPoolExecutor(min(16, max(len(names), 1)), thread_name_prefix="covid-reports") as threads:
+        paths = list(threads.map(download, names))
+    found = {name: (path, "download") for name, path in zip(names, paths) if path is not None}
+    # a report missing for a few days is not published any more (the JHU reports stopped in March 2023)
+    missing = [name for name, path in zip(names, paths) if path is None and
+               (today - datetime.date.fromisoformat(report_date(name))).days > MISSING_AFTER]
+    return found, missing
+
+
+# function to parse reports in up to `processes` processes, returns [(date, states, {metric: values})] in the
+# order of the paths
+def parse_reports(paths, processes=None):
+    processes = min(processes or PARSE_PROCESSES, len(paths))
+    if processes <= 1:
+        return [parse_report(path) for path in paths]
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["dailyreports"])
+    with ProcessPoolExecutor(processes, mp_context=context) as pool:
+        return list(pool.map(parse_report, paths, chunksize=max(1, len(paths) // (processes * 4))))
+
+
+def current_version(root):
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+# function to load the current store, an empty table when there is none
+def load_store(root=DAILY_REPORTS_DIR):
+    version = current_version(root)
+    if version is None:
+        return empty_table()
+    return ReportTable.load(os.path.join(root, version), version)
+
+
+# function to write a table as a new store version and point CURRENT at it
+def write_store(root, table):
+    version = "{:08x}".format(zlib.crc32(json.dumps(table.manifest, sort_keys=True).encode()))
+    tmp = tempfile.mkdtemp(dir=root, prefix=".tmp-")
+    try:
+        table.save(tmp)
+        os.rename(tmp, os.path.join(root, version))
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(os.path.join(root, version)):
+            raise
+    write_atomic(os.path.join(root, "CURRENT"), lambda f: f.write(version.encode()))
+    versions = sorted((entry for entry in os.scandir(root) if entry.is_dir() and not entry.name.startswith(".")
+                       and entry.name != "downloads"), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[KEEP_VERSIONS:]:
+        if entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+    table.version = version
+    return table
+
+
+# function to bring the store up to date with the source: only the reports that are new or changed since the
+# manifest are parsed (in parallel) and appended, an unchanged source only reads the manifest. One process at a
+# time updates the store. Returns the current table
+def ingest(source=None, root=DAILY_REPORTS_DIR, processes=None):
+    source = source or DAILY_REPORTS_SOURCE
+    if source.startswith("file://"):
+        source = source[len("file://"):]
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        table = load_store(root)
+        manifest = dict(table.manifest)
+        if os.path.isdir(source):
+            available, missing = local_reports(source), []
+        else:
+            available, missing = remote_reports(source, manifest, os.path.join(root, "downloads"))
+        changed = sorted(name for name, (_, validator) in available.items() if manifest.get(name) != validator)
+        if not changed and not missing:
+            return table
+        reports = parse_reports([available[name][0] for name in changed], processes)
+        manifest.update({name: available[name][1] for name in changed})
+        manifest.update({name: None for name in missing})
+        table = write_store(root, table.append(reports, manifest))
+        # the downloaded files are in the store now
+        for name in changed:
+            if not os.path.isdir(source):
+                os.remove(available[name][0])
+        return table
+
+
+# `python dailyreports.py` brings the daily reports store up to date and prints its size
+if __name__ == "__main__":
+    table = ingest()
+    print("{} states x {} dates, version {}".format(len(table.states), len(table.dates), table.version))
@@ -0,0 +1,519 @@
+import copy
+import os
+import weakref
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# non-date columns in the JHU US time series files
+META_COLUMNS = ["UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Province_State", "Country_Region", "Lat", "Long_",
+                "Combined_Key", "Population"]
+# non-date columns read by CountyCube, and those of them holding labels
+CUBE_COLUMNS = ["UID", "FIPS", "Admin2", "Province_State", "Country_Region", "Population"]
+LABEL_COLUMNS = ["Admin2", "Province_State", "Country_Region"]
+# dtype of the counts of the rows and counties, the state and nation sums are 64 bit
+COUNT_DTYPE = np.int32
+
+# aggregation levels and transforms of CountyCube.aggregate
+LEVELS = ["nation", "state", "county"]
+TRANSFORMS = ["cumulative", "daily"]
+NATION = np.array(["US"], dtype=object)
+
+# numeric arrays of a cube, saved as .npy files that can be memory-mapped
+ARRAY_FIELDS = ["values", "county_values", "uids", "order", "row_fips", "population", "state_starts",
+                "county_starts", "county_valid"]
+# label arrays of a cube, saved as fixed width unicode arrays
+LABEL_FIELDS = ["dates", "states", "row_states", "row_counties", "county_names", "county_states"]
+
+
+# county x date matrix of a JHU US time series with its rows sorted by state and county,
+# so that every state and county is a contiguous block of rows
+class CountyCube:
+    def __init__(self, df):
+        # only US rows are used by the dashboard, the columns are taken row by row position so that the frame
+        # is never copied whole
+        us_rows = us_positions(df)
+        date_cols = [col for col in df.columns if col not in META_COLUMNS]
+        # sort rows by state then county, rows without a county go to the end of their state
+        # (labels may be categories, they are sorted as strings)
+        labels = df[["Province_State", "Admin2"]].iloc[us_rows].astype(object).reset_index(drop=True)
+        order = labels.sort_values(["Province_State", "Admin2"], kind="mergesort", na_position="last").index.to_numpy()
+        self.uids = df["UID"].to_numpy()[us_rows]
+        self.order = order
+        rows = us_rows[order]
+
+        self.dates = np.array(date_cols, dtype=object)
+        self.values = count_matrix(df, date_cols, rows)
+        self.row_states = df["Province_State"].to_numpy(dtype=object)[rows]
+        self.row_counties = df["Admin2"].to_numpy(dtype=object)[rows]
+        self.row_fips = df["FIPS"].to_numpy(dtype=float)[rows]
+        self.population = (df["Population"].fillna(0).to_numpy(dtype=np.int64)[rows] if "Population" in df.columns
+                           else None)
+
+        # state -> row range
+        n_rows = len(self.row_states)
+        state_change = np.ones(n_rows, dtype=bool)
+        state_change[1:] = self.row_states[1:] != self.row_states[:-1]
+        self.state_starts = np.flatnonzero(state_change)
+        self.states = self.row_states[self.state_starts]
+
+        # county groups: a new group starts where the state or the county name changes
+        has_county = pd.notna(self.row_counties)
+        county_change = state_change.copy()
+        county_change[1:] |= self.row_counties[1:] != self.row_counties[:-1]
+        county_starts = np.flatnonzero(county_change)
+        valid = has_county[county_starts]
+        self.county_starts = county_starts
+        self.county_valid = valid
+        self.county_names = self.row_counties[county_starts][valid]
+        self.county_states = self.row_states[county_starts][valid]
+        self.build_index()
+
+        # all levels in one grouped pass: the rows are summed into (state, county) groups, the groups into
+        # states and the states into the nation
+        groups = np.add.reduceat(self.values, county_starts, axis=0, dtype=COUNT_DTYPE) if n_rows else self.values
+        self.county_values = groups[valid]
+        self.levels = self.build_levels(np.add.reduceat(groups, self.state_group_starts, axis=0, dtype=np.int64)
+                                        if n_rows else groups.astype(np.int64))
+
+    # state -> row range and state -> county range lookups
+    def build_index(self):
+        state_stops = np.append(self.state_starts[1:], len(self.row_states))
+        self.state_rows = {state: (start, stop) for state, start, stop in
+                           zip(self.states, self.state_starts, state_stops)}
+        self.county_state_starts = np.searchsorted(self.county_states, self.states, side="left")
+        self.county_state_stops = np.searchsorted(self.county_states, self.states, side="right")
+        self.state_counties = {state: (start, stop) for state, start, stop in
+                               zip(self.states, self.county_state_starts, self.county_state_stops)}
+        # position of the first group of every state among the (state, county) groups
+        self.state_group_starts = np.searchsorted(self.county_starts, self.state_starts)
+        # label -> row of the level tables, counties are labelled (state, county)
+        self.label_positions = {"nation": {"US": 0},
+                                "state": {state: i for i, state in enumerate(self.states)},
+                                "county": {key: i for i, key in enumerate(zip(self.county_states,
+                                                                               self.county_names))}}
+        self.date_positions = {date: i for i, date in enumerate(self.dates)}
+        # FIPS code of every county, NaN for counties without one
+        self.county_fips = np.asarray(self.row_fips, dtype=float)[self.county_starts][self.county_valid]
+        self.levels = None
+        self.peak_tables = {}
+        self.rolling_tables = {}
+        self.populations = None
+        self.rank_vectors = {}
+        # rows of the county tables the leaderboard never ranks, see county_vector
+        self.unranked = None
+        self.values_crc = None
+
+    # function to save the cube as one .npy file per array
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for field in ARRAY_FIELDS:
+            if getattr(self, field) is not None:
+                np.save(os.path.join(directory, field + ".npy"), np.ascontiguousarray(getattr(self, field)))
+        for field in LABEL_FIELDS:
+            labels = getattr(self, field)
+            np.save(os.path.join(directory, field + ".npy"),
+                    np.array(["" if pd.isna(label) else str(label) for label in labels], dtype=str))
+
+    # function to load a saved cube, the numeric arrays are memory-mapped read-only by default so that
+    # every process loading the same directory shares one physical copy
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        cube = cls.__new__(cls)
+        for field in ARRAY_FIELDS:
+            path = os.path.join(directory, field + ".npy")
+            setattr(cube, field, np.load(path, mmap_mode=mmap_mode) if os.path.exists(path) else None)
+        for field in LABEL_FIELDS:
+            setattr(cube, field, np.load(os.path.join(directory, field + ".npy")).astype(object))
+        # rows without a county were saved as empty names
+        cube.row_counties[cube.row_counties == ""] = np.nan
+        cube.build_index()
+        return cube
+
+    # new cube with the date columns of df that are not in this cube appended, the row indexes are reused;
+    # None when df has different rows or changed values in the existing dates. The peak tables and rolling averages
+    # computed for this cube are extended by the new dates (see extend_tables). df may be a newer saved cube of the
+    # same rows (see sharedstore.py): it is kept as it is so that its mapped arrays stay shared, only its level
+    # tables are built from ours and the sums of its new columns
+    def extend(self, df):
+        if isinstance(df, CountyCube):
+            return self.extended_by(df)
+        us_rows = us_positions(df)
+        date_cols = [col for col in df.columns if col not in META_COLUMNS]
+        old_cols = list(self.dates)
+        if (len(us_rows) != len(self.uids) or date_cols[:len(old_cols)] != old_cols
+                or not np.array_equal(df["UID"].to_numpy()[us_rows], self.uids)):
+            return None
+        # the counts are read once, for the check of the old columns and as the values of the new cube
+        values = count_matrix(df, date_cols, us_rows[self.order])
+        if not np.array_equal(values[:, :len(old_cols)], self.values):
+            return None
+        if len(date_cols) == len(old_cols):
+            return self
+        new_values = values[:, len(old_cols):]
+        cube = copy.copy(self)
+        cube.dates = np.array(date_cols, dtype=object)
+        cube.date_positions = {date: i for i, date in enumerate(cube.dates)}
+        cube.rank_vectors = {}
+        cube.values = values
+        # the level tables only gain the sums of the new columns
+        new_groups = np.add.reduceat(new_values, self.county_starts, axis=0, dtype=COUNT_DTYPE)
+        cube.county_values = np.ascontiguousarray(np.hstack([self.county_values, new_groups[self.county_valid]]))
+        new_states = np.add.reduceat(new_groups, self.state_group_starts, axis=0, dtype=np.int64)
+        cube.levels = cube.build_levels(np.hstack([self.level_tables()["state"][1], new_states]))
+        cube.extend_tables(self)
+        return cube
+
+    # function to extend the cube by a saved cube of the same rows, see extend
+    def extended_by(self, cube):
+        old = len(self.dates)
+        if cube is self:
+            return self
+        if (len(cube.uids) != len(self.uids) or list(cube.dates[:old]) != list(self.dates)
+                or not np.array_equal(cube.uids, self.uids) or not np.array_equal(cube.order, self.order)
+                or not np.array_equal(cube.values[:, :old], self.values)):
+            return None
+        if len(cube.dates) == old:
+            return self
+        new_states = np.add.reduceat(cube.values[:, old:], self.state_starts, axis=0, dtype=np.int64)
+        cube.levels = cube.build_levels(np.hstack([self.level_tables()["state"][1], new_states]))
+        cube.unranked = self.unranked
+        cube.extend_tables(self)
+        return cube
+
+    # function to take over the sparse peak tables, the rolling averages and the checksum `old` computed, for the
+    # same series with fewer dates: only their entries that start or end on a new date are computed, the others are
+    # copied, and the checksum goes on from that of the old columns
+    def extend_tables(self, old):
+        old_days = len(old.dates)
+        self.peak_tables = {}
+        self.rolling_tables = {}
+        self.values_crc = None if old.values_crc is None else column_crc(self.values[:, old_days:], old.values_crc)
+        if not old_days:
+            return
+        for level, tables in old.peak_tables.items():
+            cumulative = self.level_tables()[level][1]
+            daily = np.hstack([tables[0][0], np.diff(cumulative[:, old_days - 1:], axis=1).astype(np.int64)])
+            days = np.broadcast_to(np.arange(daily.shape[1], dtype=np.int32), daily.shape).copy()
+            extended = [(daily, days)]
+            width = 1
+            while width * 2 <= daily.shape[1]:
+                peaks, peak_days = extended[-1]
+                kept = tables[len(extended)] if len(extended) < len(tables) else (peaks[:, :0], peak_days[:, :0])
+                start = kept[0].shape[1]
+                left, right = peaks[:, start:-width], peaks[:, start + width:]
+                later = right > left
+                extended.append((np.hstack([kept[0], np.where(later, right, left)]),
+                                 np.hstack([kept[1], np.where(later, peak_days[:, start + width:],
+                                                              peak_days[:, start:-width])])))
+                width *= 2
+            self.peak_tables[level] = extended
+        for (level, n), kept in old.rolling_tables.items():
+            cumulative = self.level_tables()[level][1]
+            table = np.full(cumulative.shape, np.nan, dtype=np.float32)
+            table[:, :old_days] = kept
+            start = max(n, old_days)
+            if cumulative.shape[1] > start:
+                table[:, start:] = (cumulative[:, start:] - cumulative[:, start - n:-n]) / n
+            self.rolling_tables[(level, n)] = table
+
+    # function to get the crc32 of the counts, read date column by date column so that a cube extended by new dates
+    # only reads those (see extend_tables)
+    def checksum(self):
+        if self.values_crc is None:
+            self.values_crc = column_crc(self.values)
+        return self.values_crc
+
+    # (labels, cumulative table) of every level from the state table
+    def build_levels(self, state_values):
+        return {"nation": (NATION, state_values.sum(axis=0, keepdims=True)),
+                "state": (self.states, state_values),
+                "county": (self.county_names, self.county_values)}
+
+    # level tables, computed on first use for a loaded cube so that its mapped county table stays shared
+    def level_tables(self):
+        if self.levels is None:
+            self.levels = self.build_levels(np.add.reduceat(self.values, self.state_starts, axis=0, dtype=np.int64))
+        return self.levels
+
+    # function to turn a date label or index into an index
+    def date_index(self, date):
+        if date is None or isinstance(date, (int, np.integer)):
+            return date
+        return self.date_positions[date]
+
+    # aggregation engine: series of one level ("nation", "state" or "county") as (labels, dates, table).
+    # names selects many series at once (state names, or (state, county) pairs for counties; unknown names are
+    # skipped), state selects all counties of one state. transform "daily" undoes the running totals by a
+    # difference along the date axis, the first date of the data has no previous day and is NaN.
+    # start/stop select a date range by index or date label
+    def aggregate(self, level, transform="cumulative", names=None, start=None, stop=None, state=None):
+        labels, table = self.level_tables()[level]
+        if names is not None:
+            positions = self.label_positions[level]
+            rows = [positions[name] for name in names if name in positions]
+            labels, table = labels[rows], table[rows]
+        elif state is not None:
+            first, last = self.state_counties.get(state, (0, 0))
+            labels, table = labels[first:last], table[first:last]
+        first, last, _ = slice(self.date_index(start), self.date_index(stop)).indices(len(self.dates))
+        last = max(first, last)
+        if transform == "daily":
+            if first == 0:
+                table = np.diff(table[:, :last], axis=1, prepend=np.nan)
+            else:
+                table = np.diff(table[:, first - 1:last], axis=1).astype(float)
+        else:
+            table = table[:, first:last]
+        return labels, self.dates[first:last], table
+
+    # batched lookup of series of any levels: keys are (level, name) pairs (names as in label_positions, unknown ones
+    # are skipped), returns the keys found and their cumulative series as one (keys x dates) matrix, gathered with one
+    # indexing per level whatever the number of keys
+    def series(self, keys):
+        tables = self.level_tables()
+        found = [(level, name) for level, name in keys if name in self.label_positions[level]]
+        matrix = np.zeros((len(found), len(self.dates)), dtype=np.int64)
+        for level in {level for level, _ in found}:
+            rows = [i for i, key in enumerate(found) if key[0] == level]
+            matrix[rows] = tables[level][1][[self.label_positions[level][found[i][1]] for i in rows]]
+        return found, matrix
+
+    # sums and means of the daily counts of a level from date index first to last (inclusive), for the series at
+    # `rows` (a slice or positions into the level table, all by default). The running totals are the prefix sums
+    # of the daily counts, so every window total is the difference of two of them whatever the window. The first
+    # date of the data has no daily count and is left out of every window
+    def window_totals(self, level, first, last, rows=slice(None)):
+        table = self.level_tables()[level][1]
+        first = max(first, 1)
+        days = max(last - first + 1, 0)
+        if not days:
+            return np.zeros(len(table[rows, 0]), dtype=np.int64), np.full(len(table[rows, 0]), np.nan)
+        totals = table[rows, last].astype(np.int64) - table[rows, first - 1]
+        return totals, totals / days
+
+    # sparse table of the daily counts of a level for window_peaks: for every power of two 2^k up to the number of
+    # days, the highest daily count of the 2^k days starting at every day and the day it was reached. Built on first
+    # use, it holds about log2(days) copies of the daily table, so it is meant for the nation and state levels
+    def peak_table(self, level):
+        tables = self.peak_tables.get(level)
+        if tables is None:
+            cumulative = self.level_tables()[level][1]
+            # daily counts, index 0 stands for the first date, which has none
+            daily = np.diff(cumulative, axis=1, prepend=cumulative[:, :1]).astype(np.int64)
+            days = np.broadcast_to(np.arange(daily.shape[1], dtype=np.int32), daily.shape).copy()
+            tables = [(daily, days)]
+            width = 1
+            while width * 2 <= daily.shape[1]:
+                peaks, peak_days = tables[-1]
+                left, right = peaks[:, :-width], peaks[:, width:]
+                later = right > left
+                tables.append((np.where(later, right, left),
+                               np.where(later, peak_days[:, width:], peak_days[:, :-width])))
+                width *= 2
+            self.peak_tables[level] = tables
+        return tables
+
+    # function to get the highest daily count from date index first to last (inclusive) of the series at `rows` of
+    # a level and the date index of its first day, with two lookups into the sparse table
+    def window_peaks(self, level, first, last, rows=slice(None)):
+        tables = self.peak_table(level)
+        first = max(first, 1)
+        if last < first:
+            count = len(tables[0][0][rows, 0])
+            return np.zeros(count, dtype=np.int64), np.full(count, -1)
+        k = int(last - first + 1).bit_length() - 1
+        peaks, peak_days = tables[k]
+        left, right = peaks[rows, first], peaks[rows, last - 2 ** k + 1]
+        later = right > left
+        return (np.where(later, right, left),
+                np.where(later, peak_days[rows, last - 2 ** k + 1], peak_days[rows, first]))
+
+    # N-day rolling averages of the daily counts of every series of a level, for each N in `days`. The running totals
+    # are the prefix sums of the daily counts, so the average of the N days up to day t is
+    # (total[t] - total[t - N]) / N: one subtraction over the whole table per N instead of a rolling() per series.
+    # The days without N daily counts before them are NaN. Computed on first use and kept with the cube, that is
+    # with its data version; float32 so that the tables stay small. Meant for the nation and state levels, a county
+    # table would be a private copy in every worker
+    def rolling_averages(self, level, days=(7, 14)):
+        missing = [n for n in days if (level, n) not in self.rolling_tables]
+        if missing:
+            cumulative = self.level_tables()[level][1]
+            for n in missing:
+                table = np.full(cumulative.shape, np.nan, dtype=np.float32)
+                if cumulative.shape[1] > n:
+                    table[:, n:] = (cumulative[:, n:] - cumulative[:, :-n]) / n
+                self.rolling_tables[(level, n)] = table
+        return [self.rolling_tables[(level, n)] for n in days]
+
+    # population of every series of a level, summed from the Population column of the rows. A cube without one (the
+    # confirmed cases file has none) takes it from `source`, another cube of the same series, by label; series
+    # without a population are 0
+    def level_population(self, level, source=None):
+        if self.population is None:
+            if source is None or source.population is None:
+                return None
+            labels = (zip(self.county_states, self.county_names) if level == "county"
+                      else self.level_tables()[level][0])
+            positions = source.label_positions[level]
+            population = source.level_population(level)
+            return np.array([population[positions[label]] if label in positions else 0 for label in labels],
+                            dtype=np.int64)
+        if self.populations is None:
+            groups = (np.add.reduceat(self.population, self.county_starts) if len(self.population)
+                      else np.zeros(0, dtype=np.int64))
+            states = (np.add.reduceat(groups, self.state_group_starts) if len(groups)
+                      else np.zeros(0, dtype=np.int64))
+            self.populations = {"nation": states.sum(keepdims=True), "state": states,
+                                "county": groups[self.county_valid]}
+        return self.populations[level]
+
+    # value of every county ranked by the county leaderboard: "total" (the last running total), "growth" (the counts
+    # of the last 7 days) or "per_100k" (the last running total per 100,000 people of `population`, one value per
+    # county). Only the last columns of the county table are read, so a cube extended by new dates computes its
+    # vectors again for the cost of a few columns. The rows that are no place (no FIPS code, "Unassigned" and "Out of"
+    # rows) are NaN and never ranked, their mask is kept by the cubes extended from this one. Computed on first use
+    # and kept with the cube
+    def county_vector(self, metric, population=None):
+        vector = self.rank_vectors.get(metric)
+        if vector is None:
+            if not self.county_values.shape[1]:
+                vector = np.zeros(len(self.county_values))
+            elif metric == "growth":
+                vector = (self.county_values[:, -1].astype(np.int64) -
+                          (self.county_values[:, -8] if self.county_values.shape[1] > 7 else 0))
+            elif metric == "per_100k":
+                vector = per_100k(self.county_values[:, -1], population)
+            else:
+                vector = self.county_values[:, -1]
+            if self.unranked is None:
+                names = self.county_names.astype(str)
+                self.unranked = (np.isnan(self.county_fips) | (self.county_fips >= 80000) | (names == "Unassigned") |
+                                 np.char.startswith(names, "Out of"))
+            vector = np.where(self.unranked, np.nan, vector)
+            self.rank_vectors[metric] = vector
+        return vector
+
+    # statistics of the highest value of every county, for all states in one pass: returns the county peaks and,
+    # per state in self.states, the number of counties, their mean peak and the index (into the county arrays)
+    # of the first county with the highest and with the lowest peak, -1 for states without counties
+    def county_peak_stats(self):
+        peaks = (self.county_values.max(axis=1) if self.county_values.shape[1]
+                 else np.zeros(len(self.county_values), dtype=self.county_values.dtype))
+        counts = self.county_state_stops - self.county_state_starts
+        group = np.repeat(np.arange(len(self.states)), counts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.bincount(group, weights=peaks, minlength=len(self.states)) / counts
+        # sorting by (state, peak) puts the extreme counties of each state at its first county position,
+        # lexsort is stable so ties keep the first county in name order
+        max_idx = np.lexsort((-peaks, group))
+        min_idx = np.lexsort((peaks, group))
+        if not len(peaks):
+            return peaks, counts, means, np.full(len(self.states), -1), np.full(len(self.states), -1)
+        firsts = np.minimum(self.county_state_starts, len(peaks) - 1)
+        return (peaks, counts, means, np.where(counts > 0, max_idx[firsts], -1),
+                np.where(counts > 0, min_idx[firsts], -1))
+
+    # cumulative series of every county name in the country, counties of the same name in different states summed
+    def county_name_table(self):
+        names, inverse = np.unique(self.county_names.astype(str), return_inverse=True)
+        table = np.zeros((len(names), len(self.dates)), dtype=self.county_values.dtype)
+        np.add.at(table, inverse, self.county_values)
+        return names.astype(object), table
+
+
+# function to turn counts into counts per 100,000 people, NaN where the population is unknown (0). population has
+# one value per row of values
+def per_100k(values, population):
+    values = np.asarray(values, dtype=float)
+    population = np.asarray(population, dtype=float).reshape((-1,) + (1,) * (values.ndim - 1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(population > 0, values * 100000 / population, np.nan)
+
+
+# function to get the positions of the n largest (or smallest) values of values[start:stop] in rank order, NaN values
+# are skipped. np.argpartition picks the n values in linear time and only those n are sorted, whatever the length
+def top_rows(values, n, largest=True, start=0, stop=None):
+    window = values[start:stop]
+    valid = np.flatnonzero(~np.isnan(window))
+    keys = -window[valid] if largest else window[valid]
+    n = min(max(int(n), 0), len(keys))
+    if not n:
+        return valid[:0]
+    picked = np.argpartition(keys, n - 1)[:n] if n < len(keys) else np.arange(len(keys))
+    return start + valid[picked[np.argsort(keys[picked], kind="stable")]]
+
+
+# function to shift every row of values so that it starts on the first day its cumulative series reaches
+# `threshold`, returns the shifted (rows x days) matrix, NaN past the end of every row, and the index of the first
+# day of every row, -1 (and an empty row) for the rows that never reach it
+def align_rows(values, cumulative, threshold):
+    reached = cumulative >= threshold
+    starts = np.where(reached.any(axis=1), reached.argmax(axis=1), -1)
+    days = values.shape[1] - (starts[starts >= 0].min() if (starts >= 0).any() else values.shape[1])
+    positions = np.where(starts >= 0, starts, values.shape[1])[:, None] + np.arange(days)
+    inside = positions < values.shape[1]
+    aligned = np.take_along_axis(values.astype(float), np.minimum(positions, values.shape[1] - 1), axis=1)
+    return np.where(inside, aligned, np.nan), starts
+
+
+# function to get the positions of the US rows of a JHU US time series frame
+def us_positions(df):
+    return np.flatnonzero((df["Country_Region"] == "US").to_numpy())
+
+
+# function to get the counts of the given rows (positions) of a time series frame as a COUNT_DTYPE matrix, missing
+# counts are 0
+def count_matrix(df, date_cols, rows):
+    values = df[date_cols].to_numpy()[rows]
+    if values.dtype.kind == "f":
+        values = np.nan_to_num(values, copy=False)
+    return np.ascontiguousarray(values, dtype=COUNT_DTYPE)
+
+
+# one cube per loaded frame, so that the frame is only converted once; the frames are weakly referenced
+# so that the frames of replaced data are freed with their cubes
+_cubes = {}
+
+
+# function to get the crc32 of a matrix column by column, going on from `crc`
+def column_crc(values, crc=0):
+    return zlib.crc32(np.ascontiguousarray(values.T), crc)
+
+
+# function to attach an already built cube (e.g. an extended one) to its frame
+def register_cube(df, cube):
+    key = id(df)
+
+    def forget(ref):
+        if key in _cubes and _cubes[key][0] is ref:
+            del _cubes[key]
+
+    _cubes[key] = (weakref.ref(df, forget), cube)
+    return cube
+
+
+# function to get the cube of a JHU US time series frame
+def cube_for(df):
+    if isinstance(df, CountyCube):
+        return df
+    cached = _cubes.get(id(df))
+    if cached is None or cached[0]() is not df:
+        return register_cube(df, CountyCube(df))
+    return cached[1]
+
+
+# function to turn a (labels x dates) table into the long format produced by pd.melt, the labels and dates
+# are categories so that every row only holds their codes
+def melt_table(labels, dates, table, id_name, value_name):
+    return pd.DataFrame({id_name: long_labels(labels, len(dates), np.tile),
+                         "Date": long_labels(dates, len(labels), np.repeat),
+                         value_name: np.asarray(table).T.ravel()})
+
+
+def long_labels(labels, count, spread):
+    labels = np.asarray(labels, dtype=object)
+    if len(pd.unique(labels)) != len(labels) or pd.isna(labels).any():
+        return spread(labels, count)
+    return pd.Categorical.from_codes(spread(np.arange(len(labels)), count), labels)
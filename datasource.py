@@ -0,0 +1,304 @@
+import argparse
+import csv
+import errno
+import json
+import multiprocessing
+import os
+import pickle
+import resource
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from datacube import COUNT_DTYPE, CUBE_COLUMNS, LABEL_COLUMNS, META_COLUMNS, CountyCube
+
+# JHU CSSE time series directory, used when no other source is configured
+JHU_TIME_SERIES_URL = ("https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/"
+                       "csse_covid_19_time_series")
+DEATHS_FILE = "time_series_covid19_deaths_US.csv"
+CONFIRMED_FILE = "time_series_covid19_confirmed_US.csv"
+GLOBAL_CONFIRMED_FILE = "time_series_covid19_confirmed_global.csv"
+GLOBAL_DEATHS_FILE = "time_series_covid19_deaths_global.csv"
+GLOBAL_RECOVERED_FILE = "time_series_covid19_recovered_global.csv"
+# non-date columns of the global time series, and those of them holding labels
+GLOBAL_META_COLUMNS = ["Province/State", "Country/Region", "Lat", "Long"]
+GLOBAL_LABEL_COLUMNS = ["Province/State", "Country/Region"]
+
+# COVID_DATA_SOURCE: a local directory or a base url (e.g. a local file server) holding the csv files
+# COVID_DATA_CACHE: directory for the last downloaded csv files and their parsed snapshots
+DATA_SOURCE = os.environ.get("COVID_DATA_SOURCE", JHU_TIME_SERIES_URL)
+CACHE_DIR = os.environ.get("COVID_DATA_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            ".data_cache"))
+TIMEOUT = float(os.environ.get("COVID_DATA_TIMEOUT", "30"))
+# COVID_CSV_ENGINE: pandas csv parser, "pyarrow" uses the (optional) Arrow csv reader
+CSV_ENGINE = os.environ.get("COVID_CSV_ENGINE", "c")
+# format of the snapshots, snapshots of another format are parsed again
+SNAPSHOT_FORMAT = 2
+# COVID_PARSE_PROCESSES: processes parsing csv files concurrently in load_datasets, with 1 (the default on a single
+# cpu) the files are parsed by the threads fetching them
+PARSE_PROCESSES = int(os.environ.get("COVID_PARSE_PROCESSES", str(os.cpu_count() or 1)))
+
+
+# function to get the cache file paths of a csv file
+def cache_paths(filename, cache_dir=None):
+    base = os.path.join(cache_dir or CACHE_DIR, os.path.splitext(filename)[0])
+    return {"csv": base + ".csv", "info": base + ".json", "meta": base + ".meta.pkl", "values": base + ".values.npy"}
+
+
+# function to write a file atomically, so that concurrent workers never read a partial file
+def write_atomic(path, write):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def read_info(paths):
+    try:
+        with open(paths["info"]) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_info(paths, info):
+    write_atomic(paths["info"], lambda f: f.write(json.dumps(info).encode()))
+
+
+# function to save a parsed time series as a columnar snapshot: the date columns as one .npy matrix and
+# the label columns as a pickled frame
+def write_snapshot(df, paths, info, validator):
+    meta_cols = [col for col in df.columns if col in META_COLUMNS or col in GLOBAL_META_COLUMNS]
+    date_cols = [col for col in df.columns if col not in meta_cols]
+    write_atomic(paths["values"], lambda f: np.save(f, np.ascontiguousarray(df[date_cols].to_numpy(dtype=COUNT_DTYPE))))
+    write_atomic(paths["meta"], lambda f: df[meta_cols].to_pickle(f))
+    info = dict(info, snapshot=validator, format=SNAPSHOT_FORMAT, columns=list(df.columns), dates=date_cols,
+                meta_columns=meta_cols)
+    write_info(paths, info)
+    return info
+
+
+# function to load a snapshot back into the frame pd.read_csv would have returned, None if it is stale
+def read_snapshot(paths, info, validator):
+    if validator is None or info.get("snapshot") != validator or info.get("format") != SNAPSHOT_FORMAT:
+        return None
+    try:
+        meta = pd.read_pickle(paths["meta"])
+        values = np.load(paths["values"])
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        return None
+    if values.shape != (len(meta), len(info["dates"])):
+        return None
+    df = pd.concat([meta, pd.DataFrame(values, columns=info["dates"], index=meta.index)], axis=1)
+    return df[info["columns"]]
+
+
+# function to parse a JHU US time series with only the columns the cubes use: the counts as 32 bit integers and the
+# labels as categories
+def read_csv(path, engine=None):
+    engine = engine or CSV_ENGINE
+    with open(path, newline="") as f:
+        columns = next(csv.reader(f))
+    usecols = [col for col in columns if col in CUBE_COLUMNS or col not in META_COLUMNS]
+    date_cols = [col for col in usecols if col not in META_COLUMNS]
+    dtype = {col: "category" for col in LABEL_COLUMNS}
+    try:
+        df = pd.read_csv(path, usecols=usecols, engine=engine,
+                         dtype=dict(dtype, **dict.fromkeys(date_cols, COUNT_DTYPE)))
+    except ValueError:
+        # missing counts cannot be read as integers, they are read as floats and counted as 0
+        df = pd.read_csv(path, usecols=usecols, engine=engine, dtype=dtype)
+        df[date_cols] = df[date_cols].fillna(0).astype(COUNT_DTYPE)
+    for col in LABEL_COLUMNS:
+        # the Arrow reader reads missing labels as empty strings
+        if col in df.columns and "" in df[col].cat.categories:
+            df[col] = df[col].cat.remove_categories([""])
+    return df
+
+
+# function to parse a JHU global time series: the labels as categories and the counts as 32 bit integers, without
+# the coordinates
+def read_global_csv(path, engine=None):
+    engine = engine or CSV_ENGINE
+    with open(path, newline="") as f:
+        columns = next(csv.reader(f))
+    usecols = [col for col in columns if col in GLOBAL_LABEL_COLUMNS or col not in GLOBAL_META_COLUMNS]
+    date_cols = [col for col in usecols if col not in GLOBAL_META_COLUMNS]
+    dtype = {col: "category" for col in GLOBAL_LABEL_COLUMNS}
+    try:
+        return pd.read_csv(path, usecols=usecols, engine=engine,
+                           dtype=dict(dtype, **dict.fromkeys(date_cols, COUNT_DTYPE)))
+    except ValueError:
+        df = pd.read_csv(path, usecols=usecols, engine=engine, dtype=dtype)
+        df[date_cols] = df[date_cols].fillna(0).astype(COUNT_DTYPE)
+        return df
+
+
+# function to get the parse function of a time series file
+def parser_for(filename):
+    return read_global_csv if filename.endswith("_global.csv") else read_csv
+
+
+# function to get a csv file from a local directory, returns its path, its cache info and the validator of its
+# snapshot
+def fetch_local(filename, source, paths):
+    path = os.path.join(source, filename)
+    stat = os.stat(path)
+    return path, read_info(paths), "{}-{}".format(stat.st_mtime_ns, stat.st_size)
+
+
+# function to download a csv file, sending the cached ETag / Last-Modified so that an unchanged file is
+# answered with a 304 and read from the snapshot
+def fetch_remote(filename, source, paths):
+    info = read_info(paths)
+    have_csv = os.path.exists(paths["csv"])
+    request = urllib.request.Request(source.rstrip("/") + "/" + filename)
+    if have_csv and info.get("etag"):
+        request.add_header("If-None-Match", info["etag"])
+    if have_csv and info.get("last_modified"):
+        request.add_header("If-Modified-Since", info["last_modified"])
+    try:
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            write_atomic(paths["csv"], lambda f: f.write(response.read()))
+            info = dict(info, etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"))
+            info["version"] = info.get("version", 0) + 1
+            write_info(paths, info)
+    except urllib.error.HTTPError as error:
+        if error.code != 304 or not have_csv:
+            raise
+    except (urllib.error.URLError, OSError):
+        # offline: fall back to the last download
+        if not have_csv:
+            raise
+    return paths["csv"], info, "download-{}".format(info.get("version", 0))
+
+
+# function to parse a csv file and save its snapshot, it runs in a parse process when the frame is not returned
+def parse_snapshot(filename, path, paths, info, validator, return_frame=True):
+    df = parser_for(filename)(path)
+    write_snapshot(df, paths, info, validator)
+    return df if return_frame else None
+
+
+# function to load one time series file from the configured source through the local cache: fetch it, then read
+# its snapshot or parse it (in `parse_pool` when given) only when it changed. Returns the frame and the seconds of
+# every step, a failure is returned as the error instead of raised
+def load_dataset(filename, source=None, cache_dir=None, parse_pool=None):
+    source = source or DATA_SOURCE
+    if source.startswith("file://"):
+        source = source[len("file://"):]
+    result = SimpleNamespace(filename=filename, frame=None, error=None, fetch_seconds=None, parse_seconds=None,
+                             seconds=None)
+    start = time.perf_counter()
+    try:
+        paths = cache_paths(filename, cache_dir)
+        os.makedirs(os.path.dirname(paths["csv"]), exist_ok=True)
+        # a source without a url scheme is a local directory
+        if "://" not in source and not os.path.isdir(source):
+            raise FileNotFoundError(errno.ENOENT, "Data source directory not found", source)
+        fetch = fetch_local if os.path.isdir(source) else fetch_remote
+        path, info, validator = fetch(filename, source, paths)
+        result.fetch_seconds = time.perf_counter() - start
+        result.frame = read_snapshot(paths, info, validator)
+        if result.frame is None:
+            parse_start = time.perf_counter()
+            if parse_pool is None:
+                result.frame = parse_snapshot(filename, path, paths, info, validator)
+            else:
+                # the parse process writes the snapshot, which is cheaper to read back than the pickled frame
+                parse_pool.submit(parse_snapshot, filename, path, paths, info, validator, False).result()
+                result.frame = read_snapshot(paths, read_info(paths), validator)
+            result.parse_seconds = time.perf_counter() - parse_start
+    except Exception as error:
+        result.error = error
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+# function to load one time series file from the configured source through the local cache
+def load_time_series(filename, source=None, cache_dir=None):
+    result = load_dataset(filename, source, cache_dir)
+    if result.error is not None:
+        raise result.error
+    return result.frame
+
+
+# function to load several time series files at once: one thread per file fetches it (or checks the local file)
+# and up to PARSE_PROCESSES processes parse the files that changed, so that loading them costs about as much as
+# the slowest one. A failed file does not stop the others, returns {filename: result of load_dataset}
+def load_datasets(filenames, source=None, cache_dir=None):
+    parse_pool = None
+    if PARSE_PROCESSES > 1 and len(filenames) > 1:
+        # the pool only starts its processes for the first file to parse. A fork server forks them from a process
+        # that imported this module once, without the threads of the server
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["datasource"])
+        parse_pool = ProcessPoolExecutor(min(PARSE_PROCESSES, len(filenames)), mp_context=context)
+    try:
+        with ThreadPoolExecutor(len(filenames), thread_name_prefix="covid-load") as threads:
+            results = list(threads.map(lambda filename: load_dataset(filename, source, cache_dir, parse_pool),
+                                       filenames))
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+    return dict(zip(filenames, results))
+
+
+# function to get the frames of datasets that are all required, raising the error of the first one that failed
+def required_frames(results):
+    for result in results.values():
+        if result.error is not None:
+            raise result.error
+    return [result.frame for result in results.values()]
+
+
+# function to get the version of the last loaded snapshot of a csv file, it changes whenever the source file does
+def snapshot_version(filename, cache_dir=None):
+    return read_info(cache_paths(filename, cache_dir)).get("snapshot")
+
+
+# function to get the resident memory of this process in bytes
+def resident_memory():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # peak instead of current resident memory where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# parse time, frame memory and resident memory of the lean ingest (or of a default pd.read_csv with --default)
+# for both csv files of a local directory, e.g. the data cache. Run once per mode as the memory is per process
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("source", nargs="?", default=DATA_SOURCE if os.path.isdir(DATA_SOURCE) else CACHE_DIR)
+    args.add_argument("--engine", default=CSV_ENGINE)
+    args.add_argument("--default", action="store_true", help="parse with the default pd.read_csv settings")
+    args = args.parse_args()
+    frames = []
+    print("resident memory before parsing: {:.1f} MB".format(resident_memory() / 2 ** 20))
+    for filename in [DEATHS_FILE, CONFIRMED_FILE]:
+        path = os.path.join(args.source, filename)
+        start = time.perf_counter()
+        df = pd.read_csv(path, engine=args.engine) if args.default else read_csv(path, args.engine)
+        print("{}: parsed in {:.2f} s, frame {:.1f} MB".format(filename, time.perf_counter() - start,
+                                                             df.memory_usage(deep=True).sum() / 2 ** 20))
+        frames.append(df)
+    print("resident memory with the frames: {:.1f} MB".format(resident_memory() / 2 ** 20))
+    # the dashboard keeps the cubes only
+    cubes = [CountyCube(df) for df in frames]
+    del df, frames
+    print("resident memory with the cubes: {:.1f} MB, cube arrays {:.1f} MB".format(
+        resident_memory() / 2 ** 20, sum(cube.values.nbytes + cube.county_values.nbytes for cube in cubes) / 2 ** 20))
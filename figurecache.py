@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+import plotly.io as pio
+
+from datasource import CACHE_DIR, write_atomic
+
+# COVID_FIGURE_CACHE_DIR: directory of the on-disk figure store shared by all workers
+# COVID_FIGURE_CACHE_SIZE: number of figures kept in memory by each worker
+FIGURE_CACHE_DIR = os.environ.get("COVID_FIGURE_CACHE_DIR", os.path.join(CACHE_DIR, "figures"))
+FIGURE_CACHE_SIZE = int(os.environ.get("COVID_FIGURE_CACHE_SIZE", "256"))
+# number of data versions kept on disk
+KEEP_VERSIONS = 2
+
+
+# Figures keyed by (data version, state, metric, daily/cumulative). Figures are kept as plain dicts in an
+# in-process LRU backed by one JSON file per figure under <directory>/<data version>/, so a figure rendered
+# by one worker is served by every other worker without pandas or plotly work. variant names an encoding of the
+# figures (e.g. the compact figures), it is part of the file names so that encodings never mix on disk
+class FigureCache:
+    def __init__(self, directory=FIGURE_CACHE_DIR, maxsize=FIGURE_CACHE_SIZE, variant=""):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.suffix = "." + variant if variant else ""
+        self.figures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        version, state, metric, kind = key
+        return os.path.join(self.directory, version, "{}-{}-{}{}.json".format(metric, kind, quote(str(state), safe=""),
+                                                                              self.suffix))
+
+    # function to get a cached figure, build() is only called when neither the memory nor the disk has it.
+    # build() returns a plotly figure or a figure dict
+    def get(self, key, build):
+        with self.lock:
+            figure = self.figures.get(key)
+            if figure is not None:
+                self.figures.move_to_end(key)
+                return figure
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                figure = json.load(f)
+        except (OSError, ValueError):
+            text = pio.to_json(build(), validate=False)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, lambda f: f.write(text.encode()))
+            figure = json.loads(text)
+        self.put(key, figure)
+        return figure
+
+    def put(self, key, figure):
+        with self.lock:
+            self.figures[key] = figure
+            self.figures.move_to_end(key)
+            while len(self.figures) > self.maxsize:
+                self.figures.popitem(last=False)
+
+    # function to delete the figures of old data versions from memory and disk
+    def prune(self, version):
+        with self.lock:
+            for key in [key for key in self.figures if key[0] != version]:
+                del self.figures[key]
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.is_dir()]
+        except OSError:
+            return
+        entries.sort(key=lambda entry: (entry.name == version, entry.stat().st_mtime), reverse=True)
+        for entry in entries[KEEP_VERSIONS:]:
+            shutil.rmtree(entry.path, ignore_errors=True)
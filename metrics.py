@@ -0,0 +1,132 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from flask import Response, g, has_request_context, request
+
+# COVID_METRICS=1 times every callback request and the stages of the callbacks, data loads and refreshes. The times
+# are served as Prometheus histograms on /metrics (per process, every gunicorn worker has its own) and sent as
+# Server-Timing headers. When it is off stage() and timed() do nothing and no request hooks are installed
+METRICS = os.environ.get("COVID_METRICS", "0") == "1"
+# upper bounds of the histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+NULL_STAGE = nullcontext()
+
+
+# Prometheus histogram with one label, kept in memory
+class Histogram:
+    def __init__(self, name, documentation, label):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        # label value -> [count of every bucket, count above the last bucket, sum]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, label_value):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(BUCKETS) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    # function to render the histogram in the Prometheus text format
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} histogram".format(self.name)]
+        with self.lock:
+            series = {value: list(counts) for value, counts in self.series.items()}
+        for value, counts in sorted(series.items()):
+            label = '{}="{}"'.format(self.label, escape(value))
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, label, bound, cumulative))
+            lines.append("{}_sum{{{}}} {}".format(self.name, label, counts[-1]))
+            lines.append("{}_count{{{}}} {}".format(self.name, label, cumulative))
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+callback_seconds = Histogram("covid_callback_seconds", "Time to answer a dash callback request, by its first output",
+                             "callback")
+stage_seconds = Histogram("covid_stage_seconds", "Time spent in a stage of a callback, a data load or a refresh",
+                          "stage")
+
+
+@contextmanager
+def timed_stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stage_seconds.observe(seconds, name)
+        if has_request_context():
+            g.setdefault("stages", []).append((name, seconds))
+
+
+# function to time a stage: `with stage("figure"): ...`
+def stage(name):
+    if not METRICS:
+        return NULL_STAGE
+    return timed_stage(name)
+
+
+# function to record the seconds of a stage timed elsewhere, e.g. in another thread
+def observe_stage(name, seconds):
+    if METRICS:
+        stage_seconds.observe(seconds, name)
+
+
+# decorator timing a callback function as its "callback" stage, the rest of a callback request (reading the inputs
+# and serializing the outputs) is reported as its "serialize" stage
+def timed(function):
+    if not METRICS:
+        return function
+
+    @functools.wraps(function)
+    def timed_function(*args, **kwargs):
+        with timed_stage("callback"):
+            return function(*args, **kwargs)
+
+    return timed_function
+
+
+# function to add the request timing hooks and the /metrics route to a Flask server
+def instrument(server):
+    if not METRICS:
+        return
+
+    @server.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @server.after_request
+    def add_timings(response):
+        start = g.get("request_start")
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        stages = g.get("stages", [])
+        if request.path.endswith("/_dash-update-component"):
+            output = (request.get_json(silent=True) or {}).get("output", "")
+            callback_seconds.observe(total, output.strip(".").split("...")[0])
+            stages = stages + [("serialize", total - sum(seconds for name, seconds in stages if name == "callback"))]
+        # repeated stages (e.g. the figures of both tabs) are summed
+        durations = {}
+        for name, seconds in stages + [("total", total)]:
+            durations[name] = durations.get(name, 0) + seconds
+        response.headers["Server-Timing"] = ", ".join("{};dur={:.2f}".format(name, seconds * 1000)
+                                                      for name, seconds in durations.items())
+        return response
+
+    server.add_url_rule("/metrics", "metrics", lambda: Response(
+        callback_seconds.render() + stage_seconds.render(), mimetype="text/plain; version=0.0.4"))
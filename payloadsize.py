@@ -0,0 +1,88 @@
+import gzip
+import importlib.util
+import json
+import os
+
+DASHBOARD_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "covid-19_dashboard.py")
+# state selected by the measured requests
+STATE = "Texas"
+# values of the callback inputs in the measured requests
+SAMPLE_INPUTS = {"states_and_territories.value": STATE, "territories.value": STATE, "chloro_graph.clickData": None,
+                 "compare_series.value": ["state|" + STATE, "state|Florida", "state|New York"],
+                 "compare_series.search_value": "county 1", "timelapse_request.data": True,
+                 "leaderboard_kind.value": "confirmed", "leaderboard_metric.value": "total",
+                 "leaderboard_order.value": "top", "leaderboard_scope.value": "state", "leaderboard_size.value": 10}
+TABS = ["tab-1", "tab-2"]
+
+
+# function to load a fresh copy of the dashboard with the given environment, without the background refresh and
+# warmup, once its data is loaded
+def load_dashboard(name, env):
+    os.environ.update(env, COVID_REFRESH_INTERVAL="0", COVID_FIGURE_WARMUP="0")
+    spec = importlib.util.spec_from_file_location(name, DASHBOARD_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.wait_for_data()
+    return module
+
+
+def response_sizes(response):
+    body = response.get_data()
+    raw = gzip.decompress(body) if response.headers.get("Content-Encoding") == "gzip" else body
+    return len(raw), len(body)
+
+
+# function to get a sample request of every server callback of a dashboard as (label, request body), callbacks
+# with a tab input get one request per tab
+def callback_requests(client):
+    requests = []
+    for dependency in client.get("/_dash-dependencies").get_json():
+        if dependency.get("clientside_function"):
+            continue
+        output = dependency["output"]
+        outputs = [dict(zip(("id", "property"), item.rsplit(".", 1))) for item in output.strip(".").split("...")]
+        inputs = dependency["inputs"]
+        tab_inputs = [item for item in inputs if item["id"].endswith("tabs")]
+        label = "{id}.{property}".format(**outputs[0]) + (" (+{})".format(len(outputs) - 1) if len(outputs) > 1 else "")
+        for tab in TABS if tab_inputs else [None]:
+            body = {"output": output, "outputs": outputs if output.startswith("..") else outputs[0],
+                    "inputs": [dict(item, value=tab if item in tab_inputs else
+                                    SAMPLE_INPUTS.get("{id}.{property}".format(**item)))
+                               for item in inputs],
+                    "state": [dict(item, value=SAMPLE_INPUTS.get("{id}.{property}".format(**item)))
+                              for item in dependency.get("state", [])],
+                    "changedPropIds": ["{id}.{property}".format(**inputs[-1])]}
+            requests.append((label + (" [{}]".format(tab) if tab else ""), body))
+    return requests
+
+
+# function to post a callback request
+def post_callback(client, body, headers=None):
+    return client.post("/_dash-update-component", data=json.dumps(body), content_type="application/json",
+                       headers=headers)
+
+
+# function to get the (raw, sent) bytes of the layout and of every server callback of a dashboard, keyed by the
+# callback outputs
+def measure(module):
+    client = module.server.test_client()
+    headers = {"Accept-Encoding": "gzip"}
+    sizes = {"layout": response_sizes(client.get("/_dash-layout", headers=headers))}
+    for label, body in callback_requests(client):
+        sizes[label] = response_sizes(post_callback(client, body, headers))
+    return sizes
+
+
+# response bytes of the layout and of every callback with the plain figures (before) and the compact figures (after).
+# "sent" is the size on the wire, gzip is only enabled with the compact figures
+if __name__ == "__main__":
+    before = measure(load_dashboard("dashboard_plain", {"COVID_COMPACT_FIGURES": "0"}))
+    after = measure(load_dashboard("dashboard_compact", {"COVID_COMPACT_FIGURES": "1"}))
+    width = max(len(label) for label in before)
+    print("{:<{}} {:>12} {:>12} {:>12} {:>8}".format("response", width, "before", "after", "after sent", "ratio"))
+    for label, (raw, sent) in before.items():
+        if label not in after:
+            continue
+        compact_raw, compact_sent = after[label]
+        print("{:<{}} {:>12,} {:>12,} {:>12,} {:>7.1f}x".format(label, width, sent, compact_raw, compact_sent,
+                                                                 sent / max(compact_sent, 1)))
@@ -0,0 +1,182 @@
+import argparse
+import cProfile
+import hashlib
+import hmac
+import os
+import pstats
+import re
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, request
+
+from datasource import CACHE_DIR
+
+# COVID_PROFILE=1 profiles every callback request. With COVID_PROFILE_SECRET set only requests carrying a token
+# signed with it are profiled: ?profile=<token> on the page (kept in a cookie for the callbacks of the page) or on
+# a callback request. `python profiler.py sign` prints a token.
+# Requests slower than COVID_PROFILE_THRESHOLD seconds leave a .pstats file and a .collapsed file (one
+# "frame;frame;frame microseconds" line per stack, for flamegraph.pl or speedscope) in COVID_PROFILE_DIR, of which
+# the newest COVID_PROFILE_KEEP traces are kept
+PROFILE = os.environ.get("COVID_PROFILE", "0") == "1"
+PROFILE_SECRET = os.environ.get("COVID_PROFILE_SECRET", "")
+PROFILE_THRESHOLD = float(os.environ.get("COVID_PROFILE_THRESHOLD", "0.5"))
+PROFILE_DIR = os.environ.get("COVID_PROFILE_DIR", os.path.join(CACHE_DIR, "profiles"))
+PROFILE_KEEP = int(os.environ.get("COVID_PROFILE_KEEP", "50"))
+COOKIE = "covid_profile"
+# stacks below this share of the request time are left out of the collapsed stacks
+MIN_STACK_SHARE = 0.001
+
+# one request is profiled at a time, the others run unprofiled
+profile_lock = threading.Lock()
+
+
+# function to sign a profiling token valid until `expires` (unix time)
+def sign(expires, secret=None):
+    secret = (secret or PROFILE_SECRET).encode()
+    return "{}.{}".format(int(expires), hmac.new(secret, str(int(expires)).encode(), hashlib.sha256).hexdigest())
+
+
+def valid_token(token):
+    expires, _, _ = token.partition(".")
+    if not PROFILE_SECRET or not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(token, sign(expires))
+
+
+# function to tell whether the current request asks to be profiled
+def requested():
+    if PROFILE:
+        return True
+    token = request.args.get("profile") or request.cookies.get(COOKIE)
+    return bool(token) and valid_token(token)
+
+
+def frame_name(function):
+    filename, line, name = function
+    if filename == "~":
+        return name.replace(";", ":")
+    return "{} ({}:{})".format(name, os.path.basename(filename), line).replace(";", ":")
+
+
+# function to turn the call graph of a profile into collapsed stacks. cProfile only records caller -> callee
+# edges, so the time of a function called from several places is split between its callers by their share of it
+def collapsed_stacks(stats):
+    entries = stats.stats
+    children = defaultdict(list)
+    for function, (_, _, _, _, callers) in entries.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            children[caller].append((function, cumulative))
+    total = sum(entry[3] for entry in entries.values() if not entry[4])
+    stacks = defaultdict(float)
+
+    def walk(function, stack, seconds):
+        _, _, own, cumulative, _ = entries[function]
+        stack = stack + (frame_name(function),)
+        scale = seconds / cumulative if cumulative else 0
+        stacks[stack] += own * scale
+        for child, child_seconds in children[function]:
+            if child_seconds * scale >= total * MIN_STACK_SHARE and frame_name(child) not in stack:
+                walk(child, stack, child_seconds * scale)
+
+    for function, entry in entries.items():
+        if not entry[4]:
+            walk(function, (), entry[3])
+    return ["{} {}\n".format(";".join(stack), round(seconds * 1e6)) for stack, seconds in stacks.items()
+            if round(seconds * 1e6)]
+
+
+# function to delete all but the newest PROFILE_KEEP traces
+def rotate(directory=PROFILE_DIR, keep=PROFILE_KEEP):
+    traces = sorted((entry for entry in os.scandir(directory) if entry.name.endswith(".pstats")),
+                    key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in traces[keep:]:
+        for path in (entry.path, entry.path[:-len(".pstats")] + ".collapsed"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def write_trace(profile, seconds, label):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, "{}-{}-{:.0f}ms-{}".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid(),
+                                                                 seconds * 1000, re.sub(r"[^\w.-]+", "_", label)))
+    stats = pstats.Stats(profile)
+    stats.dump_stats(stem + ".pstats")
+    with open(stem + ".collapsed", "w") as f:
+        f.writelines(collapsed_stacks(stats))
+    rotate()
+
+
+# function to name a callback request by its first output and its short string inputs, e.g.
+# "state_confirmed.figure-tab-1-Texas"
+def request_label():
+    body = request.get_json(silent=True) or {}
+    inputs = [item.get("value") for item in body.get("inputs", []) if isinstance(item, dict)]
+    return "-".join([body.get("output", "").strip(".").split("...")[0]] +
+                    [value for value in inputs if isinstance(value, str) and len(value) <= 30])
+
+
+# function to add the profiling hooks to a Flask server
+def instrument(server):
+    if not PROFILE and not PROFILE_SECRET:
+        return
+
+    @server.before_request
+    def start_profile():
+        if not request.path.endswith("/_dash-update-component") or not requested():
+            return
+        if not profile_lock.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active in this process
+            profile_lock.release()
+            return
+        g.profile = (profile, time.perf_counter())
+
+    # function to stop the profile of the request, returns the profile, its seconds and the request label when it
+    # took long enough to be written
+    def finish_profile():
+        started = g.pop("profile", None)
+        if started is None:
+            return None
+        profile, start = started
+        profile.disable()
+        seconds = time.perf_counter() - start
+        profile_lock.release()
+        return (profile, seconds, request_label()) if seconds >= PROFILE_THRESHOLD else None
+
+    # the trace is written once the response body has been sent, not while the client waits for it
+    @server.after_request
+    def keep_token(response):
+        token = request.args.get("profile")
+        if token and valid_token(token):
+            response.set_cookie(COOKIE, token, max_age=max(0, int(token.partition(".")[0]) - int(time.time())),
+                                httponly=True, samesite="Strict")
+        finished = finish_profile()
+        if finished is not None:
+            response.call_on_close(lambda: write_trace(*finished))
+        return response
+
+    # a request that failed before its response still stops its profile
+    @server.teardown_request
+    def stop_profile(error=None):
+        finished = finish_profile()
+        if finished is not None:
+            write_trace(*finished)
+
+
+# `python profiler.py sign [--minutes N]` prints a token for ?profile= signed with COVID_PROFILE_SECRET
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("command", choices=["sign"])
+    args.add_argument("--minutes", type=float, default=60, help="minutes until the token expires")
+    args = args.parse_args()
+    if not PROFILE_SECRET:
+        raise SystemExit("COVID_PROFILE_SECRET is not set")
+    print(sign(time.time() + args.minutes * 60))
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import zlib
+
+from datacube import CountyCube
+from datasource import CONFIRMED_FILE, DEATHS_FILE, load_datasets, required_frames, snapshot_version, write_atomic
+
+# Shared data store: the county x date cubes of both time series saved as .npy files under
+# <root>/<version>/<name>/, with <root>/CURRENT naming the latest version. Every gunicorn worker maps the
+# same files read-only, so N workers share one physical copy of the data instead of loading N copies.
+# With COVID_SHARED_DATA_DIR set the first worker to load its data writes the store while the others wait for it,
+# `python sharedstore.py` writes it ahead of time as a separate prep step.
+SHARED_DATA_DIR = os.environ.get("COVID_SHARED_DATA_DIR")
+# number of store versions kept on disk, older ones are deleted after a new version is written
+KEEP_VERSIONS = 2
+
+
+# function to get the version the store currently points to, None for an empty store
+def store_version(root):
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+# function to write a new store version and point CURRENT at it
+def write_store(root, version, cubes):
+    os.makedirs(root, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=root, prefix=".tmp-")
+    try:
+        for name, cube in cubes.items():
+            cube.save(os.path.join(tmp, name))
+        os.rename(tmp, os.path.join(root, version))
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # another process wrote the same version first
+        if not os.path.isdir(os.path.join(root, version)):
+            raise
+    write_atomic(os.path.join(root, "CURRENT"), lambda f: f.write(version.encode()))
+    # mapped files of removed versions stay readable by the workers still using them
+    versions = sorted((entry for entry in os.scandir(root) if entry.is_dir() and not entry.name.startswith(".")),
+                      key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[KEEP_VERSIONS:]:
+        if entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+# function to bring the store up to date with the data source, only one process at a time does the work;
+# with wait=False a process that finds another one updating the store returns right away
+def prepare_store(root, wait=True):
+    import fcntl
+
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return store_version(root)
+        US_covid_deaths, US_confirmed_cases = required_frames(load_datasets([DEATHS_FILE, CONFIRMED_FILE]))
+        sources = "{} {}".format(snapshot_version(DEATHS_FILE), snapshot_version(CONFIRMED_FILE))
+        version = "{:08x}".format(zlib.crc32(sources.encode()))
+        previous = store_version(root)
+        if previous != version:
+            write_store(root, version, build_cubes(root, previous, {"deaths": US_covid_deaths,
+                                                                    "confirmed": US_confirmed_cases}))
+    return version
+
+
+# function to build the cubes of a new store version: frames that only gained new dates since the previous version
+# extend its cubes (only the new columns are read and summed), anything else is built from scratch
+def build_cubes(root, previous, frames):
+    cubes = {}
+    for name, df in frames.items():
+        cube = None
+        if previous is not None:
+            try:
+                cube = CountyCube.load(os.path.join(root, previous, name)).extend(df)
+            except OSError:
+                cube = None
+        cubes[name] = cube if cube is not None else CountyCube(df)
+    return cubes
+
+
+# function to map the current store, returns the deaths and confirmed cubes and the store version
+def open_store(root):
+    version = store_version(root) or prepare_store(root)
+    directory = os.path.join(root, version)
+    return CountyCube.load(os.path.join(directory, "deaths")), CountyCube.load(
+        os.path.join(directory, "confirmed")), version
+
+
+if __name__ == "__main__":
+    print(prepare_store(SHARED_DATA_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data_store")))
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import plotly
+from plotly.utils import PlotlyJSONEncoder
+
+from datasource import write_atomic
+
+# COVID_STATIC_EXPORT_DIR: directory the dashboard writes its static export to after every data load and refresh
+# (see export_static in covid-19_dashboard.py), empty to export nothing. The export is the page of staticshell/
+# and the pre-rendered data of the dashboard as json, it can be served from any static host or CDN: the json of a
+# data version never changes under data/<version>/, only latest.json points to the newest one
+STATIC_EXPORT_DIR = os.environ.get("COVID_STATIC_EXPORT_DIR", "")
+SHELL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "staticshell")
+# client side callbacks of the dashboard the page runs as well
+SHELL_ASSETS = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "tabs.js")]
+PLOTLY_JS = os.path.join(os.path.dirname(plotly.__file__), "package_data", "plotly.min.js")
+# number of data versions kept in an export, a page opened before a refresh still finds the files of its version
+KEEP_VERSIONS = 2
+
+
+# function to get the file name of the data of a state
+def state_file(state):
+    return "states/{}.json".format(re.sub("[^a-z0-9]+", "-", state.lower()).strip("-"))
+
+
+def write_json(path, value):
+    text = json.dumps(value, cls=PlotlyJSONEncoder, separators=(",", ":")).encode()
+    write_atomic(path, lambda f: f.write(text))
+
+
+# function to copy a file of the page into the export when it is missing there or its size or modification time
+# changed, so that an export after every refresh does not rewrite plotly.min.js (several MB) each time
+def copy_changed(path, target):
+    stat = os.stat(path)
+    try:
+        copied = os.stat(target)
+        if copied.st_size == stat.st_size and copied.st_mtime_ns == stat.st_mtime_ns:
+            return
+    except FileNotFoundError:
+        pass
+    with open(path, "rb") as f:
+        content = f.read()
+    write_atomic(target, lambda f: f.write(content))
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+# function to write the export of a data version into a directory: national is the json of the national part of the
+# dashboard, states maps the name of every state to the json of its part. The page and its scripts are copied, the
+# data of the version is written once (a version already exported is kept) and latest.json is written last
+def write_export(directory, version, national, states):
+    data_dir = os.path.join(directory, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    if not os.path.exists(os.path.join(data_dir, version)):
+        tmp = tempfile.mkdtemp(dir=data_dir, prefix=".tmp-")
+        try:
+            os.makedirs(os.path.join(tmp, "states"))
+            files = {}
+            for state, value in states.items():
+                files[state] = state_file(state)
+                write_json(os.path.join(tmp, files[state]), value)
+            write_json(os.path.join(tmp, "national.json"), dict(national, version=version, states=files))
+            os.rename(tmp, os.path.join(data_dir, version))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(os.path.join(data_dir, version)):
+                raise
+    for path in [os.path.join(SHELL_DIR, name) for name in sorted(os.listdir(SHELL_DIR))] + SHELL_ASSETS + \
+            [PLOTLY_JS]:
+        copy_changed(path, os.path.join(directory, os.path.basename(path)))
+    write_json(os.path.join(directory, "latest.json"), {"version": version, "path": "data/{}/".format(version)})
+    versions = sorted((entry for entry in os.scandir(data_dir) if entry.is_dir() and not entry.name.startswith(".")),
+                      key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[KEEP_VERSIONS:]:
+        if entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+    return os.path.join(data_dir, version)
+
+
+# `python staticexport.py <directory>` loads the data once and exports the dashboard into the directory
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(prog="python staticexport.py")
+    args.add_argument("directory", nargs="?", default=STATIC_EXPORT_DIR or "static_export")
+    args = args.parse_args()
+
+    from payloadsize import load_dashboard
+
+    module = load_dashboard("static_dashboard", {"COVID_STATIC_EXPORT_DIR": ""})
+    print("exported {} into {}".format(module.data.version, module.export_static(module.data, args.directory)))
@@ -0,0 +1,91 @@
+// static page of the dashboard (see staticexport.py): the callbacks of the dashboard run here in the browser on the
+// exported json. The tabs pick their figure with the client side callback of assets/tabs.js, a state selection
+// (from the map or the list) loads the json of that state once
+(function () {
+    window.dash_clientside = Object.assign({no_update: {}}, window.dash_clientside);
+    var DEFAULT_STATE = "Florida";
+    var base = null;
+    var national = null;
+    var stateData = {};
+    // figures of both tabs and the selected tab of every graph
+    var graphs = {};
+
+    function fetchJson(path, options) {
+        return fetch(path, options).then(function (response) {
+            if (!response.ok) {
+                throw new Error(path + ": " + response.status);
+            }
+            return response.json();
+        });
+    }
+
+    function showTexts(texts) {
+        Object.keys(texts).forEach(function (id) {
+            var element = document.getElementById(id);
+            if (element) {
+                element.textContent = texts[id];
+            }
+        });
+    }
+
+    function render(id) {
+        var graph = graphs[id];
+        var figure = window.dash_clientside.tabs.select_figure(graph.tab, graph.figures, null, null);
+        if (figure !== window.dash_clientside.no_update) {
+            Plotly.react(id, figure.data, figure.layout, {responsive: true});
+        }
+        document.querySelectorAll(".tabs[data-graph='" + id + "'] button").forEach(function (button) {
+            button.classList.toggle("selected", button.value === graph.tab);
+        });
+    }
+
+    function setFigures(id, figures) {
+        graphs[id] = {tab: graphs[id] ? graphs[id].tab : "tab-1", figures: figures};
+        render(id);
+    }
+
+    function selectState(state) {
+        if (!national.states[state]) {
+            return;
+        }
+        var loaded = stateData[state] || fetchJson(base + national.states[state]);
+        stateData[state] = loaded;
+        loaded.then(function (value) {
+            showTexts(value.summary);
+            setFigures("state_confirmed", value.confirmed);
+            setFigures("state_death", value.deaths);
+        });
+    }
+
+    document.querySelectorAll(".tabs button").forEach(function (button) {
+        button.addEventListener("click", function () {
+            var id = button.parentNode.getAttribute("data-graph");
+            if (graphs[id]) {
+                graphs[id].tab = button.value;
+                render(id);
+            }
+        });
+    });
+
+    fetchJson("latest.json", {cache: "no-store"}).then(function (latest) {
+        base = latest.path;
+        return fetchJson(base + "national.json");
+    }).then(function (value) {
+        national = value;
+        showTexts(national.summary);
+        setFigures("confirmed_cases", national.confirmed);
+        setFigures("deaths", national.deaths);
+        Plotly.react("chloro_graph", national.map.data, national.map.layout, {responsive: true});
+        document.getElementById("chloro_graph").on("plotly_click", function (event) {
+            selectState(national.abbr[event.points[0].location] || event.points[0].location);
+        });
+        var select = document.getElementById("territories");
+        Object.keys(national.states).forEach(function (state) {
+            select.add(new Option(state, state));
+        });
+        select.addEventListener("change", function () {
+            selectState(select.value);
+        });
+        selectState(DEFAULT_STATE);
+    });
+})();